@@ -0,0 +1,9 @@
+"""
+Исполнение сгенерированных диалогов для игровых сессий
+
+Зависит только от app.schemas: не требует настроек и LLM-клиентов.
+"""
+from .engine import END, DialogStateMachine, DialogRuntime
+
+
+__all__ = ['END', 'DialogStateMachine', 'DialogRuntime']
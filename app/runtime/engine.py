@@ -0,0 +1,142 @@
+"""
+Неизменяемый конечный автомат диалога и хранилище игровых сессий
+"""
+from array import array
+from typing import List, Optional, Tuple, Union
+
+from app.schemas import ContentGenerationResponse, DialogTree
+
+END = -1  # состояние завершённого диалога (выбор ведёт в отсутствующую ноду)
+
+
+class DialogStateMachine:
+    """Скомпилированное дерево: ноды - целые индексы, переходы - кортежи индексов по Choice.next_node_id"""
+    __slots__ = ("node_ids", "npc_texts", "choice_texts", "transitions", "root", "_index")
+
+    def __init__(
+        self,
+        node_ids: Tuple[str, ...],
+        npc_texts: Tuple[str, ...],
+        choice_texts: Tuple[Tuple[str, ...], ...],
+        transitions: Tuple[Tuple[int, ...], ...],
+        root: int
+    ):
+        self.node_ids = node_ids
+        self.npc_texts = npc_texts
+        self.choice_texts = choice_texts
+        self.transitions = transitions
+        self.root = root
+        self._index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+    @classmethod
+    def compile(cls, tree: Union[DialogTree, ContentGenerationResponse]) -> "DialogStateMachine":
+        """Компилирует заполненное дерево; петли (loop) - обычные переходы к ранним нодам"""
+        if isinstance(tree, ContentGenerationResponse):
+            tree = tree.dialog_tree
+        if tree.root_node_id not in tree.nodes:
+            raise ValueError(f"Root node {tree.root_node_id} is not found in tree")
+
+        node_ids = tuple(tree.nodes)
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+        nodes = [tree.nodes[node_id] for node_id in node_ids]
+
+        return cls(
+            node_ids=node_ids,
+            npc_texts=tuple(node.npc_text or "" for node in nodes),
+            choice_texts=tuple(tuple(choice.text for choice in node.choices or ()) for node in nodes),
+            transitions=tuple(
+                tuple(index.get(choice.next_node_id, END) for choice in node.choices or ())
+                for node in nodes
+            ),
+            root=index[tree.root_node_id],
+        )
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "_index"):
+            raise AttributeError(f"{type(self).__name__} is immutable")
+        object.__setattr__(self, name, value)
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def index(self, node_id: str) -> int:
+        return self._index[node_id]
+
+    def step(self, node: int, choice_idx: int) -> int:
+        """Переход из ноды по номеру выбора за O(1)"""
+        if node == END:
+            raise ValueError("Dialog is already finished")
+        transitions = self.transitions[node]
+        if not 0 <= choice_idx < len(transitions):
+            raise IndexError(f"Node {self.node_ids[node]} has no choice {choice_idx}")
+        return transitions[choice_idx]
+
+    def is_terminal(self, node: int) -> bool:
+        """Диалог окончен: нода отсутствует или в ней нет вариантов выбора"""
+        return node == END or not self.transitions[node]
+
+
+class DialogRuntime:
+    """Сессии игроков поверх одного автомата: состояние сессии - индекс ноды и число ходов в массивах"""
+
+    def __init__(self, machine: DialogStateMachine):
+        self.machine = machine
+        self._nodes = array("i")
+        self._turns = array("I")
+        self._closed = bytearray()  # 1 - слот закрыт и ждет переиспользования
+        self._free: List[int] = []
+
+    def start(self, node_id: Optional[str] = None) -> int:
+        """Открывает сессию (с корня или с указанной ноды), возвращает её номер"""
+        node = self.machine.root if node_id is None else self.machine.index(node_id)
+        if self._free:
+            session = self._free.pop()
+            self._nodes[session] = node
+            self._turns[session] = 0
+            self._closed[session] = 0
+        else:
+            session = len(self._nodes)
+            self._nodes.append(node)
+            self._turns.append(0)
+            self._closed.append(0)
+        return session
+
+    def end(self, session: int) -> None:
+        """
+        Закрывает сессию; её слот переиспользуется следующей
+
+        :raises ValueError: если сессия не открыта или уже закрыта
+        """
+        if not 0 <= session < len(self._closed) or self._closed[session]:
+            raise ValueError(f"Session {session} is not active")
+        self._nodes[session] = END
+        self._closed[session] = 1
+        self._free.append(session)
+
+    def choose(self, session: int, choice_idx: int) -> int:
+        """Выбор игрока: переводит сессию в следующую ноду и возвращает её индекс"""
+        node = self.machine.step(self._nodes[session], choice_idx)
+        self._nodes[session] = node
+        self._turns[session] += 1
+        return node
+
+    def node(self, session: int) -> int:
+        return self._nodes[session]
+
+    def turns(self, session: int) -> int:
+        return self._turns[session]
+
+    def npc_text(self, session: int) -> str:
+        node = self._nodes[session]
+        return "" if node == END else self.machine.npc_texts[node]
+
+    def choices(self, session: int) -> Tuple[str, ...]:
+        node = self._nodes[session]
+        return () if node == END else self.machine.choice_texts[node]
+
+    def is_finished(self, session: int) -> bool:
+        return self.machine.is_terminal(self._nodes[session])
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._nodes) - len(self._free)
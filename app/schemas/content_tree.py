@@ -1,6 +1,7 @@
 """
 Модели данных для генерации контента в узлах дерева диалогов
 """
+import copy
 from typing import Optional, List, Dict
 from pydantic import Field
 
@@ -42,11 +43,39 @@ class DialogNode(DialogStructureNode):
             }
         }
 
+    @classmethod
+    def from_structure(
+        cls,
+        node: DialogStructureNode,
+        npc_text: Optional[str] = "",
+        choices: Optional[List[Choice]] = None
+    ) -> "DialogNode":
+        """Узел с контентом поверх провалидированной структуры (без повторной валидации, связи и метаданные копируются)"""
+        values = {name: node.__dict__[name] for name in DialogStructureNode.model_fields}
+        values["parent_node_ids"] = list(values["parent_node_ids"] or [])
+        values["child_node_ids"] = list(values["child_node_ids"] or [])
+        if values["metadata"] is not None:
+            values["metadata"] = values["metadata"].model_copy()
+        values["npc_text"] = npc_text
+        values["choices"] = choices if choices is not None else []
+        return cls._construct_trusted(values)
+
 
 class DialogTree(DialogBaseTree):
     """Диалоговое дерево после генерации его структуры"""
     nodes: Dict[str, DialogNode] = Field(..., description="Словарь узлов")
 
+    @classmethod
+    def from_structure(cls, tree: DialogStructureTree) -> "DialogTree":
+        """Незаполненное дерево без повторной валидации; изменения в нем не затрагивают исходное дерево"""
+        paths = tree.goal_achievement_paths
+        return cls._construct_trusted({
+            "root_node_id": tree.root_node_id,
+            "nodes": {node_id: DialogNode.from_structure(node) for node_id, node in tree.nodes.items()},
+            "goal_achievement_paths": [list(path) for path in paths] if paths is not None else None,
+            "metadata": copy.deepcopy(tree.metadata),
+        })
+
 
 class ContentGenerationRequest(GenerationBaseRequest):
     """Запрос на заполнение дерева"""
@@ -56,3 +85,8 @@ class ContentGenerationRequest(GenerationBaseRequest):
 class ContentGenerationResponse(GenerationBaseResponse):
     """Базовый класс для ответов после генерации"""
     dialog_tree: DialogTree = Field(..., description="Диалоговое дерево")
+    unfilled_node_ids: List[str] = Field(default_factory=list, description="Узлы, оставшиеся незаполненными (частичный результат)")
+
+    @property
+    def is_partial(self) -> bool:
+        return bool(self.unfilled_node_ids)
@@ -1,14 +1,89 @@
 """
 Базовая модель данных, поддерживающая преобразования в текстовый промпт
 """
-from typing import List, Dict, ClassVar
+import typing
+from typing import Any, List, Dict, ClassVar, Tuple
 from pydantic import BaseModel
-from pydantic.fields import FieldInfo
+
+
+# Виды значений поля, определяющие способ отрисовки (_ANY - тип известен только по значению)
+_ANY, _SCALAR, _MODEL, _LIST, _DICT = range(5)
+
+
+def _unwrap_optional(annotation: Any) -> Any:
+    """Снимаем Optional[...] с аннотации; для прочих Union возвращаем Any"""
+    if typing.get_origin(annotation) is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return args[0] if len(args) == 1 else Any
+    return annotation
+
+
+def _annotation_kind(annotation: Any) -> int:
+    """Вид значения по аннотации поля"""
+    annotation = _unwrap_optional(annotation)
+    origin = typing.get_origin(annotation) or annotation
+
+    if annotation is Any or not isinstance(origin, type):
+        return _ANY
+    if issubclass(origin, BaseModel):
+        return _MODEL
+    if issubclass(origin, list):
+        return _LIST
+    if issubclass(origin, dict):
+        return _DICT
+    return _SCALAR
+
+
+def _item_kind(annotation: Any) -> int:
+    """Вид элементов списка или значений словаря (модель либо скаляр)"""
+    args = typing.get_args(_unwrap_optional(annotation))
+    if not args:
+        return _ANY
+    kind = _annotation_kind(args[-1])
+    return kind if kind in (_MODEL, _ANY) else _SCALAR
+
+
+def _value_kind(value: Any) -> int:
+    """Вид значения по его типу (как в рефлексивной отрисовке)"""
+    if isinstance(value, BaseModel):
+        return _MODEL
+    if isinstance(value, list):
+        return _LIST
+    if isinstance(value, dict):
+        return _DICT
+    return _SCALAR
+
+
+class _RenderPlan:
+    """Скомпилированный план отрисовки класса: порядок полей, описания и виды значений"""
+    __slots__ = ("fields", "tab", "bullet", "_pads")
+
+    def __init__(self, model_cls: type):
+        self.tab: str = model_cls._TAB
+        self.bullet: str = model_cls._BULLET
+        self.fields: Tuple[Tuple[str, str, int, int], ...] = tuple(
+            (
+                field_name,
+                field_info.description or field_name.replace("_", " ").capitalize(),
+                _annotation_kind(field_info.annotation),
+                _item_kind(field_info.annotation),
+            )
+            for field_name, field_info in model_cls.model_fields.items()
+        )
+        self._pads: List[Tuple[str, str, str]] = []
+
+    def pads(self, lvl: int) -> Tuple[str, str, str]:
+        """Отступы уровня: (поле, элемент списка, элемент словаря)"""
+        while len(self._pads) <= lvl:
+            indent = self.tab * len(self._pads)
+            self._pads.append((indent + self.bullet, self.tab + indent, self.tab + indent + self.bullet))
+        return self._pads[lvl]
 
 
 class AutoPromptModel(BaseModel):
     _TAB: ClassVar[str] = "  "
     _BULLET: ClassVar[str] = "- "
+    _render_plans: ClassVar[Dict[type, _RenderPlan]] = {}
 
     @classmethod
     def model_description(cls) -> str:
@@ -19,44 +94,80 @@ class AutoPromptModel(BaseModel):
             lines.append(f"{cls._BULLET}{str(field_name)}: {desc}")
         return "\n".join(lines)
 
+    @classmethod
+    def _construct_trusted(cls, values: Dict[str, Any]) -> "AutoPromptModel":
+        """Экземпляр из уже провалидированных значений всех полей, без валидации и копирования
+
+        Облегчённый аналог model_construct: values должен содержать каждое поле модели.
+        """
+        obj = cls.__new__(cls)
+        object.__setattr__(obj, "__dict__", values)
+        object.__setattr__(obj, "__pydantic_fields_set__", set(values))
+        object.__setattr__(obj, "__pydantic_extra__", None)
+        object.__setattr__(obj, "__pydantic_private__", None)
+        return obj
+
+    @classmethod
+    def _render_plan(cls) -> _RenderPlan:
+        """План отрисовки класса, строится один раз при первом обращении"""
+        plan = AutoPromptModel._render_plans.get(cls)
+        if plan is None:
+            plan = AutoPromptModel._render_plans[cls] = _RenderPlan(cls)
+        return plan
+
     def as_prompt(self, exclude_none: bool = True, *, _lvl: int = 0) -> str:
         """Перевод полей экземпляра класса в текстовое представление для промпта"""
-        def pad(bul: str = self._BULLET): return self._TAB * _lvl + bul
-            
         parts: List[str] = []
-        model_fields: Dict[str, FieldInfo] = self.__class__.model_fields
-        
-        for field_name, field_info in model_fields.items():
-            value = getattr(self, field_name)
+        self._render_into(parts, exclude_none, _lvl)
+        return "\n".join(parts)
+
+    def _render_into(self, parts: List[str], exclude_none: bool, lvl: int) -> None:
+        """Дописывает строки промпта в общий буфер по скомпилированному плану"""
+        plan = self.__class__._render_plan()
+        pad, item_pad, entry_pad = plan.pads(lvl)
+        values = self.__dict__
+
+        for field_name, description, kind, item_kind in plan.fields:
+            value = values[field_name]
             if exclude_none and not value:
                 continue
 
-            description = field_info.description or field_name.replace("_", " ").capitalize()
+            if value is None:
+                kind = _SCALAR
+            elif kind == _ANY:
+                kind = _value_kind(value)
 
-            if isinstance(value, BaseModel):
-                parts.append(f"{pad()}{description}:")
-                parts.append(value.as_prompt(_lvl=_lvl + 1))
+            if kind == _SCALAR:
+                parts.append(f"{pad}{description}: {value}")
+                continue
 
-            elif isinstance(value, list):
-                parts.append(f"{pad()}{description}:")
+            parts.append(f"{pad}{description}:")
 
+            if kind == _MODEL:
+                _render_nested(value, parts, lvl + 1)
+
+            elif kind == _LIST:
                 for i, item in enumerate(value, 1):
-                    parts.append(
-                        item.as_prompt(_lvl=_lvl + 1)
-                        if isinstance(item, BaseModel)
-                        else f"{self._TAB}{pad(str(i))}. {item}"  # в случае списка значений
-                    )
-            
-            elif isinstance(value, dict):
-                parts.append(f"{pad()}{description}:")
-                for k, v in value.items():
-                    parts.append(
-                        v.as_prompt(_lvl=_lvl + 1)
-                        if isinstance(v, BaseModel)
-                        else f"{self._TAB}{pad()}{k}: {v}"
-                    )
-                    
+                    if item_kind == _MODEL or (item_kind == _ANY and isinstance(item, BaseModel)):
+                        _render_nested(item, parts, lvl + 1)
+                    else:
+                        parts.append(f"{item_pad}{i}. {item}")  # в случае списка значений
+
             else:
-                parts.append(f"{pad()}{description}: {value}")
+                for k, v in value.items():
+                    if item_kind == _MODEL or (item_kind == _ANY and isinstance(v, BaseModel)):
+                        _render_nested(v, parts, lvl + 1)
+                    else:
+                        parts.append(f"{entry_pad}{k}: {v}")
 
-        return "\n".join(parts)
+
+def _render_nested(value: BaseModel, parts: List[str], lvl: int) -> None:
+    """Отрисовка вложенной модели в общий буфер (пустая модель даёт пустую строку)"""
+    if not isinstance(value, AutoPromptModel):
+        parts.append(value.as_prompt(_lvl=lvl))
+        return
+
+    start = len(parts)
+    value._render_into(parts, True, lvl)  # вложенные модели всегда без пустых полей
+    if len(parts) == start:
+        parts.append("")
@@ -2,13 +2,38 @@
 Сервисы для приложения
 """
 from .llm_client import (
-    LLMClient, TreeLLMGenerator, NodeContentLLMGenerator, llm_clients
+    LLMClient, TreeLLMGenerator, NodeContentLLMGenerator, TranslationLLMGenerator, llm_clients
 )
 from .tree_generator import TreeGenerator
 from .content_writer import ContentWriter
 from .tree_validator import TreeValidator
+from .hedging import HedgeMetrics, LatencyTracker, latency_tracker
+from .routing import Backend, BackendPool
+from .scheduler import PriorityNodeScheduler, node_priorities
+from .job_queue import Job, JobQueue
+from .corpus_store import CorpusStore, content_hash
+from .localizer import Localizer, TranslationMemory
+from .duplicates import DuplicateDetector, DuplicateMatch
+from .templates import StructureTemplate, TemplateLibrary, branch_profile
+from .analytics import CorpusReport, TreeTable, analyze, analyze_corpus
+from .markov import ChainReport, analyze_chains, analyze_corpus_chains
+from .bulk import BatchAPI, BatchResult, BulkItem, BulkPipeline
+from .workers import (
+    QueueWorker, submit_npc, submit_content, assemble, collect, failures, stream_batch, run_worker_processes
+)
 
 __all__ = [
-    'LLMClient', 'TreeLLMGenerator', 'NodeContentLLMGenerator', 'llm_clients', 
-    'TreeGenerator', 'ContentWriter', 'TreeValidator'
+    'LLMClient', 'TreeLLMGenerator', 'NodeContentLLMGenerator', 'TranslationLLMGenerator', 'llm_clients', 
+    'TreeGenerator', 'ContentWriter', 'TreeValidator',
+    'HedgeMetrics', 'LatencyTracker', 'latency_tracker',
+    'Backend', 'BackendPool',
+    'PriorityNodeScheduler', 'node_priorities',
+    'CorpusStore', 'content_hash',
+    'DuplicateDetector', 'DuplicateMatch',
+    'Localizer', 'TranslationMemory',
+    'StructureTemplate', 'TemplateLibrary', 'branch_profile',
+    'CorpusReport', 'TreeTable', 'analyze', 'analyze_corpus',
+    'ChainReport', 'analyze_chains', 'analyze_corpus_chains',
+    'BatchAPI', 'BatchResult', 'BulkItem', 'BulkPipeline',
+    'Job', 'JobQueue', 'QueueWorker', 'submit_npc', 'submit_content', 'assemble', 'collect', 'failures', 'stream_batch', 'run_worker_processes'
 ]
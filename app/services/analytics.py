@@ -0,0 +1,295 @@
+"""
+Статистика по корпусу деревьев: глубина, ветвление, типы веток, кривые сложности, тупики и число путей
+
+Все метрики считаются по массивам TreeArrays сразу для всего корпуса: обход в ширину
+и топологическая сортировка идут по уровням, каждый уровень - векторная операция над всеми деревьями.
+"""
+import csv
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from app.utils import BRANCH_TYPES, MISSING, TreeArrays
+from app.utils.tree_arrays import TreeLike
+from .corpus_store import CorpusStore, STRUCTURE
+
+
+def bfs_depth(arrays: TreeArrays) -> np.ndarray:
+    """Расстояние от корня до каждой ноды (корень - 0), MISSING - нода недостижима"""
+    depth = np.full(arrays.n_nodes, MISSING, dtype=np.int64)
+    frontier = arrays.roots[arrays.roots != MISSING]
+    depth[frontier] = 0
+    level = 0
+    while frontier.size:
+        targets = arrays.indices[arrays.edges_of(frontier)]
+        targets = targets[targets != MISSING]
+        frontier = np.unique(targets[depth[targets] == MISSING])
+        level += 1
+        depth[frontier] = level
+    return depth
+
+
+def _topological_layers(arrays: TreeArrays, mask: np.ndarray, reachable: np.ndarray) -> List[np.ndarray]:
+    """Слои алгоритма Кана по ребрам mask среди достижимых нод; ноды циклов в слои не попадают"""
+    targets = arrays.indices
+    indegree = np.bincount(targets[mask], minlength=arrays.n_nodes)
+    frontier = np.flatnonzero((indegree == 0) & reachable)
+    layers = []
+    while frontier.size:
+        layers.append(frontier)
+        edges = arrays.edges_of(frontier)
+        edges = edges[mask[edges]]
+        indegree -= np.bincount(targets[edges], minlength=arrays.n_nodes)
+        frontier = np.unique(targets[edges][indegree[targets[edges]] == 0])
+    return layers
+
+
+def _strong_components(arrays: TreeArrays, mask: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """
+    Компоненты сильной связности нод nodes по ребрам mask (номер - наибольший индекс ноды компоненты,
+    MISSING - нода вне nodes). Раскраска: наибольший индекс предка протягивается вперед, затем
+    от нод, сохранивших свой цвет, компонента собирается обходом назад внутри цвета.
+    """
+    sources, targets = arrays.edge_source, np.where(mask, arrays.indices, 0)
+    ids = np.arange(arrays.n_nodes)
+    component = np.full(arrays.n_nodes, MISSING, dtype=np.int64)
+    active = nodes.copy()
+    while active.any():
+        live = np.flatnonzero(mask & active[sources] & active[targets])
+        live_sources, live_targets = sources[live], targets[live]
+        color = np.where(active, ids, MISSING)
+        while True:
+            spread = color.copy()
+            np.maximum.at(spread, live_targets, color[live_sources])
+            if (spread == color).all():
+                break
+            color = spread
+        members = active & (color == ids)
+        same_color = color[live_sources] == color[live_targets]
+        while True:
+            reached = same_color & members[live_targets] & ~members[live_sources]
+            if not reached.any():
+                break
+            members[live_sources[reached]] = True
+        component[members] = color[members]
+        active &= ~members
+    return component
+
+
+def acyclic_edges(arrays: TreeArrays, depth: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Ребра достижимой части без возвратов (loop) и топологические слои по ним.
+    Возвратом считается ребро внутри компоненты сильной связности, не увеличивающее глубину:
+    в каждом цикле есть хотя бы одно такое ребро, поэтому после их удаления граф ациклический.
+    """
+    sources, targets = arrays.edge_source, arrays.indices
+    reachable = depth != MISSING
+    mask = (targets != MISSING) & reachable[sources]
+    layers = _topological_layers(arrays, mask, reachable)
+
+    peeled = np.zeros(arrays.n_nodes, dtype=bool)
+    if layers:
+        peeled[np.concatenate(layers)] = True
+    if (peeled != reachable).any():
+        # компоненты ищутся только среди нод, не снятых сортировкой: остальные в циклах не участвуют
+        safe_targets = np.where(mask, targets, 0)
+        component = _strong_components(arrays, mask, reachable & ~peeled)
+        loops = (
+            mask & (component[sources] != MISSING) & (component[sources] == component[safe_targets])
+            & (depth[safe_targets] <= depth[sources])
+        )
+        mask &= ~loops
+        layers = _topological_layers(arrays, mask, reachable)
+    return mask, layers
+
+
+def count_paths(arrays: TreeArrays, mask: np.ndarray, layers: List[np.ndarray]) -> np.ndarray:
+    """Число различных путей от корня до каждой ноды (динамика по топологическим слоям)"""
+    sources, targets = arrays.edge_source, arrays.indices
+    paths = np.zeros(arrays.n_nodes, dtype=np.float64)
+    paths[arrays.roots[arrays.roots != MISSING]] = 1.0
+    for layer in layers:
+        edges = arrays.edges_of(layer)
+        edges = edges[mask[edges]]
+        paths += np.bincount(targets[edges], weights=paths[sources[edges]], minlength=arrays.n_nodes)
+    return paths
+
+
+@dataclass
+class TreeTable:
+    """Таблица метрик по деревьям: колонки - массивы NumPy, строки - деревья"""
+    keys: List[str]
+    columns: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for i, key in enumerate(self.keys):
+            yield {"key": key, **{name: column[i].item() for name, column in self.columns.items()}}
+
+    def to_csv(self, path: Union[str, Path]) -> int:
+        """Выгружает таблицу по деревьям, возвращает число строк"""
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["key", *self.columns])
+            writer.writeheader()
+            writer.writerows(self.rows())
+        return len(self.keys)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Среднее, медиана, минимум и максимум каждой метрики (без nan)"""
+        summary = {}
+        for name, column in self.columns.items():
+            values = column[~np.isnan(column)] if column.dtype.kind == "f" else column
+            if values.size:
+                summary[name] = {
+                    "mean": float(values.mean()), "median": float(np.median(values)),
+                    "min": float(values.min()), "max": float(values.max()),
+                }
+        return summary
+
+    def format(self) -> str:
+        """Текстовая сводка по метрикам"""
+        lines = [f"trees: {len(self)}", "", f"{'metric':<24}{'mean':>10}{'median':>10}{'min':>10}{'max':>10}"]
+        for name, stats in self.summary().items():
+            lines.append(
+                f"{name:<24}{stats['mean']:>10.2f}{stats['median']:>10.2f}{stats['min']:>10.2f}{stats['max']:>10.2f}"
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class CorpusReport(TreeTable):
+    """Метрики по деревьям и распределения по корпусу"""
+    depth_histogram: Optional[np.ndarray] = None      # число деревьев по глубине
+    branching_histogram: Optional[np.ndarray] = None  # число нод с ветвлением по числу ребер (листья не учитываются)
+    branch_mix: Optional[Dict[str, float]] = None     # доли нод по типам веток во всем корпусе
+    difficulty_curve: Optional[np.ndarray] = None     # средняя сложность на k-м шаге путей к цели
+
+    def format(self) -> str:
+        """Текстовый отчет: сводка по метрикам и распределения"""
+        lines = [super().format(), ""]
+        lines.append("depth: " + ", ".join(f"{d}={n}" for d, n in enumerate(self.depth_histogram) if n))
+        lines.append("branching: " + ", ".join(f"{d}={n}" for d, n in enumerate(self.branching_histogram) if n))
+        lines.append("branch mix: " + ", ".join(f"{k}={v:.2f}" for k, v in self.branch_mix.items()))
+        lines.append("difficulty by step: " + " ".join(f"{v:.2f}" for v in self.difficulty_curve))
+        return "\n".join(lines)
+
+
+def _difficulty_along_paths(arrays: TreeArrays) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Кривая средней сложности по шагам путей к цели, средняя сложность и прирост (конец - начало) по деревьям"""
+    n_trees = arrays.n_trees
+    if not arrays.path_nodes.size:
+        return np.zeros(0), np.full(n_trees, np.nan), np.full(n_trees, np.nan)
+    lengths = np.diff(arrays.path_ptr)
+    step = np.arange(arrays.path_nodes.size) - np.repeat(arrays.path_ptr[:-1], lengths)
+    values = np.where(
+        arrays.path_nodes != MISSING, arrays.difficulty[np.maximum(arrays.path_nodes, 0)], np.nan
+    )
+    known = ~np.isnan(values)
+    curve_sum = np.bincount(step[known], weights=values[known])
+    curve_count = np.bincount(step[known], minlength=curve_sum.size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        curve = curve_sum / curve_count
+
+        path_of_step = np.repeat(np.arange(lengths.size), lengths)
+        tree_of_step = arrays.path_tree[path_of_step]
+        mean = (
+            np.bincount(tree_of_step[known], weights=values[known], minlength=n_trees)
+            / np.bincount(tree_of_step[known], minlength=n_trees)
+        )
+
+        nonempty = lengths > 0
+        first = values[arrays.path_ptr[:-1][nonempty]]
+        last = values[arrays.path_ptr[1:][nonempty] - 1]
+        rise = last - first
+        has_rise = ~np.isnan(rise)
+        trees = arrays.path_tree[nonempty][has_rise]
+        rise = (
+            np.bincount(trees, weights=rise[has_rise], minlength=n_trees)
+            / np.bincount(trees, minlength=n_trees)
+        )
+    return curve, mean, rise
+
+
+def analyze(trees: Union[TreeArrays, Iterable[TreeLike]], keys: Optional[List[str]] = None) -> CorpusReport:
+    """Метрики по деревьям; keys - подписи строк таблицы (по умолчанию - номера деревьев)"""
+    arrays = trees if isinstance(trees, TreeArrays) else TreeArrays.from_trees(trees)
+    n_trees, tree_of_node = arrays.n_trees, arrays.tree_of_node
+    keys = keys if keys is not None else [str(t) for t in range(n_trees)]
+
+    depth = bfs_depth(arrays)
+    reachable = depth != MISSING
+    mask, layers = acyclic_edges(arrays, depth)
+    paths = count_paths(arrays, mask, layers)
+
+    out_degree = arrays.out_degree
+    n_nodes = np.diff(arrays.tree_ptr)
+    leaves = reachable & (out_degree == 0)
+    dag_leaves = reachable & (np.bincount(arrays.edge_source[mask], minlength=arrays.n_nodes) == 0)
+
+    tree_depth = np.full(n_trees, 0, dtype=np.int64)
+    np.maximum.at(tree_depth, tree_of_node[reachable], depth[reachable] + 1)
+
+    inner = out_degree > 0
+    branching_nodes = arrays.per_tree(np.ones(int(inner.sum())), inner)
+    max_branching = np.zeros(n_trees, dtype=np.int64)
+    np.maximum.at(max_branching, tree_of_node, out_degree)
+
+    n_leaves = arrays.per_tree(np.ones(int(leaves.sum())), leaves)
+    # концы путей к цели - не тупики
+    dead_ends = leaves & ~arrays.goal_ends
+
+    # ноды без типа ветки (последний столбец) в доли не входят: доли - среди нод с известным типом
+    branch_counts = np.zeros((n_trees, len(BRANCH_TYPES) + 1), dtype=np.int64)
+    np.add.at(branch_counts, (tree_of_node, arrays.branch), 1)
+    branch_counts = branch_counts[:, :len(BRANCH_TYPES)]
+    typed = branch_counts.sum(axis=1)
+    curve, path_difficulty, difficulty_rise = _difficulty_along_paths(arrays)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        columns = {
+            "n_nodes": n_nodes,
+            "depth": tree_depth,
+            "mean_branching": arrays.per_tree(out_degree[inner].astype(np.float64), inner) / branching_nodes,
+            "max_branching": max_branching,
+            "n_leaves": n_leaves.astype(np.int64),
+            "dead_end_ratio": arrays.per_tree(np.ones(int(dead_ends.sum())), dead_ends) / n_leaves,
+            "n_paths": arrays.per_tree(paths[dag_leaves], dag_leaves),
+            "loop_edges": np.bincount(
+                tree_of_node[arrays.edge_source[(arrays.indices != MISSING) & reachable[arrays.edge_source] & ~mask]],
+                minlength=n_trees
+            ),
+            "unreachable": n_nodes - np.bincount(tree_of_node[reachable], minlength=n_trees),
+            **{
+                f"share_{branch_type}": branch_counts[:, code] / typed
+                for code, branch_type in enumerate(BRANCH_TYPES)
+            },
+            "path_difficulty": path_difficulty,
+            "difficulty_rise": difficulty_rise,
+        }
+
+    total = branch_counts.sum(axis=0)
+    return CorpusReport(
+        keys=keys,
+        columns=columns,
+        depth_histogram=np.bincount(tree_depth),
+        branching_histogram=np.bincount(out_degree[inner]) if inner.any() else np.zeros(0, dtype=np.int64),
+        branch_mix={branch_type: float(total[code] / max(total.sum(), 1)) for code, branch_type in enumerate(BRANCH_TYPES)},
+        difficulty_curve=curve,
+    )
+
+
+def analyze_corpus(store: CorpusStore, kind: Optional[str] = STRUCTURE, **filters: Any) -> CorpusReport:
+    """Метрики по деревьям корпуса (по умолчанию - структурам); деревья читаются без pydantic-валидации"""
+    keys: List[str] = []
+
+    def trees() -> Iterator[Dict[str, Any]]:
+        for record in store.export(kind=kind, **filters):
+            keys.append(record["hash"])
+            yield record["dialog_tree"]
+
+    arrays = TreeArrays.from_trees(trees())
+    return analyze(arrays, keys=keys)
@@ -0,0 +1,197 @@
+"""
+Локальная замена Batch API для разработки и тестов
+
+Хранит файлы и пакеты в памяти и выполняет строки пакета в фоне через responder
+(по умолчанию - интерактивный chat completion основного агента). Запуск:
+    python -m app.services.batch_server --port 8100
+и base_url агентов http://127.0.0.1:8100/v1
+"""
+import asyncio
+import itertools
+import json
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+# тело запроса chat completion -> текст ответа
+Responder = Callable[[Dict[str, Any]], Awaitable[str]]
+
+
+async def forward_responder(body: Dict[str, Any]) -> str:
+    """Выполняет запрос интерактивно через основного агента"""
+    from .llm_client import llm_clients
+    response = await llm_clients.base_client.client.chat.completions.create(**body)
+    return response.choices[0].message.content or ""
+
+
+def _parse_multipart(body: bytes, content_type: str) -> Dict[str, Tuple[Optional[str], bytes]]:
+    """Поля multipart/form-data: имя -> (имя файла, содержимое)"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    if not message.is_multipart():
+        raise HTTPException(status_code=400, detail="multipart/form-data expected")
+    return {
+        part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+
+class BatchServer:
+    """Состояние сервера: файлы, пакеты и фоновые задачи их выполнения"""
+
+    def __init__(self, responder: Optional[Responder] = None, max_concurrency: int = 8):
+        self.responder = responder or forward_responder
+        self.max_concurrency = max_concurrency
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _put_file(self, content: bytes) -> Dict[str, Any]:
+        file_id = f"file-{next(self._ids)}"
+        self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "purpose": "batch"}
+
+    def create_batch(self, input_file_id: str, endpoint: str, completion_window: str) -> Dict[str, Any]:
+        if input_file_id not in self.files:
+            raise HTTPException(status_code=404, detail=f"No file {input_file_id}")
+        batch_id = f"batch-{next(self._ids)}"
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self._tasks[batch_id] = asyncio.create_task(self._process(batch_id))
+        return self.batches[batch_id]
+
+    async def _answer(self, line: Dict[str, Any], semaphore: asyncio.Semaphore) -> Tuple[bool, Dict[str, Any]]:
+        """Строка результата: (успех, запись для выходного файла или файла ошибок)"""
+        body = line.get("body", {})
+        try:
+            async with semaphore:
+                content = await self.responder(body)
+        except Exception as e:
+            return False, {
+                "id": f"req-{next(self._ids)}",
+                "custom_id": line["custom_id"],
+                "response": None,
+                "error": {"code": "server_error", "message": f"{type(e).__name__}: {e}"},
+            }
+        return True, {
+            "id": f"req-{next(self._ids)}",
+            "custom_id": line["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "object": "chat.completion",
+                    "model": body.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                },
+            },
+            "error": None,
+        }
+
+    async def _process(self, batch_id: str) -> None:
+        batch = self.batches[batch_id]
+        lines = [json.loads(line) for line in self.files[batch["input_file_id"]].splitlines() if line.strip()]
+        batch["status"] = "in_progress"
+        batch["request_counts"]["total"] = len(lines)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        answers = await asyncio.gather(*(self._answer(line, semaphore) for line in lines))
+        outputs = [record for ok, record in answers if ok]
+        errors = [record for ok, record in answers if not ok]
+
+        def dump(records) -> bytes:
+            return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+
+        if outputs:
+            batch["output_file_id"] = self._put_file(dump(outputs))["id"]
+        if errors:
+            batch["error_file_id"] = self._put_file(dump(errors))["id"]
+        batch["request_counts"].update(completed=len(outputs), failed=len(errors))
+        batch["status"] = "completed"
+        self._tasks.pop(batch_id, None)
+
+    def cancel(self, batch_id: str) -> Dict[str, Any]:
+        task = self._tasks.pop(batch_id, None)
+        if task is not None:
+            task.cancel()
+        self.batches[batch_id]["status"] = "cancelled"
+        return self.batches[batch_id]
+
+    def router(self) -> APIRouter:
+        router = APIRouter()
+
+        @router.post("/files")
+        async def upload_file(request: Request) -> Dict[str, Any]:
+            fields = _parse_multipart(await request.body(), request.headers.get("content-type", ""))
+            if "file" not in fields:
+                raise HTTPException(status_code=400, detail="No file field")
+            return self._put_file(fields["file"][1])
+
+        @router.get("/files/{file_id}/content")
+        async def file_content(file_id: str) -> PlainTextResponse:
+            if file_id not in self.files:
+                raise HTTPException(status_code=404, detail=f"No file {file_id}")
+            return PlainTextResponse(self.files[file_id].decode("utf-8"))
+
+        @router.post("/batches")
+        async def create_batch(request: Request) -> Dict[str, Any]:
+            payload = await request.json()
+            return self.create_batch(
+                payload["input_file_id"], payload.get("endpoint", ""), payload.get("completion_window", "24h")
+            )
+
+        @router.get("/batches/{batch_id}")
+        async def retrieve_batch(batch_id: str) -> Dict[str, Any]:
+            if batch_id not in self.batches:
+                raise HTTPException(status_code=404, detail=f"No batch {batch_id}")
+            return self.batches[batch_id]
+
+        @router.post("/batches/{batch_id}/cancel")
+        async def cancel_batch(batch_id: str) -> Dict[str, Any]:
+            if batch_id not in self.batches:
+                raise HTTPException(status_code=404, detail=f"No batch {batch_id}")
+            return self.cancel(batch_id)
+
+        return router
+
+
+def create_batch_app(server: Optional[BatchServer] = None) -> FastAPI:
+    """Приложение с маршрутами Batch API (с префиксом /v1 и без него)"""
+    server = server or BatchServer()
+    app = FastAPI(title="Local Batch API")
+    router = server.router()
+    app.include_router(router, prefix="/v1")
+    app.include_router(router)
+    app.state.batch_server = server
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible Batch API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    uvicorn.run(create_batch_app(), host=args.host, port=args.port)
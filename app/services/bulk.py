@@ -0,0 +1,332 @@
+"""
+Офлайн-режим: все запросы к LLM отправляются пакетами через Batch API (OpenAI-совместимый)
+
+Этапы выполняются волнами: структуры деревьев -> содержимое всех нод -> валидация.
+Внутри волны запросы всех NPC уходят одним JSONL-файлом, следующая волна строится
+из результатов предыдущей. Запросы, завершившиеся ошибкой, переотправляются
+отдельной волной (до max_retries раз). Библиотека шаблонов TreeGenerator используется
+так же, как в интерактивном режиме: для подходящего скелета переписываются только описания нод.
+"""
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from app.schemas import (
+    ContentGenerationRequest, ContentGenerationResponse, DialogStructureTree, DialogTree,
+    TreeGenerationRequest, TreeValidationRequest, TreeValidationResponse
+)
+from app.utils import LLMConfig, PromptTooLargeError, span
+from .content_writer import ContentWriter
+from .llm_client import BaseLLMGenerator, LLMClient
+from .templates import StructureTemplate
+from .tree_generator import TreeGenerator
+from .tree_validator import TreeValidator
+
+CHAT_COMPLETIONS = "/v1/chat/completions"
+# конечные статусы пакета
+_TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass
+class BatchResult:
+    """Результаты пакета по custom_id: текст ответа или описание ошибки"""
+    batch_id: str
+    outputs: Dict[str, str] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+class BatchAPI:
+    """Клиент Batch API: загрузка JSONL, создание пакета, опрос статуса и разбор результатов"""
+
+    def __init__(
+        self,
+        config: LLMConfig,
+        http: Optional[httpx.AsyncClient] = None,
+        completion_window: str = "24h"
+    ):
+        self.http = http or httpx.AsyncClient(
+            base_url=config.base_url.rstrip("/") + "/",
+            headers={"Authorization": f"Bearer {config.api_key}"},
+            timeout=60.0
+        )
+        self.completion_window = completion_window
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+    async def _json(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        response = await self.http.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def submit(self, lines: Sequence[Dict[str, Any]]) -> str:
+        """Загружает запросы одним JSONL-файлом и создает пакет, возвращает ID пакета"""
+        payload = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+        uploaded = await self._json(
+            "POST", "files",
+            data={"purpose": "batch"},
+            files={"file": ("batch.jsonl", payload, "application/jsonl")}
+        )
+        batch = await self._json("POST", "batches", json={
+            "input_file_id": uploaded["id"],
+            "endpoint": CHAT_COMPLETIONS,
+            "completion_window": self.completion_window,
+        })
+        return batch["id"]
+
+    async def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        return await self._json("GET", f"batches/{batch_id}")
+
+    async def wait(self, batch_id: str, poll_interval: float = 30.0) -> Dict[str, Any]:
+        """Опрашивает пакет до конечного статуса"""
+        while True:
+            batch = await self.retrieve(batch_id)
+            if batch["status"] in _TERMINAL:
+                return batch
+            await asyncio.sleep(poll_interval)
+
+    async def _lines(self, file_id: Optional[str]) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        response = await self.http.get(f"files/{file_id}/content")
+        response.raise_for_status()
+        return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+    async def results(self, batch: Dict[str, Any]) -> BatchResult:
+        """Ответы пакета; запросы без ответа (пакет прерван или истек) считаются ошибками"""
+        result = BatchResult(batch_id=batch["id"])
+        for line in await self._lines(batch.get("output_file_id")) + await self._lines(batch.get("error_file_id")):
+            custom_id, response = line["custom_id"], line.get("response") or {}
+            if line.get("error") or response.get("status_code", 200) != 200:
+                error = line.get("error") or response.get("body", {}).get("error") or {}
+                result.errors[custom_id] = error.get("message") or f"status {response.get('status_code')}"
+                continue
+            result.outputs[custom_id] = response["body"]["choices"][0]["message"]["content"] or ""
+        if batch["status"] != "completed":
+            result.errors.setdefault("*", f"batch {batch['id']} {batch['status']}")
+        return result
+
+    async def run(self, lines: Sequence[Dict[str, Any]], poll_interval: float = 30.0) -> BatchResult:
+        """Отправка, ожидание и результаты одного пакета"""
+        batch_id = await self.submit(lines)
+        return await self.results(await self.wait(batch_id, poll_interval))
+
+
+@dataclass
+class BulkItem:
+    """Результаты пайплайна для одного NPC"""
+    request: TreeGenerationRequest
+    structure: Optional[DialogStructureTree] = None
+    content: Optional[ContentGenerationResponse] = None
+    validation: Optional[TreeValidationResponse] = None
+    errors: Dict[str, str] = field(default_factory=dict)  # custom_id -> ошибка последней попытки
+
+
+class BulkPipeline:
+    """Пакетный пайплайн генерации: те же промпты и разбор ответов, что в интерактивном режиме"""
+
+    def __init__(
+        self,
+        api: Optional[BatchAPI] = None,
+        tree_generator: Optional[TreeGenerator] = None,
+        content_writer: Optional[ContentWriter] = None,
+        validator: Optional[TreeValidator] = None,
+        poll_interval: float = 30.0,
+        max_retries: int = 1
+    ):
+        self.tree_generator = tree_generator or TreeGenerator()
+        self.content_writer = content_writer or ContentWriter()
+        self.validator = validator or TreeValidator()
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        # один API на все роли (например, локальный сервер) или свой у основного бэкенда каждой роли
+        self._api = api
+        self._apis: Dict[str, BatchAPI] = {}
+
+    def _api_for(self, llm: LLMClient) -> BatchAPI:
+        if self._api is not None:
+            return self._api
+        config = llm.backends.backends[0].config
+        if config.base_url not in self._apis:
+            self._apis[config.base_url] = BatchAPI(config)
+        return self._apis[config.base_url]
+
+    async def close(self) -> None:
+        """Закрывает API, созданные пайплайном; переданный в конструктор API закрывает его владелец"""
+        for api in self._apis.values():
+            await api.close()
+        self._apis.clear()
+
+    async def _wave(
+        self,
+        stage: str,
+        llm: BaseLLMGenerator,
+        prompts: Dict[str, Tuple[str, int]],
+        handle: Callable[[str, Dict[str, Any]], None]
+    ) -> Dict[str, str]:
+        """
+        Отправляет промпты одним пакетом и передает разобранные ответы в handle(custom_id, ответ).
+        Возвращает ошибки запросов, не выполненных и после повторных волн.
+        """
+        pending, errors = dict(prompts), {}
+        for _ in range(self.max_retries + 1):
+            if not pending:
+                break
+            lines = [
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": CHAT_COMPLETIONS,
+                    "body": llm.request_body(prompt, max_tokens=max_tokens),
+                }
+                for custom_id, (prompt, max_tokens) in pending.items()
+            ]
+            with span("bulk.wave", stage=stage, size=len(lines)):
+                result = await self._api_for(llm).run(lines, self.poll_interval)
+
+            errors = {}
+            for custom_id in pending:
+                if custom_id not in result.outputs:
+                    errors[custom_id] = result.errors.get(custom_id) or result.errors.get("*", "no response")
+                    continue
+                try:
+                    handle(custom_id, LLMClient.parse_json(result.outputs[custom_id]))
+                except Exception as e:
+                    errors[custom_id] = f"{type(e).__name__}: {e}"
+            pending = {custom_id: prompts[custom_id] for custom_id in errors}
+        return errors
+
+    @staticmethod
+    def _record(items: List[BulkItem], errors: Dict[str, str]) -> None:
+        for custom_id, error in errors.items():
+            items[int(custom_id.split(":")[1])].errors[custom_id] = error
+
+    async def _structure_wave(self, items: List[BulkItem]) -> None:
+        """
+        Деревья для NPC без готовой структуры. Запросы с подходящим скелетом в библиотеке шаблонов
+        идут в той же волне промптом переписывания описаний; если он не удался, дерево строится
+        с нуля дополнительной волной.
+        """
+        templates: Dict[int, StructureTemplate] = {}
+        prompts: Dict[str, Tuple[str, int]] = {}
+        oversized: Dict[str, str] = {}
+        for i, item in enumerate(items):
+            if item.structure is not None:
+                continue
+            template = self.tree_generator.match_template(item.request)
+            try:
+                if template is not None:
+                    prompts[f"retheme:{i}"] = self.tree_generator.retheme_prompt(item.request, template)
+                    templates[i] = template
+                    continue
+            except PromptTooLargeError:
+                pass  # скелет не помещается в контекст: дерево строится с нуля
+            try:
+                prompts[f"tree:{i}"] = self.tree_generator.tree_prompt(item.request)
+            except PromptTooLargeError as e:
+                oversized[f"tree:{i}"] = str(e)
+
+        def handle(custom_id: str, response: Dict[str, Any]) -> None:
+            kind, i = custom_id.split(":")
+            item = items[int(i)]
+            if kind == "tree":
+                item.structure = self.tree_generator.structure_tree(response)
+                return
+            item.structure = self.tree_generator.apply_themes(templates[int(i)], response)
+            if item.structure is None:
+                raise ValueError("Rethemed tree does not cover the skeleton")
+
+        errors = await self._wave("tree", self.tree_generator.llm, prompts, handle)
+        # неудачное переписывание - не ошибка NPC: дерево строится с нуля
+        fallback = {}
+        for custom_id in [custom_id for custom_id in errors if custom_id.startswith("retheme:")]:
+            del errors[custom_id]
+            i = int(custom_id.split(":")[1])
+            try:
+                fallback[f"tree:{i}"] = self.tree_generator.tree_prompt(items[i].request)
+            except PromptTooLargeError as e:
+                oversized[f"tree:{i}"] = str(e)
+        if fallback:
+            errors.update(await self._wave("tree", self.tree_generator.llm, fallback, handle))
+        self._record(items, {**oversized, **errors})
+
+    async def _content_wave(self, items: List[BulkItem]) -> None:
+        requests: Dict[int, ContentGenerationRequest] = {}
+        trees: Dict[int, DialogTree] = {}
+        prompts: Dict[str, Tuple[str, int]] = {}
+        oversized: Dict[str, str] = {}
+        for i, item in enumerate(items):
+            if item.structure is None:
+                continue
+            requests[i] = ContentGenerationRequest(
+                character=item.request.character,
+                goal=item.request.goal,
+                constraints=item.request.constraints,
+                dialog_tree=item.structure
+            )
+            trees[i] = DialogTree.from_structure(item.structure)
+            for node_id, node in trees[i].nodes.items():
+                custom_id = f"node:{i}:{node_id}"
+                try:
+                    prompts[custom_id] = self.content_writer.node_prompt(node, requests[i])
+                except PromptTooLargeError as e:
+                    oversized[custom_id] = str(e)
+
+        def handle(custom_id: str, response: Dict[str, Any]) -> None:
+            _, i, node_id = custom_id.split(":", 2)
+            tree = trees[int(i)]
+            tree.nodes[node_id] = self.content_writer.parse_node(tree.nodes[node_id], response)
+
+        errors = {**oversized, **await self._wave("content", self.content_writer.llm, prompts, handle)}
+        self._record(items, errors)
+        for i, tree in trees.items():
+            filled = {node_id for node_id in tree.nodes if f"node:{i}:{node_id}" not in errors}
+            items[i].content = self.content_writer.snapshot(tree, filled)
+
+    async def _validation_wave(self, items: List[BulkItem]) -> None:
+        prompts: Dict[str, Tuple[str, int]] = {}
+        oversized: Dict[str, str] = {}
+        for i, item in enumerate(items):
+            if item.content is None or item.content.is_partial:
+                continue
+            request = TreeValidationRequest(
+                character=item.request.character,
+                goal=item.request.goal,
+                constraints=item.request.constraints,
+                dialog_tree=item.content.dialog_tree
+            )
+            try:
+                prompts[f"validation:{i}"] = self.validator.eval_prompt(request)
+            except PromptTooLargeError as e:
+                oversized[f"validation:{i}"] = str(e)
+
+        def handle(custom_id: str, response: Dict[str, Any]) -> None:
+            items[int(custom_id.split(":")[1])].validation = self.validator.to_response(response)
+
+        errors = await self._wave("tree_validation", self.validator.llm, prompts, handle)
+        self._record(items, {**oversized, **errors})
+
+    async def run(
+        self,
+        requests: Sequence[TreeGenerationRequest],
+        structures: Optional[Sequence[Optional[DialogStructureTree]]] = None,
+        validate: bool = True
+    ) -> List[BulkItem]:
+        """
+        Генерация для всех NPC волнами пакетов.
+        Для NPC с готовой структурой (structures) волна генерации дерева пропускается;
+        частично заполненные деревья не валидируются.
+        """
+        items = [
+            BulkItem(request=request, structure=structures[i] if structures else None)
+            for i, request in enumerate(requests)
+        ]
+        with span("bulk.run", npcs=len(items)):
+            await self._structure_wave(items)
+            await self._content_wave(items)
+            if validate:
+                await self._validation_wave(items)
+        return items
@@ -1,12 +1,37 @@
 """
 Контент-генератор для узлов дерева
 """
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+from typing_extensions import TypedDict
+from pydantic import TypeAdapter
+
 from app.schemas import (
     Choice, DialogNode, DialogTree, 
     ContentGenerationRequest, ContentGenerationResponse
 )
-from app.utils import PromptFactory, bfs
+from app.utils import (
+    PromptFactory, PromptTooLargeError, DeadlineExceeded, DialogStreamWriter, deadline_scope,
+    expected_node_output, annotate, span, traced
+)
 from .llm_client import llm_clients
+from .scheduler import PriorityNodeScheduler
+
+
+class _ChoicePayload(TypedDict, total=False):
+    """Вариант выбора в сыром ответе LLM"""
+    text: str
+    next_node_id: str
+
+
+class _NodeContentPayload(TypedDict, total=False):
+    """Сырой ответ LLM с содержимым узла"""
+    npc_text: Optional[str]
+    choices: List[_ChoicePayload]
+
+
+# адаптер компилируется один раз: ответ LLM валидируется за один проход
+_node_content_adapter = TypeAdapter(_NodeContentPayload)
 
 
 class ContentWriter:
@@ -15,47 +40,167 @@ class ContentWriter:
     def __init__(self):
         self.llm = llm_clients.content
 
-    async def _generate_node(
-        self,
-        node: DialogNode,
-        request: ContentGenerationRequest
-    ) -> DialogNode:
-        """Заполняет один узел содержимым (NPC-реплика и выборы игрока)"""
+    def node_prompt(self, node: DialogNode, request: ContentGenerationRequest) -> Tuple[str, int]:
+        """Промпт заполнения узла и max_tokens под него"""
         prompt = PromptFactory.build_prompt(
             "node_content",
             current_node=node,
             request=request
         )
+        expected_output = expected_node_output(node)
+        try:
+            max_tokens = self.llm.max_tokens_for(prompt, expected_output)
+        except PromptTooLargeError:
+            # длинная история не влезает в контекст: сжимаем соседние ноды до кратких описаний
+            prompt = PromptFactory.build_prompt(
+                "node_content",
+                current_node=node,
+                request=request,
+                compact=True
+            )
+            max_tokens = self.llm.max_tokens_for(prompt, expected_output)
+        return prompt, max_tokens
 
-        response = await self.llm.generate(prompt=prompt)
+    @staticmethod
+    def parse_node(node: DialogNode, response: Dict[str, Any]) -> DialogNode:
+        """Узел с содержимым из ответа LLM"""
+        content = _node_content_adapter.validate_python(response)
 
         choices = [
-            Choice(
-                text=choice.get("text", ""),
-                next_node_id=choice.get("next_node_id", "")
-            ) for choice in response.get("choices", [])
+            Choice._construct_trusted({
+                "text": choice.get("text", ""),
+                "next_node_id": choice.get("next_node_id", "")
+            }) for choice in content.get("choices", [])
         ]
 
-        node = DialogNode(
-            npc_text=response.get("npc_text", ""),
-            choices=choices,
-            **node.model_dump(exclude={"npc_text", "choices"})
+        return DialogNode.from_structure(
+            node,
+            npc_text=content.get("npc_text", ""),
+            choices=choices
         )
 
-        return node
+    @traced("content.generate_node")
+    async def generate_node(
+        self,
+        node: DialogNode,
+        request: ContentGenerationRequest
+    ) -> DialogNode:
+        """Заполняет один узел содержимым (NPC-реплика и выборы игрока)"""
+        annotate(node_id=node.node_id)
+        prompt, max_tokens = self.node_prompt(node, request)
+        response = await self.llm.generate(prompt=prompt, max_tokens=max_tokens)
+        with span("content.construct"):
+            return self.parse_node(node, response)
 
-    async def fill_dialog_tree(
-        self, request: ContentGenerationRequest
-    ) -> ContentGenerationResponse:
-        """Заполняет все узлы дерева контентом"""
-        tree = DialogTree(**request.dialog_tree.model_dump())
-        for node in bfs(tree, yield_objects=True):
-            filled_node = await self._generate_node(
-                node=node,
+    async def regenerate_nodes(
+        self,
+        request: ContentGenerationRequest,
+        tree: DialogTree,
+        node_ids: Iterable[str],
+        max_concurrency: int = 1
+    ) -> DialogTree:
+        """Заново заполняет указанные узлы (например, отмеченные как повторы), остальные не трогает"""
+        nodes = dict(tree.nodes)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def regenerate(node_id: str) -> None:
+            async with semaphore:
+                nodes[node_id] = await self.generate_node(
+                    node=DialogNode.from_structure(request.dialog_tree.nodes[node_id]),
+                    request=request
+                )
+
+        await asyncio.gather(*(regenerate(node_id) for node_id in node_ids))
+        return tree.model_copy(update={"nodes": nodes})
+
+    async def fill_in_priority_order(
+        self, request: ContentGenerationRequest, max_concurrency: int = 1
+    ) -> AsyncIterator[ContentGenerationResponse]:
+        """
+        Заполняет узлы по приоритету веток и отдает частично заполненное дерево после каждого уровня:
+        первым - с основной сюжетной линией и путями к цели, последним - полностью заполненное.
+        По истечении дедлайна отдает последний снимок с незаполненными узлами и завершается.
+        """
+        tree = DialogTree.from_structure(request.dialog_tree)
+        scheduler = PriorityNodeScheduler(tree, max_concurrency=max_concurrency)
+        filled: Set[str] = set()
+
+        async def fill(node_id: str) -> None:
+            tree.nodes[node_id] = await self.generate_node(
+                node=tree.nodes[node_id],
                 request=request
             )
-            tree.nodes[node.node_id] = filled_node
+            filled.add(node_id)
+
+        try:
+            async for _ in scheduler.run(fill):
+                yield self.snapshot(tree, filled)
+        except DeadlineExceeded:
+            yield self.snapshot(tree, filled)
 
+    @staticmethod
+    def snapshot(tree: DialogTree, filled: Set[str]) -> ContentGenerationResponse:
+        """Снимок дерева: узлы заменяются целиком, поэтому достаточно копии словаря"""
         return ContentGenerationResponse(
-            dialog_tree=tree
+            dialog_tree=tree.model_copy(update={"nodes": dict(tree.nodes)}),
+            unfilled_node_ids=[node_id for node_id in tree.nodes if node_id not in filled]
         )
+
+    @traced("content.fill")
+    async def fill_dialog_tree(
+        self,
+        request: ContentGenerationRequest,
+        max_concurrency: int = 1,
+        timeout: Optional[float] = None
+    ) -> ContentGenerationResponse:
+        """
+        Заполняет все узлы дерева контентом
+
+        :param timeout: Дедлайн в секундах; по его истечении запросы отменяются,
+            а возвращается частичный результат с unfilled_node_ids
+        """
+        with deadline_scope(timeout):
+            response = self.snapshot(DialogTree.from_structure(request.dialog_tree), set())
+            async for response in self.fill_in_priority_order(request, max_concurrency=max_concurrency):
+                pass
+        return response
+
+    @traced("content.stream")
+    async def stream_dialog_tree(
+        self,
+        request: ContentGenerationRequest,
+        writer: DialogStreamWriter,
+        npc_id: str,
+        max_concurrency: int = 1,
+        timeout: Optional[float] = None
+    ) -> List[str]:
+        """
+        Заполняет дерево, записывая каждый узел в поток сразу после генерации; заполненные узлы
+        в памяти не хранятся (промптам нужна только структура). Возвращает незаполненные узлы:
+        по истечении дедлайна они записываются пустыми и перечисляются в записи о завершении.
+        """
+        structure = request.dialog_tree
+        scheduler = PriorityNodeScheduler(structure, max_concurrency=max_concurrency)
+        filled: Set[str] = set()
+
+        async def fill(node_id: str) -> None:
+            node = await self.generate_node(
+                node=DialogNode.from_structure(structure.nodes[node_id]),
+                request=request
+            )
+            writer.write_node(npc_id, node)
+            filled.add(node_id)
+
+        writer.begin(npc_id, structure, request)
+        with deadline_scope(timeout):
+            try:
+                async for _ in scheduler.run(fill):
+                    pass
+            except DeadlineExceeded:
+                pass
+
+        unfilled = [node_id for node_id in structure.nodes if node_id not in filled]
+        for node_id in unfilled:
+            writer.write_node(npc_id, DialogNode.from_structure(structure.nodes[node_id]))
+        writer.end(npc_id, len(structure.nodes), unfilled)
+        return unfilled
@@ -0,0 +1,318 @@
+"""
+Локальное хранилище корпуса диалогов на SQLite
+
+Хранит входные данные генерации, деревья структуры, заполненные деревья и результаты валидации.
+Записи дедуплицируются по хэшу содержимого, поэтому повторное сохранение того же дерева бесплатно.
+Узлы индексируются по типу ветки, реплики и варианты выбора - полнотекстовым индексом FTS5.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from app.schemas import DialogStructureTree, DialogTree, TreeGenerationRequest, TreeValidationResponse
+from app.schemas.dialog import GenerationBaseRequest
+from app.utils import ImmediateTransaction
+
+STRUCTURE = "structure"
+FILLED = "filled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    hash TEXT PRIMARY KEY,
+    character_name TEXT NOT NULL,
+    goal_type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trees (
+    hash TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    request_hash TEXT,
+    character_name TEXT,
+    goal_type TEXT,
+    n_nodes INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tree_nodes (
+    id INTEGER PRIMARY KEY,
+    tree_hash TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    branch_type TEXT,
+    difficulty INTEGER,
+    npc_text TEXT,
+    choices TEXT,
+    UNIQUE (tree_hash, node_id)
+);
+CREATE TABLE IF NOT EXISTS validations (
+    hash TEXT PRIMARY KEY,
+    tree_hash TEXT NOT NULL,
+    is_valid INTEGER,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS node_text USING fts5(
+    npc_text, choices, content='tree_nodes', content_rowid='id', tokenize='unicode61 remove_diacritics 0'
+);
+CREATE INDEX IF NOT EXISTS requests_character ON requests (character_name);
+CREATE INDEX IF NOT EXISTS requests_goal ON requests (goal_type);
+CREATE INDEX IF NOT EXISTS trees_lookup ON trees (character_name, goal_type, kind);
+CREATE INDEX IF NOT EXISTS trees_goal ON trees (goal_type, kind);
+CREATE INDEX IF NOT EXISTS trees_request ON trees (request_hash);
+CREATE INDEX IF NOT EXISTS tree_nodes_branch ON tree_nodes (branch_type, tree_hash);
+CREATE INDEX IF NOT EXISTS validations_tree ON validations (tree_hash, is_valid);
+CREATE INDEX IF NOT EXISTS validations_valid ON validations (is_valid);
+"""
+
+_REQUEST_FIELDS = {"character", "goal", "constraints"}
+
+
+def _canonical(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def content_hash(model: Union[BaseModel, Dict[str, Any]]) -> str:
+    """SHA-256 канонического JSON модели (не зависит от порядка ключей)"""
+    data = model.model_dump(mode="json") if isinstance(model, BaseModel) else model
+    return hashlib.sha256(_canonical(data).encode("utf-8")).hexdigest()
+
+
+class CorpusStore:
+    """Корпус сгенерированных диалогов в файле SQLite"""
+
+    def __init__(self, path: Union[str, Path], timeout: float = 30.0):
+        self.path = str(path)
+        self._conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "CorpusStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # запись
+
+    def put_request(self, request: GenerationBaseRequest) -> str:
+        """Сохраняет входные данные генерации (персонаж, цель, ограничения), возвращает их хэш"""
+        data = request.model_dump(mode="json", include=_REQUEST_FIELDS)
+        request_hash = content_hash(data)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO requests (hash, character_name, goal_type, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (request_hash, request.character.name, request.goal.goal_type, _canonical(data), time.time())
+        )
+        return request_hash
+
+    def put_tree(
+        self,
+        tree: Union[DialogStructureTree, DialogTree],
+        request: Optional[GenerationBaseRequest] = None
+    ) -> str:
+        """Сохраняет дерево структуры или заполненное дерево вместе с его узлами, возвращает хэш"""
+        data = tree.model_dump(mode="json")
+        tree_hash = content_hash(data)
+        kind = FILLED if isinstance(tree, DialogTree) else STRUCTURE
+        request_hash = self.put_request(request) if request is not None else None
+
+        with ImmediateTransaction(self._conn):
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO trees "
+                "(hash, kind, request_hash, character_name, goal_type, n_nodes, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    tree_hash, kind, request_hash,
+                    request.character.name if request is not None else None,
+                    request.goal.goal_type if request is not None else None,
+                    len(tree.nodes), _canonical(data), time.time()
+                )
+            )
+            if cursor.rowcount != 1:
+                return tree_hash
+
+            rows = []
+            for node_id, node in data["nodes"].items():
+                metadata = node.get("metadata") or {}
+                choices = "\n".join(choice["text"] for choice in node.get("choices") or [])
+                rows.append((
+                    tree_hash, node_id, metadata.get("branch_type"), metadata.get("difficulty"),
+                    node.get("npc_text"), choices if kind == FILLED else None
+                ))
+            self._conn.executemany(
+                "INSERT INTO tree_nodes (tree_hash, node_id, branch_type, difficulty, npc_text, choices) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            if kind == FILLED:
+                self._conn.execute(
+                    "INSERT INTO node_text (rowid, npc_text, choices) "
+                    "SELECT id, npc_text, choices FROM tree_nodes WHERE tree_hash = ?",
+                    (tree_hash,)
+                )
+        return tree_hash
+
+    def put_validation(self, tree_hash: str, response: TreeValidationResponse) -> str:
+        """Сохраняет результат валидации дерева, возвращает его хэш"""
+        data = response.model_dump(mode="json")
+        validation_hash = content_hash({"tree_hash": tree_hash, **data})
+        self._conn.execute(
+            "INSERT OR IGNORE INTO validations (hash, tree_hash, is_valid, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (validation_hash, tree_hash, response.is_valid, _canonical(data), time.time())
+        )
+        return validation_hash
+
+    # чтение
+
+    def get_request(self, request_hash: str) -> Optional[TreeGenerationRequest]:
+        row = self._conn.execute("SELECT data FROM requests WHERE hash = ?", (request_hash,)).fetchone()
+        return TreeGenerationRequest.model_validate_json(row[0]) if row else None
+
+    def get_tree(self, tree_hash: str) -> Optional[Union[DialogStructureTree, DialogTree]]:
+        row = self._conn.execute("SELECT kind, data FROM trees WHERE hash = ?", (tree_hash,)).fetchone()
+        if row is None:
+            return None
+        kind, data = row
+        model = DialogTree if kind == FILLED else DialogStructureTree
+        return model.model_validate_json(data)
+
+    def validations(self, tree_hash: str) -> List[TreeValidationResponse]:
+        rows = self._conn.execute(
+            "SELECT data FROM validations WHERE tree_hash = ? ORDER BY created_at", (tree_hash,)
+        )
+        return [TreeValidationResponse.model_validate_json(data) for data, in rows]
+
+    def _tree_filter(
+        self,
+        kind: Optional[str],
+        character_name: Optional[str],
+        goal_type: Optional[str],
+        branch_type: Optional[str],
+        is_valid: Optional[bool]
+    ):
+        clauses, params = [], []
+        for column, value in (("kind", kind), ("character_name", character_name), ("goal_type", goal_type)):
+            if value is not None:
+                clauses.append(f"t.{column} = ?")
+                params.append(value)
+        if branch_type is not None:
+            clauses.append("EXISTS (SELECT 1 FROM tree_nodes n WHERE n.branch_type = ? AND n.tree_hash = t.hash)")
+            params.append(getattr(branch_type, "value", branch_type))
+        if is_valid is not None:
+            clauses.append("EXISTS (SELECT 1 FROM validations v WHERE v.tree_hash = t.hash AND v.is_valid = ?)")
+            params.append(int(is_valid))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def find_trees(
+        self,
+        kind: Optional[str] = None,
+        character_name: Optional[str] = None,
+        goal_type: Optional[str] = None,
+        branch_type: Optional[str] = None,
+        is_valid: Optional[bool] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Описания деревьев по фильтрам (без самих деревьев), новые первыми"""
+        where, params = self._tree_filter(kind, character_name, goal_type, branch_type, is_valid)
+        query = (
+            "SELECT t.hash, t.kind, t.request_hash, t.character_name, t.goal_type, t.n_nodes, t.created_at "
+            f"FROM trees t{where} ORDER BY t.created_at DESC"
+        )
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        columns = ("hash", "kind", "request_hash", "character_name", "goal_type", "n_nodes", "created_at")
+        return [dict(zip(columns, row)) for row in self._conn.execute(query, params)]
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Полнотекстовый поиск по репликам NPC и вариантам выбора (синтаксис FTS5),
+        результаты упорядочены по релевантности
+        """
+        rows = self._conn.execute(
+            "SELECT n.tree_hash, n.node_id, n.branch_type, n.npc_text, n.choices "
+            "FROM node_text JOIN tree_nodes n ON n.id = node_text.rowid "
+            "WHERE node_text MATCH ? ORDER BY bm25(node_text) LIMIT ?",
+            (query, limit)
+        )
+        columns = ("tree_hash", "node_id", "branch_type", "npc_text", "choices")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def compare(self, old_hash: str, new_hash: str) -> Dict[str, List[str]]:
+        """Регрессионное сравнение двух деревьев по узлам: добавленные, удаленные и измененные"""
+        def ids(query: str) -> List[str]:
+            return [node_id for node_id, in self._conn.execute(query, (old_hash, new_hash))]
+
+        return {
+            "added": ids(
+                "SELECT b.node_id FROM tree_nodes b WHERE b.tree_hash = ?2 AND NOT EXISTS "
+                "(SELECT 1 FROM tree_nodes a WHERE a.tree_hash = ?1 AND a.node_id = b.node_id) ORDER BY b.node_id"
+            ),
+            "removed": ids(
+                "SELECT a.node_id FROM tree_nodes a WHERE a.tree_hash = ?1 AND NOT EXISTS "
+                "(SELECT 1 FROM tree_nodes b WHERE b.tree_hash = ?2 AND b.node_id = a.node_id) ORDER BY a.node_id"
+            ),
+            "changed": ids(
+                "SELECT a.node_id FROM tree_nodes a JOIN tree_nodes b ON b.node_id = a.node_id "
+                "WHERE a.tree_hash = ?1 AND b.tree_hash = ?2 AND ("
+                "a.branch_type IS NOT b.branch_type OR a.difficulty IS NOT b.difficulty OR "
+                "a.npc_text IS NOT b.npc_text OR a.choices IS NOT b.choices) ORDER BY a.node_id"
+            ),
+        }
+
+    def node_texts(self, exclude_tree_hash: Optional[str] = None) -> Iterator[Tuple[str, str, str]]:
+        """Реплики NPC заполненных деревьев корпуса: (хэш дерева, ID ноды, текст)"""
+        query, params = "SELECT tree_hash, node_id, npc_text FROM tree_nodes WHERE npc_text IS NOT NULL AND npc_text != ''", []
+        if exclude_tree_hash is not None:
+            query += " AND tree_hash != ?"
+            params.append(exclude_tree_hash)
+        yield from self._conn.execute(query, params)
+
+    def export(
+        self,
+        kind: Optional[str] = None,
+        character_name: Optional[str] = None,
+        goal_type: Optional[str] = None,
+        branch_type: Optional[str] = None,
+        is_valid: Optional[bool] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Потоковая выгрузка записей корпуса: деревья читаются курсором по одному"""
+        where, params = self._tree_filter(kind, character_name, goal_type, branch_type, is_valid)
+        cursor = self._conn.execute(
+            "SELECT t.hash, t.kind, r.data, t.data FROM trees t "
+            f"LEFT JOIN requests r ON r.hash = t.request_hash{where} ORDER BY t.created_at",
+            params
+        )
+        for tree_hash, kind, request, tree in cursor:
+            yield {
+                "hash": tree_hash,
+                "kind": kind,
+                "request": json.loads(request) if request is not None else None,
+                "dialog_tree": json.loads(tree),
+                "validations": [v.model_dump(mode="json") for v in self.validations(tree_hash)],
+            }
+
+    def export_jsonl(self, path: Union[str, Path], **filters: Any) -> int:
+        """Выгружает корпус в JSONL, возвращает число записей"""
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for record in self.export(**filters):
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+                count += 1
+        return count
+
+    def counts(self) -> Dict[str, int]:
+        """Число записей по типам"""
+        counts = {"requests": 0, STRUCTURE: 0, FILLED: 0, "validations": 0}
+        counts["requests"] = self._conn.execute("SELECT COUNT(*) FROM requests").fetchone()[0]
+        counts["validations"] = self._conn.execute("SELECT COUNT(*) FROM validations").fetchone()[0]
+        counts.update(dict(self._conn.execute("SELECT kind, COUNT(*) FROM trees GROUP BY kind").fetchall()))
+        return counts
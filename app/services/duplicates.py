@@ -0,0 +1,86 @@
+"""
+Локальный поиск почти одинаковых реплик в дереве и в корпусе без обращения к LLM
+
+Отмеченные ноды сразу отправляются на перегенерацию (ContentWriter.regenerate_nodes).
+"""
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+from app.schemas import DialogTree
+from app.utils import MinHasher, MinHashLSH
+from .corpus_store import CorpusStore
+
+NPC_TEXT = "npc_text"
+CHOICES = "choices"
+
+
+@dataclass
+class DuplicateMatch:
+    """Нода с репликой (или вариантом выбора), почти совпадающей с другой"""
+    node_id: str
+    field: str
+    text: str
+    other_node_id: str
+    other_tree_hash: Optional[str]  # None - повтор внутри того же дерева
+    similarity: float
+
+
+class DuplicateDetector:
+    """MinHash/LSH по символьным шинглам: поиск кандидатов за сублинейное время"""
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 64, k: int = 5):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm=num_perm, k=k)
+        self.corpus = MinHashLSH(num_perm=num_perm, threshold=threshold)
+
+    def index_corpus(self, store: CorpusStore, exclude_tree_hash: Optional[str] = None) -> int:
+        """Добавляет в индекс реплики NPC из корпуса, возвращает число новых реплик"""
+        added = 0
+        for tree_hash, node_id, text in store.node_texts(exclude_tree_hash=exclude_tree_hash):
+            key = (tree_hash, node_id)
+            if key in self.corpus:
+                continue
+            self.corpus.insert(key, self.hasher.signature(text))
+            added += 1
+        return added
+
+    def find_in_tree(self, tree: DialogTree) -> List[DuplicateMatch]:
+        """Повторы реплик NPC между нодами дерева и почти одинаковые варианты выбора внутри ноды"""
+        matches: List[DuplicateMatch] = []
+        index = MinHashLSH(num_perm=self.hasher.num_perm, threshold=self.threshold)
+        for node_id, node in tree.nodes.items():
+            if node.npc_text:
+                signature = self.hasher.signature(node.npc_text)
+                # вторая из пары нод отмечается как повтор первой
+                for other_node_id, similarity in index.query(signature):
+                    matches.append(DuplicateMatch(node_id, NPC_TEXT, node.npc_text, other_node_id, None, similarity))
+                index.insert(node_id, signature)
+
+            choices = MinHashLSH(num_perm=self.hasher.num_perm, threshold=self.threshold)
+            for i, choice in enumerate(node.choices or []):
+                signature = self.hasher.signature(choice.text)
+                found = choices.query(signature)
+                if found:
+                    matches.append(DuplicateMatch(node_id, CHOICES, choice.text, node_id, None, found[0][1]))
+                    break
+                choices.insert(i, signature)
+        return matches
+
+    def find_in_corpus(self, tree: DialogTree) -> List[DuplicateMatch]:
+        """Реплики NPC дерева, почти совпадающие с репликами из проиндексированного корпуса"""
+        matches: List[DuplicateMatch] = []
+        for node_id, node in tree.nodes.items():
+            if not node.npc_text:
+                continue
+            found = self.corpus.query(self.hasher.signature(node.npc_text))
+            if found:
+                (tree_hash, other_node_id), similarity = found[0]
+                matches.append(DuplicateMatch(node_id, NPC_TEXT, node.npc_text, other_node_id, tree_hash, similarity))
+        return matches
+
+    def find(self, tree: DialogTree) -> List[DuplicateMatch]:
+        return self.find_in_tree(tree) + self.find_in_corpus(tree)
+
+    def flagged_nodes(self, tree: DialogTree) -> Set[str]:
+        """Ноды, которые нужно перегенерировать"""
+        return {match.node_id for match in self.find(tree)}
@@ -0,0 +1,93 @@
+"""
+Хеджирование запросов к LLM: дублирующий запрос, если основной завис дольше обычного
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных запросов по ключу (модель, этап)"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def record(self, key: Tuple[str, str], latency: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(latency)
+
+    def quantile(self, key: Tuple[str, str], q: float, min_samples: int = 1) -> Optional[float]:
+        """Квантиль задержки; None, если замеров пока недостаточно"""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@dataclass
+class HedgeMetrics:
+    """Счётчики хеджирования одного клиента"""
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    primary_wins: int = 0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+    @property
+    def hedge_win_rate(self) -> float:
+        return self.hedge_wins / self.hedged if self.hedged else 0.0
+
+
+latency_tracker = LatencyTracker()
+
+
+async def hedged_call(
+    primary: Callable[[], Awaitable[Any]],
+    hedge: Callable[[], Awaitable[Any]],
+    delay: Optional[float],
+    metrics: HedgeMetrics
+) -> Any:
+    """
+    Запускает primary; если за delay секунд он не завершился, запускает hedge
+    и возвращает первый успешный результат, отменяя второй запрос.
+
+    :param delay: Порог в секундах; None - без хеджирования
+    """
+    metrics.requests += 1
+    first = asyncio.ensure_future(primary())
+    tasks = {first: "primary"}
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            result = first.result()
+            metrics.primary_wins += 1
+            return result
+
+        metrics.hedged += 1
+        tasks[asyncio.ensure_future(hedge())] = "hedge"
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if tasks[task] == "hedge":
+                        metrics.hedge_wins += 1
+                    else:
+                        metrics.primary_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,253 @@
+"""
+Надежная локальная очередь заданий на SQLite для пула воркеров
+
+Задание берется воркером в аренду (lease) на ограниченное время и продлевается heartbeat'ом.
+Если воркер упал, аренда истекает и задание снова становится доступно другим воркерам.
+Несколько процессов одного хоста работают с одним файлом базы. Только один хост: журнал WAL
+держит индекс в общей памяти, на сетевых файловых системах он не поддерживается.
+"""
+import json
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from app.utils import ImmediateTransaction
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    batch_id TEXT NOT NULL,
+    parent_id TEXT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent_id, status);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, kind);
+"""
+
+
+@dataclass
+class Job:
+    """Задание, взятое воркером в аренду"""
+    id: str
+    batch_id: str
+    parent_id: Optional[str]
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class JobQueue:
+    """Очередь заданий в файле SQLite (WAL), безопасная для нескольких процессов"""
+
+    def __init__(self, path: Union[str, Path], timeout: float = 30.0):
+        self.path = str(path)
+        # QueueWorker обращается к базе из своего потока, вызовы к соединению он сериализует сам
+        self._conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "JobQueue":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _transaction(self):
+        """Транзакция с немедленной блокировкой записи (аренда не достанется двум воркерам)"""
+        return ImmediateTransaction(self._conn)
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        batch_id: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        priority: int = 0
+    ) -> str:
+        return self.enqueue_many(kind, [payload], batch_id=batch_id, parent_id=parent_id, priority=priority)[0]
+
+    def enqueue_many(
+        self,
+        kind: str,
+        payloads: Iterable[Dict[str, Any]],
+        batch_id: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        priority: int = 0
+    ) -> List[str]:
+        """Добавляет задания одной транзакцией, возвращает их ID"""
+        now = time.time()
+        rows = [
+            (uuid.uuid4().hex, batch_id or "default", parent_id, kind, json.dumps(payload, ensure_ascii=False),
+             priority, now, now)
+            for payload in payloads
+        ]
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT INTO jobs (id, batch_id, parent_id, kind, payload, priority, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return [row[0] for row in rows]
+
+    def lease(
+        self,
+        worker_id: str,
+        lease_seconds: float = 60.0,
+        kinds: Optional[List[str]] = None,
+        max_attempts: int = 3
+    ) -> Optional[Job]:
+        """
+        Берет в аренду самое приоритетное готовое задание (или задание с истекшей арендой).
+        Задание с истекшей арендой после max_attempts попыток помечается проваленным, а не выдается снова.
+        """
+        now = time.time()
+        kind_filter, params = "", [now]
+        if kinds:
+            kind_filter = f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired', "
+                "lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, max_attempts)
+            )
+            row = self._conn.execute(
+                "SELECT id, batch_id, parent_id, kind, payload, attempts FROM jobs "
+                "WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))"
+                f"{kind_filter} ORDER BY priority, created_at LIMIT 1",
+                params
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row[0])
+            )
+
+        job_id, batch_id, parent_id, kind, payload, attempts = row
+        return Job(job_id, batch_id, parent_id, kind, json.loads(payload), attempts + 1)
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = 60.0) -> bool:
+        """Продлевает аренду; False - аренда потеряна (задание отдано другому воркеру)"""
+        now = time.time()
+        cursor = self._conn.execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (now + lease_seconds, now, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(
+        self,
+        job_id: str,
+        worker_id: str,
+        result: Any,
+        children: Iterable[Tuple[str, Dict[str, Any], int]] = ()
+    ) -> bool:
+        """
+        Сохраняет результат и атомарно ставит дочерние задания (kind, payload, priority).
+        False - аренда уже не принадлежит воркеру, дочерние задания не создаются.
+        """
+        now = time.time()
+        with self._transaction():
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (json.dumps(result, ensure_ascii=False), now, job_id, worker_id)
+            )
+            if cursor.rowcount != 1:
+                return False
+            batch_id = self._conn.execute("SELECT batch_id FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            self._conn.executemany(
+                "INSERT INTO jobs (id, batch_id, parent_id, kind, payload, priority, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (uuid.uuid4().hex, batch_id, job_id, kind, json.dumps(payload, ensure_ascii=False), priority, now, now)
+                    for kind, payload, priority in children
+                ]
+            )
+        return True
+
+    def fail(self, job_id: str, worker_id: str, error: str, max_attempts: int = 3) -> None:
+        """Возвращает задание в очередь или помечает проваленным после max_attempts попыток"""
+        self._conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (max_attempts, error, time.time(), job_id, worker_id)
+        )
+
+    def result(self, job_id: str) -> Any:
+        row = self._conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Задание с его статусом и результатом (None - задания нет)"""
+        rows = self._conn.execute(
+            "SELECT id, kind, payload, status, result, error FROM jobs WHERE id = ?", (job_id,)
+        ).fetchall()
+        return self._rows(rows)[0] if rows else None
+
+    def children(self, parent_id: str) -> List[Dict[str, Any]]:
+        """Дочерние задания с их статусом и результатом"""
+        rows = self._conn.execute(
+            "SELECT id, kind, payload, status, result, error FROM jobs WHERE parent_id = ?", (parent_id,)
+        ).fetchall()
+        return self._rows(rows)
+
+    @staticmethod
+    def _rows(rows: List[tuple]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "id": job_id, "kind": kind, "payload": json.loads(payload), "status": status,
+                "result": json.loads(result) if result is not None else None, "error": error,
+            }
+            for job_id, kind, payload, status, result, error in rows
+        ]
+
+    def jobs(self, batch_id: str, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Задания пакета (без результатов)"""
+        query, params = "SELECT id, kind, status, error FROM jobs WHERE batch_id = ?", [batch_id]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        return [
+            {"id": job_id, "kind": kind, "status": status, "error": error}
+            for job_id, kind, status, error in self._conn.execute(query + " ORDER BY created_at", params)
+        ]
+
+    def counts(self, batch_id: Optional[str] = None) -> Dict[str, int]:
+        """Число заданий по статусам"""
+        query, params = "SELECT status, COUNT(*) FROM jobs", []
+        if batch_id is not None:
+            query += " WHERE batch_id = ?"
+            params.append(batch_id)
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(self._conn.execute(query + " GROUP BY status", params).fetchall()))
+        return counts
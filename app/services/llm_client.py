@@ -1,11 +1,21 @@
 """
 Клиент для работы с OpenAI-совместимыми LLM API, включая DeepSeek
 """
+import asyncio
 import json
-from typing import Dict, Any, Optional, List 
+import time
+from typing import Dict, Any, Optional, List, Callable
 from openai import AsyncOpenAI
 
-from app.utils import SystemPrompts, LLMConfig, settings
+from app.utils import (
+    SystemPrompts, LLMConfig, settings, estimate_tokens, plan_max_tokens, with_deadline, span
+)
+from .hedging import HedgeMetrics, hedged_call, latency_tracker
+from .routing import Backend, BackendPool
+
+# хуки профилирования: до вызова (клиент, сообщения) и после (клиент, сообщения, результат, ошибка, секунды)
+BeforeHook = Callable[["LLMClient", List[Dict[str, str]]], None]
+AfterHook = Callable[["LLMClient", List[Dict[str, str]], Any, Optional[BaseException], float], None]
 
 
 """
@@ -16,17 +26,43 @@ TODO:
 
 class LLMClient:
     """Гибкий клиент для OpenAI/DeepSeek с поддержкой структурированного вывода"""
+    stage: str = "base"  # этап пайплайна, по которому ведется статистика задержек
 
-    def __init__(self, config: Optional[LLMConfig] = None):
-        config = config or settings.llm_base
+    def __init__(
+        self,
+        config: Optional[LLMConfig] = None,
+        hedge_config: Optional[LLMConfig] = None,
+        pool: Optional[List[LLMConfig]] = None
+    ):
+        if config is None:
+            config = settings.llm_base
+            pool = pool or settings.llm_base_pool
 
-        self.client = AsyncOpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url,
-        )
+        # основной агент и дополнительные бэкенды роли
+        self.backends = BackendPool.from_configs([config, *(pool or [])])
+        self.client = self.backends.backends[0].client
         self.model = config.model
         self.temperature = config.temperature
         self.max_tokens = config.max_tokens
+        self.context_window = min(backend.config.context_window for backend in self.backends.backends)
+
+        # хеджирование: дубль уходит в резервного агента, иначе в другой бэкенд пула
+        self.hedge_quantile = config.hedge_quantile
+        self.hedge_min_delay = config.hedge_min_delay
+        self.hedge_min_samples = config.hedge_min_samples
+        hedge_config = hedge_config or settings.llm_hedge
+        self.hedge_backend = Backend(hedge_config) if hedge_config is not None else None
+        self.hedge_metrics = HedgeMetrics()
+
+        self.before_hooks: List[BeforeHook] = []
+        self.after_hooks: List[AfterHook] = []
+
+    def add_hooks(self, before: Optional[BeforeHook] = None, after: Optional[AfterHook] = None) -> None:
+        """Подключает хуки, вызываемые вокруг каждого запроса к LLM"""
+        if before is not None:
+            self.before_hooks.append(before)
+        if after is not None:
+            self.after_hooks.append(after)
     
     def resolve_generation_params(self, **kwargs) -> Dict[str, Any]:
         """Собираем параметры генерации"""
@@ -50,10 +86,123 @@ class LLMClient:
         :param messages: Список сообщений (roles: system/user/assistant)
         :param response_format: Формат ответа, например {"type": "json_object"} для структурированного вывода
         """
+        return await self._complete(messages, response_format, parse=None, **kwargs)
+
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, str]],
+        parse: Optional[Callable[[str], Any]],
+        **kwargs
+    ) -> Any:
+        """Запрос к LLM в спане llm.chat с вызовом хуков профилирования"""
+        for hook in self.before_hooks:
+            hook(self, messages)
+        started = time.perf_counter()
+        result, error = None, None
+        try:
+            with span("llm.chat", stage=self.stage, model=self.model):
+                result = await self._route(messages, response_format, parse, **kwargs)
+            return result
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            for hook in self.after_hooks:
+                hook(self, messages, result, error, elapsed)
+
+    async def _route(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, str]],
+        parse: Optional[Callable[[str], Any]],
+        **kwargs
+    ) -> Any:
+        """
+        Запрос с маршрутизацией по пулу бэкендов и опциональным хеджированием.
+        Успешным считается ответ, прошедший parse; при ошибке запрос уходит в следующий бэкенд пула.
+        """
         params = self.resolve_generation_params(**kwargs)
+        pool = self.backends
+        primary_backend = pool.select()
+        tried: List[Backend] = [primary_backend]
+
+        async def attempt(backend: Backend) -> Any:
+            started = time.perf_counter()
+            pool.started(backend)
+            try:
+                with span("llm.request", model=backend.model):
+                    text = await self._create(backend.client, backend.model, messages, response_format, params)
+            except asyncio.CancelledError:
+                # в квантиль хеджирования идут только завершенные запросы: время проигравшего
+                # в гонке запроса занижает порог; пулу оно нужно как нижняя оценка задержки бэкенда
+                pool.cancelled(backend, time.perf_counter() - started)
+                raise
+            except Exception:
+                pool.failed(backend)
+                raise
+            elapsed = time.perf_counter() - started
+            latency_tracker.record((backend.model, self.stage), elapsed)
+            pool.succeeded(backend, elapsed)
+            # ошибка разбора - плохой ответ модели, а не отказ бэкенда: запрос уходит дальше, здоровье не страдает
+            if parse:
+                with span("llm.parse", chars=len(text)):
+                    return parse(text)
+            return text
+
+        async def with_failover(backend: Backend) -> Any:
+            while True:
+                try:
+                    return await attempt(backend)
+                except Exception:
+                    backend = pool.select(exclude=tried)
+                    if backend is None:
+                        raise
+                    tried.append(backend)
+
+        def hedge_target() -> Optional[Backend]:
+            return self.hedge_backend or pool.select(exclude=tried, healthy_only=True)
+
+        async def hedge() -> Any:
+            backend = hedge_target()
+            if backend is None:
+                # другие бэкенды заняты переключением основного запроса: ждем только его
+                raise RuntimeError("No backend left for a hedge request")
+            tried.append(backend)
+            return await attempt(backend)
+
+        # дубль в тот же бэкенд только удвоит нагрузку: без резервного агента и второго здорового бэкенда не хеджируем
+        delay = self.hedge_delay(primary_backend.model) if hedge_target() is not None else None
+        # по дедлайну вызова (deadline_scope) отменяются и основной, и дублирующий запросы
+        return await with_deadline(hedged_call(
+            primary=lambda: with_failover(primary_backend),
+            hedge=hedge,
+            delay=delay,
+            metrics=self.hedge_metrics
+        ))
+
+    def hedge_delay(self, model: Optional[str] = None) -> Optional[float]:
+        """Порог для дублирующего запроса: квантиль задержек модели на этом этапе"""
+        if self.hedge_quantile is None:
+            return None
+        threshold = latency_tracker.quantile(
+            (model or self.model, self.stage), self.hedge_quantile, min_samples=self.hedge_min_samples
+        )
+        return None if threshold is None else max(threshold, self.hedge_min_delay)
+
+    @staticmethod
+    async def _create(
+        client: AsyncOpenAI,
+        model: str,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, str]],
+        params: Dict[str, Any]
+    ) -> str:
+        """Один вызов chat completion"""
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
+            response = await client.chat.completions.create(
+                model=model,
                 messages=messages,
                 response_format=response_format,
                 **params
@@ -90,12 +239,16 @@ class LLMClient:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
 
-        response_text = await self.chat(
+        # разбор JSON входит в попытку: при хеджировании побеждает первый валидный ответ
+        return await self._complete(
             messages=messages,
             response_format={"type": "json_object"},
+            parse=self.parse_json,
             **kwargs
         )
 
+    @staticmethod
+    def parse_json(response_text: str) -> Dict[str, Any]:
         try:
             return json.loads(response_text)
         except json.JSONDecodeError as e:
@@ -105,10 +258,32 @@ class LLMClient:
 class BaseLLMGenerator(LLMClient):
     """Базовый класс для специализированных генераторов"""
 
-    def __init__(self, config: Optional[LLMConfig], system_prompt: str):
-        super().__init__(config=config)
+    def __init__(self, config: Optional[LLMConfig], system_prompt: str, pool: Optional[List[LLMConfig]] = None):
+        super().__init__(config=config, pool=pool)
         self.system_prompt = system_prompt
     
+    def max_tokens_for(self, prompt: str, expected_output: int) -> int:
+        """
+        max_tokens под ожидаемый размер ответа по локальной оценке промпта
+
+        :raises PromptTooLargeError: если промпт не помещается в контекст модели
+        """
+        prompt_tokens = estimate_tokens(self.system_prompt) + estimate_tokens(prompt)
+        return plan_max_tokens(prompt_tokens, expected_output, self.context_window, self.max_tokens)
+
+    def request_body(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """Тело запроса chat completion для пакетной отправки (Batch API), те же параметры, что у generate"""
+        params = self.resolve_generation_params(**kwargs)
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            "response_format": {"type": "json_object"},
+            **{name: value for name, value in params.items() if value is not None},
+        }
+
     async def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
         return await self.generate_structured_output(
             prompt=prompt,
@@ -120,28 +295,49 @@ class BaseLLMGenerator(LLMClient):
 
 class TreeLLMGenerator(BaseLLMGenerator):
     """Клиент для генерации дерева диалогов"""
+    stage = "tree"
+
     def __init__(self):
         super().__init__(
             config=settings.llm_tree,
-            system_prompt=SystemPrompts.tree_generation_prompt
+            system_prompt=SystemPrompts.tree_generation_prompt,
+            pool=settings.llm_tree_pool
         )
 
 
 class NodeContentLLMGenerator(BaseLLMGenerator):
     """Клиент для генерации контента в нодах"""
+    stage = "content"
+
     def __init__(self):
         super().__init__(
             config=settings.llm_content,
-            system_prompt=SystemPrompts.content_generation_prompt
+            system_prompt=SystemPrompts.content_generation_prompt,
+            pool=settings.llm_content_pool
         )
 
 
 class TreeLLMValidator(BaseLLMGenerator):
     """Валидатор дерева диалогов"""
+    stage = "tree_validation"
+
     def __init__(self):
         super().__init__(
             config=settings.llm_tree_validator,
-            system_prompt=SystemPrompts.tree_validation_prompt
+            system_prompt=SystemPrompts.tree_validation_prompt,
+            pool=settings.llm_tree_validator_pool
+        )
+
+
+class TranslationLLMGenerator(BaseLLMGenerator):
+    """Клиент для перевода диалогов"""
+    stage = "translation"
+
+    def __init__(self):
+        super().__init__(
+            config=settings.llm_translator,
+            system_prompt=SystemPrompts.translation_prompt,
+            pool=settings.llm_translator_pool
         )
 
 
@@ -160,6 +356,7 @@ class LLMClients:
         self.tree = TreeLLMGenerator()
         self.content = NodeContentLLMGenerator()
         self.tree_validator = TreeLLMValidator()
+        self.translator = TranslationLLMGenerator()
 
 
 llm_clients = LLMClients()
@@ -0,0 +1,241 @@
+"""
+Локализация заполненных деревьев пакетами строк
+
+Все реплики NPC и варианты выбора собираются из деревьев, повторы схлопываются,
+строки без перевода в памяти переводов (translation memory) упаковываются
+в ограниченные по размеру пакеты, которые переводятся параллельно.
+"""
+import asyncio
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+from typing_extensions import TypedDict
+from pydantic import TypeAdapter
+
+from app.schemas import Character, DialogTree
+from app.utils import DeadlineExceeded, PromptFactory, estimate_tokens, expected_translation_output, traced
+from .llm_client import llm_clients
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    source_hash TEXT NOT NULL,
+    locale TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    PRIMARY KEY (source_hash, locale)
+);
+"""
+
+# ограничение SQLite на число параметров запроса
+_LOOKUP_CHUNK = 500
+
+
+class _TranslationPayload(TypedDict):
+    """Сырой ответ LLM с переводами по ключам строк"""
+    translations: Dict[str, str]
+
+
+_translation_adapter = TypeAdapter(_TranslationPayload)
+
+
+def _source_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """Переводы по (хэш исходной строки, локаль) в SQLite; по умолчанию - в памяти процесса"""
+
+    def __init__(self, path: Union[str, Path] = ":memory:", timeout: float = 30.0):
+        self.path = str(path)
+        self._conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "TranslationMemory":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def lookup(self, sources: Iterable[str], locale: str) -> Dict[str, str]:
+        """Известные переводы строк"""
+        by_hash = {_source_hash(source): source for source in sources}
+        hashes = list(by_hash)
+        found: Dict[str, str] = {}
+        for i in range(0, len(hashes), _LOOKUP_CHUNK):
+            chunk = hashes[i:i + _LOOKUP_CHUNK]
+            rows = self._conn.execute(
+                f"SELECT source_hash, target FROM translations WHERE locale = ? "
+                f"AND source_hash IN ({', '.join('?' * len(chunk))})",
+                [locale, *chunk]
+            )
+            for source_hash, target in rows:
+                found[by_hash[source_hash]] = target
+        return found
+
+    def store(self, translations: Dict[str, str], locale: str) -> None:
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations (source_hash, locale, source, target) VALUES (?, ?, ?, ?)",
+                [(_source_hash(source), locale, source, target) for source, target in translations.items()]
+            )
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def count(self, locale: Optional[str] = None) -> int:
+        if locale is None:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return self._conn.execute("SELECT COUNT(*) FROM translations WHERE locale = ?", (locale,)).fetchone()[0]
+
+
+class Localizer:
+    """Переводит деревья на несколько языков, дедуплицируя строки и переиспользуя прошлые переводы"""
+
+    def __init__(
+        self,
+        memory: Optional[TranslationMemory] = None,
+        max_batch_tokens: int = 1500,
+        max_batch_strings: int = 40,
+        max_concurrency: int = 4,
+        max_retries: int = 1
+    ):
+        self.llm = llm_clients.translator
+        self.memory = memory or TranslationMemory()
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_strings = max_batch_strings
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+
+    @staticmethod
+    def collect_strings(trees: Iterable[DialogTree]) -> List[str]:
+        """Уникальные непустые реплики и варианты выбора в порядке появления"""
+        strings: Dict[str, None] = {}
+        for tree in trees:
+            for node in tree.nodes.values():
+                if node.npc_text:
+                    strings[node.npc_text] = None
+                for choice in node.choices or []:
+                    if choice.text:
+                        strings[choice.text] = None
+        return list(strings)
+
+    def batches(self, strings: Sequence[str]) -> List[List[str]]:
+        """Пакеты не больше max_batch_strings строк и max_batch_tokens токенов (длинная строка - отдельным пакетом)"""
+        batches: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for text in strings:
+            tokens = estimate_tokens(text)
+            if current and (
+                len(current) >= self.max_batch_strings or current_tokens + tokens > self.max_batch_tokens
+            ):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _translate_batch(
+        self,
+        batch: List[str],
+        locale: str,
+        character: Optional[Character]
+    ) -> Dict[str, str]:
+        """Один запрос на пакет; строки, которых нет в ответе, не возвращаются"""
+        keyed = {f"s{i}": text for i, text in enumerate(batch)}
+        prompt = PromptFactory.build_prompt("translation", strings=keyed, locale=locale, character=character)
+        source_tokens = sum(estimate_tokens(text) for text in batch)
+        max_tokens = self.llm.max_tokens_for(prompt, expected_translation_output(source_tokens))
+        response = await self.llm.generate(prompt=prompt, max_tokens=max_tokens)
+
+        translated = _translation_adapter.validate_python(response)["translations"]
+        return {keyed[key]: text for key, text in translated.items() if key in keyed and text}
+
+    @traced("localize.translate")
+    async def translate(
+        self,
+        strings: Sequence[str],
+        locales: Sequence[str],
+        character: Optional[Character] = None
+    ) -> Dict[str, Dict[str, str]]:
+        """
+        Переводы строк по локалям. Пакеты всех локалей выполняются параллельно (до max_concurrency),
+        результаты сразу сохраняются в память переводов. Ошибка пакета не прерывает остальные:
+        его строки переводятся заново в следующем круге.
+
+        :raises ValueError: если часть строк не переведена и после повторных попыток
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = {locale: self.memory.lookup(strings, locale) for locale in locales}
+        errors: Dict[str, Exception] = {}
+
+        async def run(batch: List[str], locale: str) -> None:
+            try:
+                async with semaphore:
+                    translated = await self._translate_batch(batch, locale, character)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                errors[locale] = e
+                return
+            self.memory.store(translated, locale)
+            results[locale].update(translated)
+
+        for _ in range(self.max_retries + 1):
+            pending = {
+                locale: [text for text in strings if text not in results[locale]]
+                for locale in locales
+            }
+            if not any(pending.values()):
+                break
+            await asyncio.gather(*(
+                run(batch, locale)
+                for locale, missing in pending.items()
+                for batch in self.batches(missing)
+            ))
+
+        for locale in locales:
+            missing = [text for text in strings if text not in results[locale]]
+            if missing:
+                raise ValueError(
+                    f"No translation into {locale} for {len(missing)} strings, e.g. {missing[0]!r}"
+                ) from errors.get(locale)
+        return results
+
+    @staticmethod
+    def apply(tree: DialogTree, translations: Dict[str, str], locale: str) -> DialogTree:
+        """Копия дерева с переведенными репликами и вариантами выбора"""
+        nodes = {}
+        for node_id, node in tree.nodes.items():
+            nodes[node_id] = node.model_copy(update={
+                "npc_text": translations.get(node.npc_text, node.npc_text),
+                "choices": [
+                    choice.model_copy(update={"text": translations.get(choice.text, choice.text)})
+                    for choice in node.choices or []
+                ],
+            })
+        return tree.model_copy(update={"nodes": nodes, "metadata": {**(tree.metadata or {}), "locale": locale}})
+
+    async def localize(
+        self,
+        trees: Sequence[DialogTree],
+        locales: Sequence[str],
+        character: Optional[Character] = None
+    ) -> Dict[str, List[DialogTree]]:
+        """Деревья, переведенные на каждую локаль (в том же порядке)"""
+        translations = await self.translate(self.collect_strings(trees), locales, character=character)
+        return {
+            locale: [self.apply(tree, translations[locale], locale) for tree in trees]
+            for locale in locales
+        }
@@ -0,0 +1,194 @@
+"""
+Заполненное дерево как поглощающая цепь Маркова по переходам Choice.next_node_id
+
+Игрок в каждой ноде выбирает вариант случайно: равновероятно или с весами по типу ветки,
+в которую ведет выбор. Поглощающие состояния:
+    цель   - ноды, которыми заканчиваются goal_achievement_paths;
+    тупик  - ноды без вариантов выбора и выборы, ведущие в отсутствующую ноду;
+    ловушка - ноды, из которых нельзя дойти ни до одного конца (замкнутые петли).
+Из корня решается (I - Q)^T y = e_root: y - ожидаемое число посещений каждой ноды,
+сумма y - ожидаемое число ходов до конца, y·R - вероятности поглощения.
+Деревья решаются пачками (np.linalg.solve по стопке матриц одного размера).
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+
+from app.schemas import BranchType
+from app.utils import BRANCH_TYPES, CHOICES, MISSING, UNTYPED, TreeArrays
+from app.utils.tree_arrays import TreeLike
+from .analytics import TreeTable, bfs_depth
+from .corpus_store import CorpusStore, FILLED
+
+# политика выбора: вес варианта по типу ветки ноды, в которую он ведет (None - равновероятно)
+ChoicePolicy = Optional[Dict[str, float]]  # ключ UNTYPED - вес нод без типа ветки
+
+_MIN_BLOCK = 8
+_CHUNK_ELEMENTS = 1 << 24  # предел элементов стопки матриц в одном решении (~128 МБ float64)
+
+
+@dataclass
+class ChainReport(TreeTable):
+    """Вероятности исходов и длина прохождения по деревьям, недостижимые ноды"""
+    unreachable: Optional[List[List[str]]] = None
+
+
+def _edge_probabilities(arrays: TreeArrays, policy: ChoicePolicy) -> np.ndarray:
+    """Вероятность каждого выбора в своей ноде"""
+    if policy is None:
+        weights = np.ones(arrays.indices.size)
+    else:
+        by_code = np.array(
+            [policy.get(branch_type, 0.0) for branch_type in (*BRANCH_TYPES, UNTYPED)], dtype=np.float64
+        )
+        missing = policy.get(BranchType.DEAD_END.value, 0.0)
+        targets = arrays.indices
+        weights = np.where(targets != MISSING, by_code[arrays.branch[np.maximum(targets, 0)]], missing)
+    totals = np.bincount(arrays.edge_source, weights=weights, minlength=arrays.n_nodes)
+    # все варианты ноды с нулевым весом - выбор равновероятный
+    uniform = totals[arrays.edge_source] == 0
+    counts = np.diff(arrays.indptr)[arrays.edge_source]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(uniform, 1.0 / counts, weights / totals[arrays.edge_source])
+
+
+def _can_exit(arrays: TreeArrays, transient: np.ndarray, probability: np.ndarray) -> np.ndarray:
+    """Ноды, из которых с ненулевой вероятностью достижим конец (обратное распространение по уровням)"""
+    sources, targets = arrays.edge_source, arrays.indices
+    live = probability > 0
+    safe_targets = np.maximum(targets, 0)
+    exits = ~transient
+    leads_out = live & ((targets == MISSING) | ~transient[safe_targets])
+    exits[np.unique(sources[leads_out])] = True
+    while True:
+        reached = live & (targets != MISSING) & exits[safe_targets] & ~exits[sources]
+        if not reached.any():
+            return exits
+        exits[np.unique(sources[reached])] = True
+
+
+def analyze_chains(
+    trees: Union[TreeArrays, Iterable[TreeLike]],
+    policy: ChoicePolicy = None,
+    keys: Optional[List[str]] = None
+) -> ChainReport:
+    """
+    Вероятности достижения цели, тупика и ловушки из корня, ожидаемое число ходов до конца
+    и недостижимые из корня ноды по каждому дереву
+
+    :param trees: заполненные деревья или TreeArrays, построенные по CHOICES
+    :param policy: веса вариантов выбора по типу ветки ноды-цели (None - равновероятно)
+    """
+    arrays = trees if isinstance(trees, TreeArrays) else TreeArrays.from_trees(trees, edges=CHOICES)
+    n_trees, n_nodes, tree_of_node = arrays.n_trees, arrays.n_nodes, arrays.tree_of_node
+    keys = keys if keys is not None else [str(t) for t in range(n_trees)]
+    sources, targets = arrays.edge_source, arrays.indices
+    safe_targets = np.maximum(targets, 0)
+
+    reachable = bfs_depth(arrays) != MISSING
+    goal = arrays.goal_ends
+    terminal = np.diff(arrays.indptr) == 0
+    probability = _edge_probabilities(arrays, policy)
+
+    transient = reachable & ~goal & ~terminal
+    trapped = transient & ~_can_exit(arrays, transient, probability)
+    transient &= ~trapped
+
+    # локальные номера переходных нод внутри дерева
+    order = np.flatnonzero(transient)
+    sizes = np.bincount(tree_of_node[order], minlength=n_trees)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    local = np.full(n_nodes, MISSING, dtype=np.int64)
+    local[order] = np.arange(order.size) - starts[tree_of_node[order]]
+
+    visits = np.zeros(n_nodes, dtype=np.float64)
+    from_transient = transient[sources]
+    inner = from_transient & (targets != MISSING) & transient[safe_targets]
+    roots = arrays.roots
+    solvable = (roots != MISSING) & transient[np.maximum(roots, 0)]
+
+    # стопки одного размера (степень двойки): дополнение единичной матрицей не меняет решение
+    blocks = np.maximum(_MIN_BLOCK, 1 << np.ceil(np.log2(np.maximum(sizes, 1))).astype(np.int64))
+    for block in np.unique(blocks[solvable]):
+        group = np.flatnonzero(solvable & (blocks == block))
+        chunk = max(1, _CHUNK_ELEMENTS // (block * block))
+        for i in range(0, group.size, chunk):
+            _solve_visits(arrays, group[i:i + chunk], int(block), local, inner, probability, visits)
+
+    def per_tree(edges: np.ndarray) -> np.ndarray:
+        return np.bincount(
+            tree_of_node[sources[edges]], weights=visits[sources[edges]] * probability[edges], minlength=n_trees
+        )
+
+    into_goal = from_transient & (targets != MISSING) & goal[safe_targets]
+    into_trap = from_transient & (targets != MISSING) & trapped[safe_targets]
+    p_goal, p_trapped = per_tree(into_goal), per_tree(into_trap)
+    p_dead_end = per_tree(from_transient & ~into_goal & ~into_trap & ~inner)
+
+    # корень сам поглощающий: исход определен без ходов
+    valid_roots = roots != MISSING
+    root_nodes = roots[valid_roots]
+    p_goal[valid_roots] += goal[root_nodes]
+    p_trapped[valid_roots] += trapped[root_nodes]
+    p_dead_end[valid_roots] += terminal[root_nodes] & ~goal[root_nodes]
+
+    unreachable_nodes = np.flatnonzero(~reachable)
+    unreachable = [[] for _ in range(n_trees)]
+    for node in unreachable_nodes:
+        unreachable[tree_of_node[node]].append(arrays.node_ids[node])
+
+    return ChainReport(
+        keys=keys,
+        columns={
+            "p_goal": p_goal,
+            "p_dead_end": p_dead_end,
+            "p_trapped": p_trapped,
+            "expected_turns": np.bincount(tree_of_node, weights=visits, minlength=n_trees),
+            "n_unreachable": np.bincount(tree_of_node[unreachable_nodes], minlength=n_trees),
+        },
+        unreachable=unreachable,
+    )
+
+
+def _solve_visits(
+    arrays: TreeArrays,
+    group: np.ndarray,
+    block: int,
+    local: np.ndarray,
+    inner: np.ndarray,
+    probability: np.ndarray,
+    visits: np.ndarray
+) -> None:
+    """Ожидаемые посещения переходных нод из корня для деревьев group (одна стопка матриц)"""
+    position = np.full(arrays.n_trees, MISSING, dtype=np.int64)
+    position[group] = np.arange(group.size)
+    sources, targets = arrays.edge_source, arrays.indices
+
+    system = np.broadcast_to(np.eye(block), (group.size, block, block)).copy()
+    edges = np.flatnonzero(inner & (position[arrays.tree_of_node[sources]] != MISSING))
+    # (I - Q)^T: строка - нода-цель перехода, столбец - нода-источник
+    np.subtract.at(
+        system,
+        (position[arrays.tree_of_node[sources[edges]]], local[targets[edges]], local[sources[edges]]),
+        probability[edges]
+    )
+    rhs = np.zeros((group.size, block, 1))
+    rhs[np.arange(group.size), local[arrays.roots[group]], 0] = 1.0
+    solution = np.linalg.solve(system, rhs)[:, :, 0]
+
+    nodes = np.flatnonzero((local != MISSING) & (position[arrays.tree_of_node] != MISSING))
+    visits[nodes] = solution[position[arrays.tree_of_node[nodes]], local[nodes]]
+
+
+def analyze_corpus_chains(store: CorpusStore, policy: ChoicePolicy = None, **filters: Any) -> ChainReport:
+    """Анализ цепей по заполненным деревьям корпуса; деревья читаются без pydantic-валидации"""
+    keys: List[str] = []
+
+    def trees() -> Iterator[Dict[str, Any]]:
+        for record in store.export(kind=FILLED, **filters):
+            keys.append(record["hash"])
+            yield record["dialog_tree"]
+
+    arrays = TreeArrays.from_trees(trees(), edges=CHOICES)
+    return analyze_chains(arrays, policy=policy, keys=keys)
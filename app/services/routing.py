@@ -0,0 +1,113 @@
+"""
+Пул LLM-бэкендов одной роли: маршрутизация по нагрузке и отказоустойчивость
+"""
+import time
+from typing import Callable, Iterable, List, Optional
+
+from openai import AsyncOpenAI
+
+from app.utils import LLMConfig
+
+
+class Backend:
+    """OpenAI-совместимый эндпоинт пула вместе со статистикой его здоровья"""
+
+    def __init__(self, config: LLMConfig, client: Optional[AsyncOpenAI] = None):
+        self.config = config
+        self.client = client or AsyncOpenAI(api_key=config.api_key, base_url=config.base_url)
+        self.model = config.model
+        self.weight = config.weight
+
+        self.in_flight = 0
+        self.latency: Optional[float] = None  # экспоненциальное среднее задержки
+        self.consecutive_errors = 0
+        self.unhealthy_until = 0.0
+
+    def __repr__(self) -> str:
+        return f"Backend({self.config.base_url}, {self.model}, in_flight={self.in_flight})"
+
+
+class BackendPool:
+    """
+    Выбирает наименее загруженный здоровый бэкенд с учетом весов.
+
+    Бэкенд после max_errors ошибок подряд выводится из ротации на cooldown секунд;
+    бэкенд, чья задержка больше slow_factor лучших, получает штраф к приоритету.
+    """
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        max_errors: int = 3,
+        cooldown: float = 30.0,
+        slow_factor: float = 3.0,
+        ewma_alpha: float = 0.2,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if not backends:
+            raise ValueError("Backend pool is empty")
+        self.backends = backends
+        self.max_errors = max_errors
+        self.cooldown = cooldown
+        self.slow_factor = slow_factor
+        self.ewma_alpha = ewma_alpha
+        self.clock = clock
+
+    @classmethod
+    def from_configs(cls, configs: Iterable[LLMConfig], **kwargs) -> "BackendPool":
+        return cls([Backend(config) for config in configs], **kwargs)
+
+    def is_healthy(self, backend: Backend) -> bool:
+        return self.clock() >= backend.unhealthy_until
+
+    def select(self, exclude: Iterable[Backend] = (), healthy_only: bool = False) -> Optional[Backend]:
+        """
+        Лучший бэкенд вне exclude; если здоровых нет - тот, что раньше вернется в ротацию
+
+        :param healthy_only: None вместо нездорового бэкенда
+        """
+        excluded = set(map(id, exclude))
+        candidates = [b for b in self.backends if id(b) not in excluded]
+        if not candidates:
+            return None
+
+        healthy = [b for b in candidates if self.is_healthy(b)]
+        if not healthy:
+            return None if healthy_only else min(candidates, key=lambda b: b.unhealthy_until)
+
+        latencies = [b.latency for b in healthy if b.latency is not None]
+        best_latency = min(latencies) if latencies else None
+
+        def score(backend: Backend):
+            load = (backend.in_flight + 1) / backend.weight
+            if best_latency and backend.latency and backend.latency > self.slow_factor * best_latency:
+                load *= self.slow_factor
+            return load, backend.latency or 0.0
+
+        return min(healthy, key=score)
+
+    def started(self, backend: Backend) -> None:
+        backend.in_flight += 1
+
+    def succeeded(self, backend: Backend, latency: float) -> None:
+        backend.in_flight -= 1
+        backend.consecutive_errors = 0
+        backend.unhealthy_until = 0.0
+        self._observe(backend, latency)
+
+    def cancelled(self, backend: Backend, elapsed: float) -> None:
+        """Отмененный запрос: задержка не меньше elapsed"""
+        backend.in_flight -= 1
+        self._observe(backend, elapsed)
+
+    def failed(self, backend: Backend) -> None:
+        backend.in_flight -= 1
+        backend.consecutive_errors += 1
+        if backend.consecutive_errors >= self.max_errors:
+            backend.unhealthy_until = self.clock() + self.cooldown
+
+    def _observe(self, backend: Backend, latency: float) -> None:
+        if backend.latency is None:
+            backend.latency = latency
+        else:
+            backend.latency += self.ewma_alpha * (latency - backend.latency)
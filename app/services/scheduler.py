@@ -0,0 +1,86 @@
+"""
+Планировщик генерации нод: основная сюжетная линия заполняется первой
+"""
+import asyncio
+import heapq
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Set
+
+from app.schemas import BranchType, DialogBaseTree
+from app.utils import bfs
+
+# уровни приоритета: 0 - основная линия и пути к цели, затем исследование и побочные ветки, тупики последними
+MAIN_PRIORITY = 0
+NODE_PRIORITY: Dict[BranchType, int] = {
+    BranchType.MAIN_PATH: MAIN_PRIORITY,
+    BranchType.EXPLORATION: 1,
+    BranchType.SIDE_QUEST: 1,
+    BranchType.LOOP_BACK: 1,
+    BranchType.DEAD_END: 2,
+}
+DEFAULT_PRIORITY = 1
+
+
+def node_priorities(tree: DialogBaseTree) -> Dict[str, int]:
+    """Приоритет каждой ноды дерева (меньше - раньше)"""
+    goal_nodes: Set[str] = {node_id for path in tree.goal_achievement_paths or [] for node_id in path}
+    priorities = {}
+    for node_id, node in tree.nodes.items():
+        if node_id in goal_nodes:
+            priorities[node_id] = MAIN_PRIORITY
+        elif node.metadata is None or node.metadata.branch_type is None:
+            priorities[node_id] = DEFAULT_PRIORITY
+        else:
+            priorities[node_id] = NODE_PRIORITY.get(node.metadata.branch_type, DEFAULT_PRIORITY)
+    return priorities
+
+
+class PriorityNodeScheduler:
+    """Очередь нод по приоритету (внутри уровня - в порядке обхода в ширину) с ограничением параллельности"""
+
+    def __init__(self, tree: DialogBaseTree, max_concurrency: int = 1):
+        self.max_concurrency = max(max_concurrency, 1)
+
+        priorities = node_priorities(tree)
+        order = list(bfs(tree))
+        visited = set(order)
+        order.extend(node_id for node_id in tree.nodes if node_id not in visited)  # недостижимые из корня ноды
+
+        by_level: Dict[int, List[str]] = {}
+        for node_id in order:
+            by_level.setdefault(priorities[node_id], []).append(node_id)
+        self.tiers: List[List[str]] = [by_level[level] for level in sorted(by_level)]
+
+    async def run(self, worker: Callable[[str], Awaitable[None]]) -> AsyncIterator[int]:
+        """
+        Выполняет worker для всех нод, отдавая номер уровня, как только все его ноды готовы.
+        Ошибка worker прерывает обход; незавершенные задачи отменяются.
+        """
+        heap = [(tier, i, node_id) for tier, node_ids in enumerate(self.tiers) for i, node_id in enumerate(node_ids)]
+        heapq.heapify(heap)
+        remaining = [len(node_ids) for node_ids in self.tiers]
+        tier_done = [asyncio.Event() for _ in self.tiers]
+
+        async def consume():
+            while heap:
+                tier, _, node_id = heapq.heappop(heap)
+                await worker(node_id)
+                remaining[tier] -= 1
+                if not remaining[tier]:
+                    tier_done[tier].set()
+
+        workers = [asyncio.ensure_future(consume()) for _ in range(min(self.max_concurrency, len(heap)))]
+        try:
+            for tier, done in enumerate(tier_done):
+                while not done.is_set():
+                    waiter = asyncio.ensure_future(done.wait())
+                    await asyncio.wait([waiter, *workers], return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    for task in workers:
+                        if task.done() and task.exception() is not None:
+                            raise task.exception()
+                yield tier
+        finally:
+            for task in workers:
+                task.cancel()
+            # отмена доходит до worker до возврата: вызывающий не увидит очистку после своего снимка
+            await asyncio.gather(*workers, return_exceptions=True)
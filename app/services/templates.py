@@ -0,0 +1,133 @@
+"""
+Библиотека проверенных скелетов структуры дерева
+
+Скелет подбирается по типу цели, ограничениям и профилю веток. Для похожего запроса
+TreeGenerator не строит дерево заново, а только переписывает описания нод скелета.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from app.schemas import BranchType, DialogStructureTree, StructureConstraints, TreeGenerationRequest
+from app.utils import bfs
+from .corpus_store import CorpusStore, STRUCTURE
+
+# числовые ограничения, по которым считается близость скелета к запросу
+_CONSTRAINT_FIELDS = ("max_choices", "min_choices", "max_turns", "min_turns", "n_storylines", "min_storylines")
+PROFILE_WEIGHT = 4.0
+
+
+def branch_profile(tree: DialogStructureTree) -> Dict[str, float]:
+    """Доли нод каждого типа ветки"""
+    counts = Counter(
+        (node.metadata.branch_type or BranchType.MAIN_PATH).value if node.metadata else BranchType.MAIN_PATH.value
+        for node in tree.nodes.values()
+    )
+    total = sum(counts.values()) or 1
+    return {branch_type.value: counts[branch_type.value] / total for branch_type in BranchType}
+
+
+@dataclass
+class StructureTemplate:
+    """Скелет дерева с ключом подбора"""
+    goal_type: str
+    constraints: StructureConstraints
+    tree: DialogStructureTree
+    profile: Dict[str, float] = field(default_factory=dict)
+    depth: int = 0
+    max_choices: int = 0
+    n_leaves: int = 0
+
+    @classmethod
+    def from_tree(
+        cls, goal_type: str, constraints: Optional[StructureConstraints], tree: DialogStructureTree
+    ) -> "StructureTemplate":
+        depths: Dict[str, int] = {}
+        for node in bfs(tree, tree.root_node_id, yield_objects=True):
+            parents = [depths[p] for p in node.parent_node_ids or [] if p in depths]
+            depths[node.node_id] = max(parents) + 1 if parents else 1
+        return cls(
+            goal_type=goal_type,
+            constraints=constraints or StructureConstraints(),
+            tree=tree,
+            profile=branch_profile(tree),
+            depth=max(depths.values(), default=0),
+            max_choices=max((len(node.child_node_ids or []) for node in tree.nodes.values()), default=0),
+            n_leaves=sum(not node.child_node_ids for node in tree.nodes.values()),
+        )
+
+    def fits(self, constraints: StructureConstraints) -> bool:
+        """Скелет не нарушает жестких ограничений запроса"""
+        if constraints.max_turns is not None and self.depth > constraints.max_turns:
+            return False
+        if constraints.min_turns is not None and self.depth < constraints.min_turns:
+            return False
+        if constraints.max_choices is not None and self.max_choices > constraints.max_choices:
+            return False
+        if constraints.min_choices is not None and self.max_choices < constraints.min_choices:
+            return False
+        for storylines in (constraints.n_storylines, constraints.min_storylines):
+            if storylines is not None and self.n_leaves < storylines:
+                return False
+        return True
+
+    def distance(self, constraints: StructureConstraints, profile: Optional[Dict[str, float]] = None) -> float:
+        """Расстояние до запроса: разница числовых ограничений и (опционально) профиля веток"""
+        distance = 0.0
+        for name in _CONSTRAINT_FIELDS:
+            mine, theirs = getattr(self.constraints, name), getattr(constraints, name)
+            if mine is None or theirs is None:
+                distance += 0.0 if mine == theirs else 1.0
+            else:
+                distance += abs(mine - theirs)
+        if profile:
+            distance += PROFILE_WEIGHT * sum(abs(self.profile.get(k, 0.0) - v) for k, v in profile.items())
+        return distance
+
+
+class TemplateLibrary:
+    """Скелеты деревьев, сгруппированные по типу цели"""
+
+    def __init__(self, templates: Iterable[StructureTemplate] = ()):
+        self._by_goal: Dict[str, List[StructureTemplate]] = {}
+        for template in templates:
+            self._by_goal.setdefault(template.goal_type, []).append(template)
+
+    def __len__(self) -> int:
+        return sum(len(templates) for templates in self._by_goal.values())
+
+    def add(self, request: TreeGenerationRequest, tree: DialogStructureTree) -> StructureTemplate:
+        """Добавляет проверенное дерево как скелет для запросов с той же целью"""
+        template = StructureTemplate.from_tree(request.goal.goal_type, request.constraints, tree)
+        self._by_goal.setdefault(template.goal_type, []).append(template)
+        return template
+
+    @classmethod
+    def from_corpus(cls, store: CorpusStore, is_valid: Optional[bool] = True) -> "TemplateLibrary":
+        """Скелеты из корпуса: деревья структуры с сохраненным запросом (по умолчанию - прошедшие валидацию)"""
+        library = cls()
+        for record in store.export(kind=STRUCTURE, is_valid=is_valid):
+            if record["request"] is None:
+                continue
+            request = TreeGenerationRequest.model_validate(record["request"])
+            library.add(request, DialogStructureTree.model_validate(record["dialog_tree"]))
+        return library
+
+    def match(
+        self,
+        request: TreeGenerationRequest,
+        profile: Optional[Dict[str, float]] = None,
+        max_distance: Optional[float] = None
+    ) -> Optional[StructureTemplate]:
+        """Ближайший подходящий скелет с тем же типом цели; None - строить дерево с нуля"""
+        constraints = request.constraints or StructureConstraints()
+        best, best_distance = None, None
+        for template in self._by_goal.get(request.goal.goal_type, []):
+            if not template.fits(constraints):
+                continue
+            distance = template.distance(constraints, profile)
+            if best_distance is None or distance < best_distance:
+                best, best_distance = template, distance
+        if best is None or (max_distance is not None and best_distance > max_distance):
+            return None
+        return best
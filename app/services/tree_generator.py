@@ -1,58 +1,151 @@
 """
 Генератор структуры диалогового дерева
 """
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+from typing_extensions import TypedDict, Required
+from pydantic import TypeAdapter, ValidationError
+
 from app.schemas import (
-    NodeMetadata, DialogStructureNode, DialogStructureTree, 
+    DialogStructureNode, DialogStructureTree,
     TreeGenerationRequest, TreeGenerationResponse
 )
-from app.utils import PromptFactory
+from app.utils import PromptFactory, deadline_scope, expected_tree_output, expected_retheme_output, traced
 from .llm_client import llm_clients
+from .templates import StructureTemplate, TemplateLibrary
+
+
+class _GeneratedTree(TypedDict, total=False):
+    """Сырой ответ LLM со структурой дерева"""
+    root_node_id: Required[str]
+    nodes: Dict[str, DialogStructureNode]
+    goal_achievement_paths: Optional[List[List[str]]]
+
+
+class _NodeTheme(TypedDict):
+    """Новые описания ноды скелета"""
+    narrative_summary: str
+    player_goal_hint: str
+
+
+class _RethemedTree(TypedDict):
+    """Сырой ответ LLM с описаниями нод скелета"""
+    nodes: Dict[str, _NodeTheme]
+
+
+# адаптеры компилируются один раз: ответ LLM валидируется за один проход
+_generated_tree_adapter = TypeAdapter(_GeneratedTree)
+_rethemed_tree_adapter = TypeAdapter(_RethemedTree)
 
 
 class TreeGenerator:
     """Генератор структуры диалогового дерева"""
     
-    def __init__(self):
+    def __init__(self, templates: Optional[TemplateLibrary] = None, max_template_distance: Optional[float] = 3.0):
+        """
+        :param templates: библиотека скелетов (None - дерево всегда строится с нуля)
+        :param max_template_distance: предел расстояния скелета до запроса (None - без предела)
+        """
         self.llm = llm_clients.tree
+        self.templates = templates
+        self.max_template_distance = max_template_distance
+
+    def match_template(self, request: TreeGenerationRequest) -> Optional[StructureTemplate]:
+        """Скелет для запроса в пределах max_template_distance; None - строить дерево с нуля"""
+        if self.templates is None:
+            return None
+        return self.templates.match(request, max_distance=self.max_template_distance)
     
+    def tree_prompt(self, request: TreeGenerationRequest) -> Tuple[str, int]:
+        """Промпт генерации структуры и max_tokens под него"""
+        prompt = PromptFactory.build_prompt("tree_generation", request=request)
+        return prompt, self.llm.max_tokens_for(prompt, expected_tree_output(request.constraints))
+
     async def _generate_tree(
         self,
         request: TreeGenerationRequest
     ) -> Dict[str, Any]:
         """Возвращаем сырую сгенерированную структуру дерева"""
-        prompt = PromptFactory.build_prompt("tree_generation", request=request)
+        prompt, max_tokens = self.tree_prompt(request)
         generated_tree = await self.llm.generate(
             prompt=prompt,
+            max_tokens=max_tokens,
         )
         return generated_tree
     
-    def _structure_tree(self, generated_tree: Dict[str, Any]) -> DialogStructureTree:
+    def retheme_prompt(self, request: TreeGenerationRequest, template: StructureTemplate) -> Tuple[str, int]:
+        """Промпт переписывания описаний нод скелета и max_tokens под него"""
+        prompt = PromptFactory.build_prompt("tree_retheme", request=request, skeleton=template.tree)
+        return prompt, self.llm.max_tokens_for(prompt, expected_retheme_output(len(template.tree.nodes)))
+
+    @staticmethod
+    def apply_themes(template: StructureTemplate, response: Dict[str, Any]) -> Optional[DialogStructureTree]:
+        """Скелет с новыми описаниями нод; None - ответ не разобран или не покрывает все ноды"""
+        skeleton = template.tree
+        try:
+            themes = _rethemed_tree_adapter.validate_python(response)["nodes"]
+        except ValidationError:
+            return None
+        if not skeleton.nodes.keys() <= themes.keys():
+            return None
+
+        # связи и метаданные берутся из копии скелета: шаблон библиотеки не делит с деревом списки и метаданные
+        tree = skeleton.model_copy(deep=True)
+        nodes = {
+            node_id: node.model_copy(update={
+                "narrative_summary": themes[node_id]["narrative_summary"],
+                "player_goal_hint": themes[node_id]["player_goal_hint"],
+            })
+            for node_id, node in tree.nodes.items()
+        }
+        return tree.model_copy(update={"nodes": nodes})
+
+    @traced("tree.retheme")
+    async def _retheme_tree(
+        self,
+        request: TreeGenerationRequest,
+        template: StructureTemplate
+    ) -> Optional[DialogStructureTree]:
+        """Переписывает описания нод скелета под запрос; None - ответ не разобран или не покрывает все ноды"""
+        prompt, max_tokens = self.retheme_prompt(request, template)
+        response = await self.llm.generate(prompt=prompt, max_tokens=max_tokens)
+        return self.apply_themes(template, response)
+
+    @traced("tree.structure")
+    def structure_tree(self, generated_tree: Dict[str, Any]) -> DialogStructureTree:
         """Преобразует сгенерированное дерево в DialogTree"""
-        nodes = {}
-        for node_id, node_info in generated_tree.get("nodes", {}).items():
-            meta = node_info.get("metadata", {})
-            node_info['metadata'] = NodeMetadata(
-                **meta
-            )
-            
-            nodes[node_id] = DialogStructureNode(
-                **node_info
-            )
-        
-        return DialogStructureTree(
-            root_node_id=generated_tree["root_node_id"],
-            nodes=nodes,
-            goal_achievement_paths=generated_tree.get("goal_achievement_paths", [])
-        )
+        for node_info in generated_tree.get("nodes", {}).values():
+            node_info.setdefault("metadata", {})
+
+        validated = _generated_tree_adapter.validate_python(generated_tree)
+
+        # узлы уже провалидированы адаптером, повторно дерево не проверяем
+        return DialogStructureTree._construct_trusted({
+            "root_node_id": validated["root_node_id"],
+            "nodes": validated.get("nodes", {}),
+            "goal_achievement_paths": validated.get("goal_achievement_paths", []),
+            "metadata": None,
+        })
     
+    @traced("tree.generate")
     async def generate_structure_tree(
         self,
-        request: TreeGenerationRequest
+        request: TreeGenerationRequest,
+        timeout: Optional[float] = None
     ) -> TreeGenerationResponse:
-        """Генерация DialogGenerationResponse"""
-        generated_tree = await self._generate_tree(request)
-        dialog_tree = self._structure_tree(generated_tree)
+        """
+        Генерация DialogGenerationResponse.
+        При подходящем скелете в библиотеке шаблонов переписываются только описания его нод.
+
+        :param timeout: Дедлайн в секундах, по истечении - DeadlineExceeded
+        """
+        with deadline_scope(timeout):
+            dialog_tree = None
+            template = self.match_template(request)
+            if template is not None:
+                dialog_tree = await self._retheme_tree(request, template)
+            if dialog_tree is None:
+                generated_tree = await self._generate_tree(request)
+                dialog_tree = self.structure_tree(generated_tree)
         return TreeGenerationResponse(
             dialog_tree=dialog_tree
         )
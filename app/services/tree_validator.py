@@ -1,7 +1,7 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 from app.schemas import TreeValidationRequest, TreeValidationResponse
-from app.utils import PromptFactory
+from app.utils import PromptFactory, VALIDATION_TOKENS, deadline_scope, traced
 from .llm_client import llm_clients
 
 
@@ -10,15 +10,14 @@ class TreeValidator:
     def __init__(self):
         self.llm = llm_clients.tree_validator
 
-    async def _gen_eval(self, request: TreeValidationRequest) -> Dict[str, Any]:
-        """Генерация оценок"""
+    def eval_prompt(self, request: TreeValidationRequest) -> Tuple[str, int]:
+        """Промпт оценки дерева и max_tokens под него"""
         prompt = PromptFactory.build_prompt("tree_validation", request=request)
-        response = await self.llm.generate(prompt=prompt)
-        return response
-    
-    async def validate(self, request: TreeValidationRequest) -> TreeValidationResponse:
-        """Логика для определения флага валидности дерева"""
-        gen_respose = await self._gen_eval(request)
+        return prompt, self.llm.max_tokens_for(prompt, VALIDATION_TOKENS)
+
+    @staticmethod
+    def to_response(gen_respose: Dict[str, Any]) -> TreeValidationResponse:
+        """Флаг валидности по оценкам: любая оценка не выше 2 - дерево невалидно"""
         scores = gen_respose.get("scores")
         is_valid = False if min(scores.values()) <= 2. else True
 
@@ -26,3 +25,20 @@ class TreeValidator:
             is_valid=is_valid,
             **gen_respose
         )
+
+    async def _gen_eval(self, request: TreeValidationRequest) -> Dict[str, Any]:
+        """Генерация оценок"""
+        prompt, max_tokens = self.eval_prompt(request)
+        response = await self.llm.generate(prompt=prompt, max_tokens=max_tokens)
+        return response
+    
+    @traced("tree.validate")
+    async def validate(self, request: TreeValidationRequest, timeout: Optional[float] = None) -> TreeValidationResponse:
+        """
+        Логика для определения флага валидности дерева
+
+        :param timeout: Дедлайн в секундах, по истечении - DeadlineExceeded
+        """
+        with deadline_scope(timeout):
+            gen_respose = await self._gen_eval(request)
+        return self.to_response(gen_respose)
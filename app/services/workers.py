@@ -0,0 +1,301 @@
+"""
+Пул воркеров поверх очереди заданий: генерация NPC и отдельных нод в нескольких процессах
+
+Задания:
+    npc     - TreeGenerationRequest: строит структуру и ставит задания node на каждую ноду
+    content - ContentGenerationRequest: готовая структура, сразу ставит задания node
+    node    - заполнение одной ноды; запрос берется из результата родительского задания
+
+Запуск воркеров (процессы одного хоста с локальным файлом очереди, см. job_queue):
+    python -m app.services.workers queue.db --processes 4 --concurrency 8
+"""
+import argparse
+import asyncio
+import functools
+import multiprocessing
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.schemas import (
+    DialogNode, DialogTree, TreeGenerationRequest,
+    ContentGenerationRequest, ContentGenerationResponse
+)
+from app.utils import DialogStreamWriter
+from .content_writer import ContentWriter
+from .job_queue import DONE, FAILED, Job, JobQueue
+from .scheduler import node_priorities
+from .tree_generator import TreeGenerator
+
+
+def submit_npc(queue: JobQueue, request: TreeGenerationRequest, batch_id: Optional[str] = None) -> str:
+    """Ставит полную генерацию NPC (структура и контент), возвращает ID задания"""
+    return queue.enqueue("npc", request.model_dump(mode="json"), batch_id=batch_id)
+
+
+def submit_content(queue: JobQueue, request: ContentGenerationRequest, batch_id: Optional[str] = None) -> str:
+    """Ставит заполнение готовой структуры, возвращает ID задания"""
+    return queue.enqueue("content", request.model_dump(mode="json"), batch_id=batch_id)
+
+
+def _node_results(queue: JobQueue, job_id: str) -> Optional[Tuple[ContentGenerationRequest, List[Dict[str, Any]]]]:
+    """
+    Запрос NPC и задания его нод, если все они завершены (выполнены или провалены); иначе None
+
+    :raises RuntimeError: если провалено само задание NPC - дерева для сборки нет
+    """
+    job = queue.job(job_id)
+    if job is None:
+        raise KeyError(f"Unknown job {job_id}")
+    if job["status"] == FAILED:
+        raise RuntimeError(f"Job {job_id} failed: {job['error']}")
+    if job["status"] != DONE:
+        return None
+    node_jobs = queue.children(job_id)
+    if any(node_job["status"] not in (DONE, FAILED) for node_job in node_jobs):
+        return None
+    return ContentGenerationRequest.model_validate(job["result"]), node_jobs
+
+
+def assemble(queue: JobQueue, job_id: str) -> Optional[ContentGenerationResponse]:
+    """
+    Собирает заполненное дерево NPC из результатов заданий node; None, если они еще не готовы.
+    Ноды проваленных заданий остаются пустыми и перечисляются в unfilled_node_ids.
+
+    :raises RuntimeError: если провалено само задание NPC
+    """
+    results = _node_results(queue, job_id)
+    if results is None:
+        return None
+    request, node_jobs = results
+    tree = DialogTree.from_structure(request.dialog_tree)
+    filled = set()
+    for job in node_jobs:
+        if job["status"] == DONE:
+            node_id = job["payload"]["node_id"]
+            tree.nodes[node_id] = DialogNode.model_validate(job["result"])
+            filled.add(node_id)
+    return ContentWriter.snapshot(tree, filled)
+
+
+def failures(queue: JobQueue, batch_id: str) -> Dict[str, str]:
+    """Проваленные задания пакета: ID задания -> ошибка (NPC без структуры и незаполненные ноды)"""
+    return {job["id"]: job["error"] for job in queue.jobs(batch_id) if job["status"] == FAILED}
+
+
+def collect(queue: JobQueue, batch_id: str) -> Dict[str, Optional[ContentGenerationResponse]]:
+    """
+    Результаты NPC пакета по ID их заданий (None - еще не готов, частичный - часть нод провалена);
+    проваленные задания NPC сюда не входят, их ошибки - в failures
+    """
+    return {
+        job["id"]: assemble(queue, job["id"])
+        for kind in ("npc", "content")
+        for job in queue.jobs(batch_id, kind=kind)
+        if job["status"] != FAILED
+    }
+
+
+def stream_batch(queue: JobQueue, batch_id: str, writer: DialogStreamWriter) -> List[str]:
+    """
+    Пишет готовые NPC пакета в поток по одному, не собирая их в памяти; ноды проваленных заданий
+    пишутся пустыми и перечисляются в записи о завершении. Возвращает ID заданий, которые еще не готовы
+    (проваленные задания NPC пропускаются, их ошибки - в failures)
+    """
+    pending = []
+    for kind in ("npc", "content"):
+        for job in queue.jobs(batch_id, kind=kind):
+            if job["status"] == FAILED:
+                continue
+            results = _node_results(queue, job["id"])
+            if results is None:
+                pending.append(job["id"])
+                continue
+            request, node_jobs = results
+            structure = request.dialog_tree
+            writer.begin(job["id"], structure, request)
+            unfilled = []
+            for node_job in node_jobs:
+                if node_job["status"] == DONE:
+                    writer.write_node(job["id"], DialogNode.model_validate(node_job["result"]))
+                else:
+                    node_id = node_job["payload"]["node_id"]
+                    writer.write_node(job["id"], DialogNode.from_structure(structure.nodes[node_id]))
+                    unfilled.append(node_id)
+            writer.end(job["id"], len(node_jobs), unfilled)
+    return pending
+
+
+class QueueWorker:
+    """
+    Воркер одного процесса: держит до concurrency заданий в работе и продлевает их аренду.
+    Запросы к базе очереди выполняются в отдельном потоке, чтобы ожидание блокировки
+    не останавливало цикл событий (и heartbeat других заданий).
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        worker_id: Optional[str] = None,
+        concurrency: int = 4,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 0.2,
+        max_attempts: int = 3,
+        request_cache_size: int = 64,
+        tree_generator: Optional[TreeGenerator] = None,
+        content_writer: Optional[ContentWriter] = None
+    ):
+        self.queue = queue
+        self.worker_id = worker_id or f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.request_cache_size = request_cache_size
+        self.tree_generator = tree_generator or TreeGenerator()
+        self.content_writer = content_writer or ContentWriter()
+        self.processed = 0
+        # кэш запросов родительских заданий (LRU): ноды одного NPC обычно идут подряд
+        self._requests: "OrderedDict[str, ContentGenerationRequest]" = OrderedDict()
+        self._db: Optional[ThreadPoolExecutor] = None
+
+    async def _call(self, method: Callable[..., Any], *args, **kwargs) -> Any:
+        """Вызов метода очереди в потоке базы; один поток - запросы и транзакции не перемежаются"""
+        if self._db is None:
+            self._db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-queue")
+        return await asyncio.get_running_loop().run_in_executor(self._db, functools.partial(method, *args, **kwargs))
+
+    async def run(self, stop_when_idle: bool = False) -> int:
+        """Обрабатывает задания; stop_when_idle - выйти, когда в очереди не осталось работы"""
+        try:
+            await asyncio.gather(*(self._loop(stop_when_idle) for _ in range(self.concurrency)))
+        finally:
+            if self._db is not None:
+                self._db.shutdown(wait=True)
+                self._db = None
+        return self.processed
+
+    async def _loop(self, stop_when_idle: bool) -> None:
+        while True:
+            job = await self._call(
+                self.queue.lease, self.worker_id, lease_seconds=self.lease_seconds, max_attempts=self.max_attempts
+            )
+            if job is None:
+                counts = await self._call(self.queue.counts)
+                if stop_when_idle and not counts["pending"] and not counts["leased"]:
+                    return
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self.process(job)
+
+    async def process(self, job: Job) -> None:
+        """Выполняет задание; при потере аренды отменяет его, чтобы не тратить токены впустую"""
+        work = asyncio.ensure_future(self.handle(job))
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        try:
+            await asyncio.wait((work, heartbeat), return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+                return
+            result, children = work.result()
+        except asyncio.CancelledError:
+            work.cancel()
+            raise
+        except Exception as e:
+            await self._call(
+                self.queue.fail, job.id, self.worker_id, f"{type(e).__name__}: {e}", max_attempts=self.max_attempts
+            )
+        else:
+            await self._call(self.queue.complete, job.id, self.worker_id, result, children=children)
+            self.processed += 1
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self._call(self.queue.heartbeat, job.id, self.worker_id, lease_seconds=self.lease_seconds):
+                return
+
+    async def handle(self, job: Job):
+        """Выполняет задание, возвращает (результат, дочерние задания)"""
+        if job.kind == "npc":
+            request = TreeGenerationRequest.model_validate(job.payload)
+            structure = await self.tree_generator.generate_structure_tree(request)
+            content_request = ContentGenerationRequest(
+                character=request.character,
+                goal=request.goal,
+                constraints=request.constraints,
+                dialog_tree=structure.dialog_tree
+            )
+            return self._fan_out(content_request)
+
+        if job.kind == "content":
+            return self._fan_out(ContentGenerationRequest.model_validate(job.payload))
+
+        if job.kind == "node":
+            request = await self._parent_request(job.parent_id)
+            node = DialogNode.from_structure(request.dialog_tree.nodes[job.payload["node_id"]])
+            filled = await self.content_writer.generate_node(node=node, request=request)
+            return filled.model_dump(mode="json"), []
+
+        raise ValueError(f"Unknown job kind: {job.kind}")
+
+    @staticmethod
+    def _fan_out(request: ContentGenerationRequest):
+        """Результат - сам запрос; по заданию node на ноду, основная линия с наивысшим приоритетом"""
+        priorities = node_priorities(request.dialog_tree)
+        children = [("node", {"node_id": node_id}, priorities[node_id]) for node_id in request.dialog_tree.nodes]
+        return request.model_dump(mode="json"), children
+
+    async def _parent_request(self, parent_id: str) -> ContentGenerationRequest:
+        request = self._requests.get(parent_id)
+        if request is not None:
+            self._requests.move_to_end(parent_id)
+            return request
+        result = await self._call(self.queue.result, parent_id)
+        request = self._requests[parent_id] = ContentGenerationRequest.model_validate(result)
+        if len(self._requests) > self.request_cache_size:
+            self._requests.popitem(last=False)
+        return request
+
+
+WorkerFactory = Callable[[JobQueue], QueueWorker]
+
+
+def _worker_main(path: str, concurrency: int, stop_when_idle: bool, factory: Optional[WorkerFactory]) -> None:
+    with JobQueue(path) as queue:
+        worker = factory(queue) if factory else QueueWorker(queue)
+        worker.concurrency = concurrency
+        asyncio.run(worker.run(stop_when_idle=stop_when_idle))
+
+
+def run_worker_processes(
+    path: str,
+    processes: int,
+    concurrency: int = 4,
+    stop_when_idle: bool = True,
+    factory: Optional[WorkerFactory] = None
+) -> None:
+    """Запускает processes процессов-воркеров над одной очередью и ждет их завершения"""
+    workers: List[multiprocessing.Process] = [
+        multiprocessing.Process(target=_worker_main, args=(path, concurrency, stop_when_idle, factory))
+        for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Воркеры генерации диалогов над очередью SQLite")
+    parser.add_argument("queue", help="Путь к файлу очереди")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", type=int, default=4, help="Заданий в работе на процесс")
+    parser.add_argument("--forever", action="store_true", help="Не завершаться, когда очередь пуста")
+    args = parser.parse_args()
+    run_worker_processes(args.queue, args.processes, args.concurrency, stop_when_idle=not args.forever)
@@ -5,11 +5,33 @@ from .config import settings, Settings, LLMConfig
 from .prompts import PromptFactory
 from .system_prompts import SystemPrompts
 from .tree_iterator import get_ancestors, bfs
+from .tokens import (
+    PromptTooLargeError, estimate_tokens, plan_max_tokens,
+    expected_node_output, expected_tree_output, expected_retheme_output,
+    expected_translation_output, VALIDATION_TOKENS
+)
+from .deadline import DeadlineExceeded, deadline_scope, remaining, with_deadline
+from .tracing import Span, Trace, tracing, span, annotate, traced
+from .minhash import MinHasher, MinHashLSH, shingles, estimate_jaccard
+from .dialog_stream import DialogStreamWriter, iter_records, iter_nodes, iter_npcs, load_tree
+from .tree_arrays import TreeArrays, BRANCH_TYPES, UNTYPED, CHILDREN, CHOICES, MISSING
+from .dialog_pack import pack_dialog_tree, write_dialog_pack, PackedDialogTree
+from .sqlite import ImmediateTransaction
 
 
 __all__ = [
     'settings', 'Settings', 'LLMConfig', 
     'PromptFactory', 'SystemPrompts', 
-    'get_ancestors', 'bfs'
+    'get_ancestors', 'bfs',
+    'PromptTooLargeError', 'estimate_tokens', 'plan_max_tokens',
+    'expected_node_output', 'expected_tree_output', 'expected_retheme_output',
+    'expected_translation_output', 'VALIDATION_TOKENS',
+    'DeadlineExceeded', 'deadline_scope', 'remaining', 'with_deadline',
+    'Span', 'Trace', 'tracing', 'span', 'annotate', 'traced',
+    'MinHasher', 'MinHashLSH', 'shingles', 'estimate_jaccard',
+    'DialogStreamWriter', 'iter_records', 'iter_nodes', 'iter_npcs', 'load_tree',
+    'TreeArrays', 'BRANCH_TYPES', 'UNTYPED', 'CHILDREN', 'CHOICES', 'MISSING',
+    'pack_dialog_tree', 'write_dialog_pack', 'PackedDialogTree',
+    'ImmediateTransaction'
 ]
 
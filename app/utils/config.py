@@ -1,7 +1,8 @@
 """
 Конфигурации
 """
-from typing import Optional
+from typing import List, Optional
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 
@@ -11,6 +12,13 @@ class LLMConfig(BaseSettings):
     model: str = "deepseek-chat"
     temperature: float = 0.3
     max_tokens: int = 4096
+    context_window: int = 65536
+    weight: float = Field(1.0, gt=0)  # доля нагрузки в пуле бэкендов роли
+
+    # хеджирование: дублирующий запрос, если ответа нет дольше квантиля задержек (None - выключено)
+    hedge_quantile: Optional[float] = None
+    hedge_min_delay: float = 1.0
+    hedge_min_samples: int = 20
 
 
 class Settings(BaseSettings):
@@ -22,6 +30,16 @@ class Settings(BaseSettings):
     llm_content: Optional[LLMConfig] = None
     llm_tree_validator: Optional[LLMConfig] = None
     llm_regenerator: Optional[LLMConfig] = None
+    llm_translator: Optional[LLMConfig] = None
+    llm_hedge: Optional[LLMConfig] = None  # резервный агент для дублирующих запросов
+
+    # дополнительные бэкенды ролей (JSON-список конфигов), нагрузка распределяется по пулу
+    llm_base_pool: List[LLMConfig] = []
+    llm_tree_pool: List[LLMConfig] = []
+    llm_content_pool: List[LLMConfig] = []
+    llm_tree_validator_pool: List[LLMConfig] = []
+    llm_regenerator_pool: List[LLMConfig] = []
+    llm_translator_pool: List[LLMConfig] = []
     
     # Валидация
     max_self_review_iterations: int = 2
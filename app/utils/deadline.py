@@ -0,0 +1,54 @@
+"""
+Дедлайны, распространяемые от верхнеуровневого вызова до каждого запроса к LLM
+
+Дедлайн хранится в контекстной переменной, поэтому его видят и задачи,
+созданные внутри области (asyncio копирует контекст при создании задачи).
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Истек дедлайн верхнеуровневого вызова"""
+
+
+@contextmanager
+def deadline_scope(timeout: Optional[float]) -> Iterator[Optional[float]]:
+    """Область с дедлайном через timeout секунд (вложенная область не может продлить внешний)"""
+    current = _deadline.get()
+    if timeout is not None:
+        new = time.monotonic() + timeout
+        current = new if current is None else min(current, new)
+    token = _deadline.set(current)
+    try:
+        yield current
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Секунд до дедлайна (None - дедлайна нет)"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+async def with_deadline(awaitable: Awaitable[T]) -> T:
+    """Ожидание с отменой по текущему дедлайну"""
+    timeout = remaining()
+    if timeout is None:
+        return await awaitable
+    if timeout <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded("Deadline exceeded")
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as e:
+        raise DeadlineExceeded("Deadline exceeded") from e
@@ -0,0 +1,325 @@
+"""
+Компактный бинарный формат заполненного дерева диалогов для игровых клиентов
+
+Все секции - массивы uint32 (little-endian) с выравниванием по 4 байта,
+строки лежат в общей интернированной таблице, связи между нодами - целые индексы.
+Загрузчик отображает файл в память и читает ноды без разбора всего файла.
+
+Раскладка файла:
+    заголовок (_HEADER)
+    node_id[n] npc_text[n] narrative_summary[n] player_goal_hint[n] node_meta[n]
+    parent_offsets[n+1] parents[]       (индексы строк)
+    child_offsets[n+1] children[]       (индексы строк)
+    choice_offsets[n+1] choice_text[m] choice_next[m] choice_next_id[m]
+    path_offsets[p+1] path_items[]      (индексы строк)
+    string_offsets[s+1] string_blob     (utf-8)
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from app.schemas import (
+    BranchType, Choice, NodeMetadata, DialogNode, DialogTree, ContentGenerationResponse
+)
+
+MAGIC = b"NPCD"
+VERSION = 1
+
+# magic, version, n_nodes, n_choices, n_parents, n_children, n_paths, n_path_items, n_strings,
+# root_node (индекс ноды), root_node_id и tree_metadata (индексы строк, метаданные - json)
+_HEADER = struct.Struct("<4sIIIIIIIIIII")
+
+NONE = 0xFFFFFFFF  # отсутствующая строка или нода
+_NO_BYTE = 0xFF
+
+_BRANCH_TYPES: List[BranchType] = list(BranchType)
+_BRANCH_CODES: Dict[BranchType, int] = {branch: code for code, branch in enumerate(_BRANCH_TYPES)}
+
+
+class _StringTable:
+    """Интернирование строк: одинаковые строки хранятся один раз"""
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.blobs: List[bytes] = []
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return NONE
+        idx = self.index.get(value)
+        if idx is None:
+            idx = self.index[value] = len(self.blobs)
+            self.blobs.append(value.encode("utf-8"))
+        return idx
+
+
+def _pack_meta(node: DialogNode) -> int:
+    """branch_type | difficulty << 8 | estimated_num_choices << 16 (0xFF - None)"""
+    meta = node.metadata
+    branch = _BRANCH_CODES[meta.branch_type] if meta and meta.branch_type is not None else _NO_BYTE
+    difficulty = meta.difficulty if meta and meta.difficulty is not None else _NO_BYTE
+    n_choices = node.estimated_num_choices if node.estimated_num_choices is not None else _NO_BYTE
+    has_meta = 0 if meta is None else 1
+    return branch | difficulty << 8 | n_choices << 16 | has_meta << 24
+
+
+def _unpack_meta(code: int) -> Tuple[Optional[BranchType], Optional[int], Optional[int], bool]:
+    branch, difficulty, n_choices = code & 0xFF, code >> 8 & 0xFF, code >> 16 & 0xFF
+    return (
+        None if branch == _NO_BYTE else _BRANCH_TYPES[branch],
+        None if difficulty == _NO_BYTE else difficulty,
+        None if n_choices == _NO_BYTE else n_choices,
+        bool(code >> 24 & 1),
+    )
+
+
+def _flatten(lists: List[List[int]]) -> Tuple[array, array]:
+    """Список списков -> (offsets[len+1], items[])"""
+    offsets, items = array("I", [0]), array("I")
+    for values in lists:
+        items.extend(values)
+        offsets.append(len(items))
+    return offsets, items
+
+
+def pack_dialog_tree(tree: Union[DialogTree, ContentGenerationResponse]) -> bytes:
+    """Компилирует заполненное дерево в бинарный формат"""
+    if isinstance(tree, ContentGenerationResponse):
+        tree = tree.dialog_tree
+
+    strings = _StringTable()
+    node_ids = list(tree.nodes)
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+    columns = [array("I") for _ in range(5)]
+    parents, children, choices = [], [], []
+    choice_text, choice_next, choice_next_id = array("I"), array("I"), array("I")
+
+    for node_id in node_ids:
+        node = tree.nodes[node_id]
+        for column, value in zip(columns, (
+            strings.add(node_id), strings.add(node.npc_text),
+            strings.add(node.narrative_summary), strings.add(node.player_goal_hint),
+            _pack_meta(node),
+        )):
+            column.append(value)
+
+        parents.append([strings.add(i) for i in node.parent_node_ids or []])
+        children.append([strings.add(i) for i in node.child_node_ids or []])
+
+        node_choices = node.choices or []
+        for choice in node_choices:
+            choice_text.append(strings.add(choice.text))
+            choice_next.append(node_index.get(choice.next_node_id, NONE))
+            choice_next_id.append(strings.add(choice.next_node_id))
+        choices.append(len(node_choices))
+
+    choice_offsets = array("I", [0])
+    for count in choices:
+        choice_offsets.append(choice_offsets[-1] + count)
+
+    parent_offsets, parent_items = _flatten(parents)
+    child_offsets, child_items = _flatten(children)
+    paths = tree.goal_achievement_paths
+    path_offsets, path_items = _flatten([[strings.add(i) for i in path] for path in paths or []])
+    tree_metadata = strings.add(json.dumps(tree.metadata, ensure_ascii=False) if tree.metadata is not None else None)
+    root = node_index.get(tree.root_node_id, NONE)
+    root_id = strings.add(tree.root_node_id)
+
+    string_offsets = array("I", [0])
+    for blob in strings.blobs:
+        string_offsets.append(string_offsets[-1] + len(blob))
+
+    header = _HEADER.pack(
+        MAGIC, VERSION, len(node_ids), len(choice_text), len(parent_items), len(child_items),
+        NONE if paths is None else len(paths), len(path_items), len(strings.blobs),
+        root, root_id, tree_metadata,
+    )
+    sections = [
+        *columns,
+        parent_offsets, parent_items, child_offsets, child_items,
+        choice_offsets, choice_text, choice_next, choice_next_id,
+        path_offsets if paths is not None else array("I", [0]), path_items,
+        string_offsets,
+    ]
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+
+    return b"".join([header, *(section.tobytes() for section in sections), *strings.blobs])
+
+
+def write_dialog_pack(tree: Union[DialogTree, ContentGenerationResponse], path: Union[str, Path]) -> int:
+    """Записывает дерево в файл, возвращает размер в байтах"""
+    data = pack_dialog_tree(tree)
+    Path(path).write_bytes(data)
+    return len(data)
+
+
+class PackedDialogTree:
+    """Дерево диалога поверх бинарного буфера (mmap или bytes) с произвольным доступом к нодам"""
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview, mmap.mmap]):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        (magic, version, n_nodes, n_choices, n_parents, n_children,
+         n_paths, n_path_items, n_strings, root, root_id, tree_metadata) = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported dialog pack: {magic!r} v{version}")
+
+        self.num_nodes = n_nodes
+        self.num_choices = n_choices
+        self._has_paths = n_paths != NONE
+        self.root_index = root  # NONE, если корня нет среди нод
+        self._root_id = root_id
+        self._tree_metadata = tree_metadata
+
+        n_paths = n_paths if self._has_paths else 0
+        sizes = [
+            n_nodes, n_nodes, n_nodes, n_nodes, n_nodes,
+            n_nodes + 1, n_parents, n_nodes + 1, n_children,
+            n_nodes + 1, n_choices, n_choices, n_choices,
+            n_paths + 1, n_path_items,
+            n_strings + 1,
+        ]
+        offset = _HEADER.size
+        sections = []
+        for size in sizes:
+            sections.append(self._u32(view, offset, size))
+            offset += 4 * size
+
+        (self._node_id, self._npc_text, self._summary, self._hint, self._meta,
+         self._parent_offsets, self._parents, self._child_offsets, self._children,
+         self._choice_offsets, self._choice_text, self._choice_next, self._choice_next_id,
+         self._path_offsets, self._path_items, self._string_offsets) = sections
+        self._blob = view[offset:]
+        self._node_index: Optional[Dict[str, int]] = None
+
+    @staticmethod
+    def _u32(view: memoryview, offset: int, size: int):
+        """Секция uint32 без копирования (на big-endian - с переворотом байт)"""
+        section = view[offset:offset + 4 * size]
+        if sys.byteorder == "little":
+            return section.cast("I")
+        swapped = array("I", section.tobytes())
+        swapped.byteswap()
+        return swapped
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "PackedDialogTree":
+        """Отображает файл в память только для чтения"""
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self) -> None:
+        """Освобождает все представления буфера и закрывает mmap"""
+        for value in vars(self).values():
+            if isinstance(value, memoryview):
+                value.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def __enter__(self) -> "PackedDialogTree":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.num_nodes
+
+    # --- строки ---
+
+    def raw_string(self, idx: int) -> Optional[memoryview]:
+        """utf-8 байты строки без копирования"""
+        if idx == NONE:
+            return None
+        return self._blob[self._string_offsets[idx]:self._string_offsets[idx + 1]]
+
+    def string(self, idx: int) -> Optional[str]:
+        raw = self.raw_string(idx)
+        return None if raw is None else str(raw, "utf-8")
+
+    def _strings(self, items, offsets, i: int) -> List[str]:
+        return [self.string(items[j]) for j in range(offsets[i], offsets[i + 1])]
+
+    # --- ноды ---
+
+    @property
+    def root_node_id(self) -> str:
+        return self.string(self._root_id)
+
+    def node_index(self, node_id: str) -> int:
+        """Индекс ноды по ID (индекс строится лениво при первом обращении)"""
+        if self._node_index is None:
+            self._node_index = {self.string(self._node_id[i]): i for i in range(self.num_nodes)}
+        return self._node_index[node_id]
+
+    def node_id(self, i: int) -> str:
+        return self.string(self._node_id[i])
+
+    def npc_text(self, i: int) -> Optional[str]:
+        return self.string(self._npc_text[i])
+
+    def num_node_choices(self, i: int) -> int:
+        return self._choice_offsets[i + 1] - self._choice_offsets[i]
+
+    def choices(self, i: int) -> List[Tuple[str, int]]:
+        """Варианты выбора ноды: (текст, индекс следующей ноды или NONE)"""
+        return [
+            (self.string(self._choice_text[j]), self._choice_next[j])
+            for j in range(self._choice_offsets[i], self._choice_offsets[i + 1])
+        ]
+
+    def next_node(self, i: int, choice_idx: int) -> int:
+        """Индекс ноды, в которую ведёт выбор choice_idx ноды i"""
+        start = self._choice_offsets[i]
+        if not 0 <= choice_idx < self._choice_offsets[i + 1] - start:
+            raise IndexError(f"Node {i} has no choice {choice_idx}")
+        return self._choice_next[start + choice_idx]
+
+    # --- обратное преобразование ---
+
+    def to_dialog_node(self, i: int) -> DialogNode:
+        branch_type, difficulty, n_choices, has_meta = _unpack_meta(self._meta[i])
+        metadata = NodeMetadata(branch_type=branch_type, difficulty=difficulty) if has_meta else None
+        return DialogNode(
+            node_id=self.node_id(i),
+            parent_node_ids=self._strings(self._parents, self._parent_offsets, i),
+            child_node_ids=self._strings(self._children, self._child_offsets, i),
+            metadata=metadata,
+            narrative_summary=self.string(self._summary[i]),
+            player_goal_hint=self.string(self._hint[i]),
+            estimated_num_choices=n_choices,
+            npc_text=self.npc_text(i),
+            choices=[
+                Choice(text=self.string(self._choice_text[j]), next_node_id=self.string(self._choice_next_id[j]))
+                for j in range(self._choice_offsets[i], self._choice_offsets[i + 1])
+            ],
+        )
+
+    def to_dialog_tree(self) -> DialogTree:
+        """Восстанавливает DialogTree (для инструментов и отладки)"""
+        tree_metadata: Optional[Dict[str, Any]] = None
+        if self._tree_metadata != NONE:
+            tree_metadata = json.loads(self.string(self._tree_metadata))
+
+        paths = None
+        if self._has_paths:
+            paths = [
+                self._strings(self._path_items, self._path_offsets, p)
+                for p in range(len(self._path_offsets) - 1)
+            ]
+
+        nodes = [self.to_dialog_node(i) for i in range(self.num_nodes)]
+        return DialogTree(
+            root_node_id=self.root_node_id,
+            nodes={node.node_id: node for node in nodes},
+            goal_achievement_paths=paths,
+            metadata=tree_metadata,
+        )
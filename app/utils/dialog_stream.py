@@ -0,0 +1,142 @@
+"""
+Потоковая запись и чтение результатов генерации в NDJSON
+
+Каждая строка - отдельная запись, записи разных NPC могут чередоваться:
+    {"type": "npc", "npc_id": ..., "root_node_id": ..., "goal_achievement_paths": ..., "metadata": ..., "request": ...}
+    {"type": "node", "npc_id": ..., "node": {...}}
+    {"type": "end", "npc_id": ..., "n_nodes": ..., "unfilled_node_ids": [...]}
+
+Нода пишется сразу после заполнения, поэтому писателю не нужно держать дерево в памяти,
+а читатель проходит файл построчно, не загружая деревья целиком.
+"""
+import json
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from app.schemas import DialogBaseTree, DialogNode, DialogTree
+from app.schemas.dialog import GenerationBaseRequest
+
+NPC = "npc"
+NODE = "node"
+END = "end"
+
+_REQUEST_FIELDS = {"character", "goal", "constraints"}
+
+
+class DialogStreamWriter:
+    """Пишет записи NDJSON по мере готовности и сбрасывает их на диск"""
+
+    def __init__(self, target: Union[str, Path, IO[str]], append: bool = False):
+        if isinstance(target, (str, Path)):
+            self._file = open(target, "a" if append else "w", encoding="utf-8")
+            self._owns_file = True
+        else:
+            self._file = target
+            self._owns_file = False
+        self.records = 0
+
+    def close(self) -> None:
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self) -> "DialogStreamWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+        self._file.flush()
+        self.records += 1
+
+    def begin(
+        self,
+        npc_id: str,
+        tree: DialogBaseTree,
+        request: Optional[GenerationBaseRequest] = None
+    ) -> None:
+        """Заголовок NPC: все поля дерева, кроме нод"""
+        self._write({
+            "type": NPC,
+            "npc_id": npc_id,
+            "root_node_id": tree.root_node_id,
+            "goal_achievement_paths": tree.goal_achievement_paths,
+            "metadata": tree.metadata,
+            "request": request.model_dump(mode="json", include=_REQUEST_FIELDS) if request is not None else None,
+        })
+
+    def write_node(self, npc_id: str, node: DialogNode) -> None:
+        self._write({"type": NODE, "npc_id": npc_id, "node": node.model_dump(mode="json")})
+
+    def end(self, npc_id: str, n_nodes: int, unfilled_node_ids: Iterable[str] = ()) -> None:
+        """NPC завершен: n_nodes записанных нод, незаполненные ноды (частичный результат)"""
+        self._write({"type": END, "npc_id": npc_id, "n_nodes": n_nodes, "unfilled_node_ids": list(unfilled_node_ids)})
+
+    def write_tree(
+        self,
+        npc_id: str,
+        tree: DialogTree,
+        request: Optional[GenerationBaseRequest] = None,
+        unfilled_node_ids: Iterable[str] = ()
+    ) -> None:
+        """Готовое дерево целиком: заголовок, ноды и завершение"""
+        self.begin(npc_id, tree, request)
+        for node in tree.nodes.values():
+            self.write_node(npc_id, node)
+        self.end(npc_id, len(tree.nodes), unfilled_node_ids)
+
+
+def iter_records(source: Union[str, Path, IO[str]]) -> Iterator[Dict[str, Any]]:
+    """Записи файла по одной (пустые строки и недописанный хвост пропускаются)"""
+    if isinstance(source, (str, Path)):
+        with open(source, "r", encoding="utf-8") as f:
+            yield from iter_records(f)
+        return
+    for line in source:
+        if not line.endswith("\n"):
+            # запись еще пишется (файл читается во время генерации)
+            return
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_nodes(
+    source: Union[str, Path, IO[str]],
+    npc_id: Optional[str] = None
+) -> Iterator[Tuple[str, DialogNode]]:
+    """Ноды (ID NPC, нода) по одной, без сборки деревьев"""
+    for record in iter_records(source):
+        if record["type"] == NODE and (npc_id is None or record["npc_id"] == npc_id):
+            yield record["npc_id"], DialogNode.model_validate(record["node"])
+
+
+def iter_npcs(source: Union[str, Path, IO[str]]) -> Iterator[Dict[str, Any]]:
+    """Записи о завершенных NPC (n_nodes и unfilled_node_ids)"""
+    for record in iter_records(source):
+        if record["type"] == END:
+            yield record
+
+
+def load_tree(source: Union[str, Path, IO[str]], npc_id: str) -> Optional[DialogTree]:
+    """Собирает дерево одного NPC (в памяти - только его ноды); None - NPC нет в файле"""
+    header, nodes = None, {}
+    for record in iter_records(source):
+        if record["npc_id"] != npc_id:
+            continue
+        if record["type"] == NPC:
+            header = record
+        elif record["type"] == NODE:
+            node = DialogNode.model_validate(record["node"])
+            nodes[node.node_id] = node
+    if header is None:
+        return None
+    return DialogTree(
+        root_node_id=header["root_node_id"],
+        nodes=nodes,
+        goal_achievement_paths=header["goal_achievement_paths"],
+        metadata=header["metadata"],
+    )
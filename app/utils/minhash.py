@@ -0,0 +1,134 @@
+"""
+MinHash и LSH по символьным шинглам для поиска почти одинаковых реплик
+
+Шинглы строятся по символам, а не по словам: русские словоформы отличаются окончаниями,
+и пословное сравнение пропускает перефразированные повторы. Хэши шинглов стабильны
+между процессами (blake2b с ключом), поэтому сигнатуры можно строить в разных воркерах.
+"""
+import hashlib
+import re
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+_MAX_HASH = (1 << 32) - 1
+_EMPTY = 1 << 62
+_OFFSET = 1 << 33  # сдвиг заимствованных значений: не совпадают с собственными значениями ячейки
+_NON_WORD = re.compile(r"[^\w]+")
+
+Signature = Tuple[int, ...]
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, без пунктуации и лишних пробелов"""
+    return _NON_WORD.sub(" ", text.lower().replace("ё", "е")).strip()
+
+
+def shingles(text: str, k: int = 5) -> Set[str]:
+    """Множество символьных k-грамм нормализованного текста"""
+    text = normalize(text)
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """
+    Сигнатуры MinHash в один проход (one permutation hashing): каждый шингл хэшируется
+    один раз и попадает в одну из num_perm ячеек, в ячейке хранится минимум.
+    Пустые ячейки заполняются из следующей непустой со сдвигом (densification),
+    поэтому сигнатуры пригодны для LSH, а стоимость не зависит от num_perm.
+    """
+
+    def __init__(self, num_perm: int = 64, k: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.k = k
+        self._key = seed.to_bytes(8, "little")
+
+    def signature(self, text: str) -> Signature:
+        num_perm, key = self.num_perm, self._key
+        bins = [_EMPTY] * num_perm
+        for shingle in shingles(text, self.k):
+            h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8, key=key).digest(), "little")
+            i, value = h % num_perm, (h // num_perm) & _MAX_HASH
+            if value < bins[i]:
+                bins[i] = value
+        filled = [i for i, value in enumerate(bins) if value != _EMPTY]
+        if not filled:
+            return tuple(bins)
+        if len(filled) < num_perm:
+            # пустая ячейка берет значение ближайшей непустой справа (по кругу) со сдвигом на расстояние
+            nxt = filled[0] + num_perm
+            for i in range(num_perm - 1, -1, -1):
+                if bins[i] != _EMPTY:
+                    nxt = i
+                else:
+                    bins[i] = bins[nxt % num_perm] + (nxt - i) * _OFFSET
+        return tuple(bins)
+
+
+def estimate_jaccard(a: Signature, b: Signature) -> float:
+    """Оценка сходства Жаккара по доле совпавших позиций сигнатур"""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def lsh_params(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Число полос и строк в полосе, при которых порог срабатывания (1/b)^(1/r)
+    ближе всего к threshold (с небольшим смещением вниз, чтобы реже пропускать повторы)
+    """
+    best = (num_perm, 1)
+    best_error = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - (threshold - 0.05))
+        if best_error is None or error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class MinHashLSH:
+    """Индекс LSH: сигнатура режется на полосы, кандидаты - ключи, совпавшие хотя бы по одной полосе"""
+
+    def __init__(self, num_perm: int = 64, threshold: float = 0.7):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(num_perm, threshold)
+        self._buckets: List[Dict[Signature, List[Hashable]]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[Hashable, Signature] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._signatures
+
+    def _band_keys(self, signature: Signature) -> Iterable[Tuple[int, Signature]]:
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def insert(self, key: Hashable, signature: Signature) -> None:
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def candidates(self, signature: Signature) -> Set[Hashable]:
+        found: Set[Hashable] = set()
+        for band, band_key in self._band_keys(signature):
+            found.update(self._buckets[band].get(band_key, ()))
+        return found
+
+    def query(self, signature: Signature) -> List[Tuple[Hashable, float]]:
+        """Ключи с оценкой сходства не ниже порога, по убыванию сходства"""
+        matches = []
+        for key in self.candidates(signature):
+            similarity = estimate_jaccard(signature, self._signatures[key])
+            if similarity >= self.threshold:
+                matches.append((key, similarity))
+        return sorted(matches, key=lambda match: -match[1])
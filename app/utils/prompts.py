@@ -4,17 +4,18 @@
 from abc import ABC, abstractmethod
 
 import json
-from typing import List, Literal
+from typing import Dict, List, Literal, Optional
 from pathlib import Path
 from .tree_iterator import get_ancestors, bfs
+from .tracing import annotate, traced
 from app.schemas import (
-    BranchType, DialogBaseNode, DialogNode, 
+    BranchType, Character, DialogBaseNode, DialogNode, 
     DialogStructureNode, DialogStructureTree,
     TreeGenerationRequest, ContentGenerationRequest,
     TreeValidationRequest
 )
 
-PromptType = Literal["tree_generation", "node_content", "tree_validation"]
+PromptType = Literal["tree_generation", "node_content", "tree_validation", "tree_retheme", "translation"]
 
 
 class BasePrompt(ABC):
@@ -37,6 +38,11 @@ class BasePrompt(ABC):
             for node in nodes
         )
 
+    @classmethod
+    def _summary_nodes(cls, nodes: List[DialogStructureNode]) -> str:
+        """Сжатое представление нод: только ID и краткое описание события"""
+        return "\n".join(f"- {node.node_id}: {node.narrative_summary}" for node in nodes)
+
     @classmethod
     @abstractmethod
     def build(cls, *args, **kwargs) -> str:
@@ -72,7 +78,8 @@ class NodeContentPrompt(BasePrompt):
     max_child_depth = 1
 
     @classmethod
-    def build(cls, current_node: DialogNode, request: ContentGenerationRequest) -> str:
+    def build(cls, current_node: DialogNode, request: ContentGenerationRequest, compact: bool = False) -> str:
+        """compact - история и развилка без полного JSON нод (для промптов, не влезающих в контекст)"""
         template = cls._load_template("content_generation.txt")
 
         tree = request.dialog_tree
@@ -85,14 +92,15 @@ class NodeContentPrompt(BasePrompt):
         )
 
         example = DialogNode.model_json_schema().get("example")
+        render_nodes = cls._summary_nodes if compact else cls._json_nodes
 
         data = {
             "character": request.character.as_prompt(),
             "goal": request.goal.as_prompt(),
             "branch_types": BranchType.as_prompt(),
             "node_description": DialogNode.model_description(),
-            "history": cls._json_nodes(ancestors) if ancestors else "Это начало диалога.",
-            "postfix": cls._json_nodes(children) if children else "Это конец диалога.",
+            "history": render_nodes(ancestors) if ancestors else "Это начало диалога.",
+            "postfix": render_nodes(children) if children else "Это конец диалога.",
             "node_content": current_node.as_prompt(exclude_none=False),  # include none, чтобы пустые списки попали в промпт
             "response_example": json.dumps(example, indent=2, ensure_ascii=False),
         }
@@ -100,6 +108,63 @@ class NodeContentPrompt(BasePrompt):
         return template.format(**data)
 
 
+class TreeRethemePrompt(BasePrompt):
+    """Переписывание описаний нод готового скелета под новый запрос"""
+    @classmethod
+    def build(cls, request: TreeGenerationRequest, skeleton: DialogStructureTree) -> str:
+        template = cls._load_template("tree_retheme.txt")
+
+        # обход от корня, чтобы модель видела сюжет по порядку
+        ordered = list(bfs(skeleton, skeleton.root_node_id, yield_objects=True))
+        seen = {node.node_id for node in ordered}
+        ordered.extend(node for node_id, node in skeleton.nodes.items() if node_id not in seen)
+
+        example = {
+            "nodes": {
+                node.node_id: {"narrative_summary": "...", "player_goal_hint": "..."}
+                for node in ordered[:2]
+            }
+        }
+
+        data = {
+            "character": request.character.as_prompt(),
+            "goal": request.goal.as_prompt(),
+            "constraints": request.constraints.as_prompt(),
+            "branch_types": BranchType.as_prompt(),
+            "skeleton": "\n".join(cls._skeleton_line(node) for node in ordered),
+            "response_example": json.dumps(example, indent=2, ensure_ascii=False),
+        }
+
+        return template.format(**data)
+
+    @staticmethod
+    def _skeleton_line(node: DialogStructureNode) -> str:
+        branch_type = node.metadata.branch_type.value if node.metadata and node.metadata.branch_type else "-"
+        children = ", ".join(node.child_node_ids or []) or "конец"
+        return (
+            f"- {node.node_id} [{branch_type}] -> {children}: "
+            f"{node.narrative_summary} | цель игрока: {node.player_goal_hint}"
+        )
+
+
+class TranslationPrompt(BasePrompt):
+    """Перевод пакета строк диалога"""
+    @classmethod
+    def build(cls, strings: Dict[str, str], locale: str, character: Optional[Character] = None) -> str:
+        template = cls._load_template("translation.txt")
+
+        example = {"translations": {key: "..." for key in list(strings)[:2]}}
+
+        data = {
+            "locale": locale,
+            "character": character.as_prompt() if character is not None else "Не указан.",
+            "strings": json.dumps(strings, indent=2, ensure_ascii=False),
+            "response_example": json.dumps(example, indent=2, ensure_ascii=False),
+        }
+
+        return template.format(**data)
+
+
 class TreeValidationPrompt(BasePrompt):
     """Валидация заполненного дерева"""
     @classmethod
@@ -120,7 +185,9 @@ class TreeValidationPrompt(BasePrompt):
 
 class PromptFactory:
     @staticmethod
+    @traced("prompt.build")
     def build_prompt(prompt_type: PromptType, **kwargs) -> str:
+        annotate(prompt_type=prompt_type)
         if prompt_type == "tree_generation":
             request: TreeGenerationRequest = kwargs["request"]
             return TreeGenerationPrompt.build(request)
@@ -128,7 +195,15 @@ class PromptFactory:
         elif prompt_type == "node_content":
             current_node: DialogNode = kwargs["current_node"]
             request: ContentGenerationRequest = kwargs["request"]
-            return NodeContentPrompt.build(current_node, request)
+            return NodeContentPrompt.build(current_node, request, compact=kwargs.get("compact", False))
+
+        elif prompt_type == "tree_retheme":
+            request: TreeGenerationRequest = kwargs["request"]
+            skeleton: DialogStructureTree = kwargs["skeleton"]
+            return TreeRethemePrompt.build(request, skeleton)
+
+        elif prompt_type == "translation":
+            return TranslationPrompt.build(kwargs["strings"], kwargs["locale"], character=kwargs.get("character"))
 
         elif prompt_type == "tree_validation":
             request: TreeValidationRequest = kwargs["request"]
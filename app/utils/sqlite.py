@@ -0,0 +1,17 @@
+"""
+Общие помощники для локальных хранилищ на SQLite (очередь заданий, корпус диалогов)
+"""
+import sqlite3
+
+
+class ImmediateTransaction:
+    """Транзакция с немедленной блокировкой записи (BEGIN IMMEDIATE): откат при исключении, иначе фиксация"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -11,6 +11,10 @@ class SystemPrompts:
 
     content_generation_prompt = """Ты сценарист диалогов для игр. Тебе необходимо заполнить каждую ноду диалогового дерева репликой персонажа.
 Обязательно учитывай логику сюжета и состояния сюжета в текущей ноде. Генерируй естественные реплики, учитывая контекст и характер персонажей.
+"""
+
+    translation_prompt = """Ты профессиональный переводчик и локализатор игровых диалогов.
+Переводи точно и естественно, сохраняя характер персонажа. Возвращай результат строго в JSON формате.
 """
 
     tree_validation_prompt = """Ты эксперт по валидации диалогов в играх. Анализируй предоставленный контент объективно и конструктивно.
@@ -0,0 +1,94 @@
+"""
+Локальная оценка размера промптов в токенах и подбор max_tokens под ожидаемый ответ
+"""
+import math
+import re
+from typing import Optional
+
+from app.schemas import DialogStructureNode, StructureConstraints
+
+# Оценка с запасом для BPE-токенизаторов: латиница ~4 символа на токен, кириллица ~3,
+# цифры и знаки препинания - по токену, перевод строки с отступом - один токен
+_PIECE = re.compile(r"(?P<latin>[A-Za-z]+)|(?P<cyrillic>[А-Яа-яЁё]+)|(?P<newline>\n[ \t]*)|(?P<other>[^\sA-Za-zА-Яа-яЁё])")
+_CHARS_PER_TOKEN = {"latin": 4, "cyrillic": 3}
+
+# ожидаемый размер ответов (в токенах)
+NPC_TEXT_TOKENS = 200
+CHOICE_TOKENS = 60
+STRUCTURE_NODE_TOKENS = 220
+RETHEME_NODE_TOKENS = 100
+TRANSLATION_EXPANSION = 1.6
+VALIDATION_TOKENS = 600
+JSON_OVERHEAD_TOKENS = 50
+
+OUTPUT_SAFETY_FACTOR = 1.5
+MIN_OUTPUT_TOKENS = 256
+
+
+class PromptTooLargeError(ValueError):
+    """Промпт вместе с ожидаемым ответом не помещается в контекст модели"""
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Оценка числа токенов в тексте (сверху)"""
+    if not text:
+        return 0
+    tokens = 0
+    for match in _PIECE.finditer(text):
+        kind = match.lastgroup
+        chars_per_token = _CHARS_PER_TOKEN.get(kind)
+        tokens += math.ceil(len(match.group()) / chars_per_token) if chars_per_token else 1
+    return tokens
+
+
+def expected_node_output(node: DialogStructureNode) -> int:
+    """Ожидаемый размер ответа при заполнении ноды: реплика и estimated_num_choices вариантов"""
+    n_choices = node.estimated_num_choices
+    if n_choices is None:
+        n_choices = len(node.child_node_ids or [])
+    return JSON_OVERHEAD_TOKENS + NPC_TEXT_TOKENS + CHOICE_TOKENS * n_choices
+
+
+def expected_tree_nodes(constraints: Optional[StructureConstraints]) -> int:
+    """Ожидаемое число нод: ветвление max_choices на каждом из max_turns ходов, ширина уровня - до max_choices * n_storylines"""
+    constraints = constraints or StructureConstraints()
+    max_choices = max(constraints.max_choices or 1, 1)
+    max_turns = max(constraints.max_turns or 1, 1)
+    width = max_choices * max(constraints.n_storylines or 1, 1)
+    return sum(min(max_choices ** depth, width) for depth in range(max_turns))
+
+
+def expected_tree_output(constraints: Optional[StructureConstraints]) -> int:
+    """Ожидаемый размер ответа со структурой дерева"""
+    return JSON_OVERHEAD_TOKENS + STRUCTURE_NODE_TOKENS * expected_tree_nodes(constraints)
+
+
+def expected_retheme_output(n_nodes: int) -> int:
+    """Ожидаемый размер ответа при переписывании описаний нод готового скелета"""
+    return JSON_OVERHEAD_TOKENS + RETHEME_NODE_TOKENS * n_nodes
+
+
+def expected_translation_output(source_tokens: int) -> int:
+    """Ожидаемый размер ответа с переводом: перевод бывает длиннее исходника, плюс ключи JSON"""
+    return JSON_OVERHEAD_TOKENS + int(source_tokens * TRANSLATION_EXPANSION)
+
+
+def plan_max_tokens(
+    prompt_tokens: int,
+    expected_output: int,
+    context_window: int,
+    max_tokens: int
+) -> int:
+    """
+    max_tokens для вызова: ожидаемый ответ с запасом, но в пределах контекста.
+
+    :raises PromptTooLargeError: если в контексте не остается места даже для ожидаемого ответа
+    """
+    available = context_window - prompt_tokens
+    if available < expected_output:
+        raise PromptTooLargeError(
+            f"Prompt of ~{prompt_tokens} tokens leaves {available} tokens of {context_window} "
+            f"for an answer of ~{expected_output} tokens"
+        )
+    wanted = max(int(expected_output * OUTPUT_SAFETY_FACTOR), MIN_OUTPUT_TOKENS)
+    return min(wanted, max_tokens, available)
@@ -0,0 +1,236 @@
+"""
+Легковесная трассировка этапов пайплайна на контекстных переменных
+
+Спаны пишутся только внутри области tracing(); вне ее span() почти ничего не стоит.
+Задачи asyncio наследуют контекст, поэтому спаны параллельного заполнения дерева
+попадают в одну трассу со ссылками на родителя и на свою дорожку (задачу).
+
+    with tracing() as trace:
+        await writer.fill_dialog_tree(request, max_concurrency=8)
+    trace.write("fill.trace.json")              # chrome://tracing, ui.perfetto.dev
+    trace.write("fill.otlp.json", format="otlp")  # OTLP/JSON для OpenTelemetry Collector
+"""
+import asyncio
+import functools
+import itertools
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass
+class Span:
+    """Завершенный (или открытый) участок работы"""
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    lane: int
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        """Длительность в секундах"""
+        return (self.end_ns - self.start_ns) / 1e9
+
+
+class Trace:
+    """Набор спанов одной области tracing() и их экспорт"""
+
+    def __init__(self, name: str = "npc-dialogue-gen"):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._epoch_ns = time.time_ns() - time.perf_counter_ns()
+        self._ids = itertools.count(1)
+        self._lanes: Dict[int, Tuple[int, str]] = {}
+
+    def _lane(self) -> int:
+        """Дорожка таймлайна: текущая задача asyncio или поток"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task is not None else threading.get_ident()
+        lane = self._lanes.get(key)
+        if lane is None:
+            label = task.get_name() if task is not None else threading.current_thread().name
+            lane = self._lanes[key] = (len(self._lanes) + 1, label)
+        return lane[0]
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """Число спанов и суммарное время (с) по имени"""
+        totals: Dict[str, Tuple[int, float]] = {}
+        for span in self.spans:
+            count, total = totals.get(span.name, (0, 0.0))
+            totals[span.name] = (count + 1, total + span.duration)
+        return totals
+
+    def critical_path(self, root: Optional[Span] = None) -> List[Span]:
+        """
+        Цепочка спанов, определившая длительность root (по умолчанию - самого длинного корневого):
+        от конца родителя берется дочерний спан, завершившийся последним, затем тот,
+        что завершился до его начала, и так далее рекурсивно
+        """
+        children: Dict[Optional[int], List[Span]] = {}
+        for span in self.spans:
+            children.setdefault(span.parent_id, []).append(span)
+        if root is None:
+            roots = children.get(None, [])
+            if not roots:
+                return []
+            root = max(roots, key=lambda s: s.end_ns - s.start_ns)
+
+        path: List[Span] = []
+
+        def walk(span: Span) -> None:
+            path.append(span)
+            end = span.end_ns
+            for child in sorted(children.get(span.span_id, []), key=lambda s: s.end_ns, reverse=True):
+                if child.end_ns <= end:
+                    walk(child)
+                    end = child.start_ns
+
+        walk(root)
+        return sorted(path, key=lambda s: s.start_ns)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Формат Chrome Trace Event (полные события 'X', время в микросекундах)"""
+        events: List[Dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": lane, "args": {"name": label}}
+            for lane, label in self._lanes.values()
+        ]
+        origin = min((span.start_ns for span in self.spans), default=0)
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".", 1)[0],
+                "ph": "X",
+                "pid": 1,
+                "tid": span.lane,
+                "ts": (span.start_ns - origin) / 1e3,
+                "dur": (span.end_ns - span.start_ns) / 1e3,
+                "args": {"span_id": span.span_id, "parent_id": span.parent_id, **span.attributes},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id}}
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Формат OTLP/JSON (ExportTraceServiceRequest) для OpenTelemetry"""
+        spans = [
+            {
+                "traceId": self.trace_id,
+                "spanId": f"{span.span_id:016x}",
+                "parentSpanId": f"{span.parent_id:016x}" if span.parent_id is not None else "",
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(self._epoch_ns + span.start_ns),
+                "endTimeUnixNano": str(self._epoch_ns + span.end_ns),
+                "attributes": [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+                "status": {"code": 2} if "error" in span.attributes else {},
+            }
+            for span in self.spans
+        ]
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.name)]},
+                "scopeSpans": [{"scope": {"name": "app.utils.tracing"}, "spans": spans}],
+            }]
+        }
+
+    def write(self, path: Union[str, Path], format: str = "chrome") -> None:
+        """Сохраняет трассу в JSON: format - 'chrome' или 'otlp'"""
+        if format == "chrome":
+            data = self.to_chrome()
+        elif format == "otlp":
+            data = self.to_otlp()
+        else:
+            raise ValueError(f"Unknown trace format: {format}")
+        Path(path).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def tracing(name: str = "npc-dialogue-gen") -> Iterator[Trace]:
+    """Область, в которой спаны записываются в новую трассу"""
+    trace = Trace(name)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Спан вокруг блока кода; вне tracing() - пустая операция"""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        span_id=next(trace._ids),
+        parent_id=parent.span_id if parent is not None else None,
+        lane=trace._lane(),
+        start_ns=time.perf_counter_ns(),
+        attributes=attributes
+    )
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.end_ns = time.perf_counter_ns()
+        _current_span.reset(token)
+        trace.spans.append(current)
+
+
+def annotate(**attributes: Any) -> None:
+    """Добавляет атрибуты к текущему спану (если трассировка включена)"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Декоратор: спан вокруг вызова функции (в т.ч. корутины)"""
+    def decorator(func: F) -> F:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
@@ -0,0 +1,151 @@
+"""
+Пакет деревьев в массивах NumPy: смежность в формате CSR поверх всех нод всех деревьев
+
+Ноды всех деревьев пронумерованы подряд (дерево t занимает [tree_ptr[t], tree_ptr[t + 1])),
+поэтому обходы и подсчеты выполняются векторно сразу по всему корпусу, а не по дереву за раз.
+Деревья принимаются как pydantic-модели или как словари (например, записи CorpusStore.export),
+словари не валидируются повторно.
+"""
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Any, Iterable, List, Union
+
+import numpy as np
+
+from app.schemas import BranchType, DialogBaseTree
+
+BRANCH_TYPES = tuple(branch_type.value for branch_type in BranchType)
+_BRANCH_CODE = {value: code for code, value in enumerate(BRANCH_TYPES)}
+# нода без типа ветки (нет метаданных или branch_type) - отдельный код после всех типов
+UNTYPED = "untyped"
+UNTYPED_CODE = len(BRANCH_TYPES)
+
+# источник ребер: связи структуры или переходы по вариантам выбора заполненного дерева
+CHILDREN = "children"
+CHOICES = "choices"
+
+MISSING = -1  # ребро в отсутствующую ноду / нет корня
+
+TreeLike = Union[DialogBaseTree, dict]
+
+
+def _get(obj: Any, name: str) -> Any:
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+@dataclass
+class TreeArrays:
+    """Деревья корпуса в плоских массивах"""
+    tree_ptr: np.ndarray      # (T + 1,) границы нод деревьев
+    indptr: np.ndarray        # (N + 1,) границы ребер нод
+    indices: np.ndarray       # (E,) глобальный индекс цели ребра или MISSING
+    roots: np.ndarray         # (T,) глобальный индекс корня или MISSING
+    branch: np.ndarray        # (N,) код типа ветки (индекс в BRANCH_TYPES, UNTYPED_CODE - тип не задан)
+    difficulty: np.ndarray    # (N,) сложность ноды, nan - не задана
+    path_ptr: np.ndarray      # (P + 1,) границы путей к цели
+    path_tree: np.ndarray     # (P,) дерево пути
+    path_nodes: np.ndarray    # глобальные индексы нод путей или MISSING
+    node_ids: List[str]       # ID нод в глобальной нумерации
+
+    @classmethod
+    def from_trees(cls, trees: Iterable[TreeLike], edges: str = CHILDREN) -> "TreeArrays":
+        """Один проход по нодам; ребра - child_node_ids (CHILDREN) или Choice.next_node_id (CHOICES)"""
+        if edges not in (CHILDREN, CHOICES):
+            raise ValueError(f"Unknown edge source {edges!r}")
+        tree_ptr, indptr, roots, path_ptr, path_tree = [0], [0], [], [0], []
+        indices: List[int] = []
+        branch: List[int] = []
+        difficulty: List[float] = []
+        path_nodes: List[int] = []
+        node_ids: List[str] = []
+
+        for t, tree in enumerate(trees):
+            nodes = _get(tree, "nodes") or {}
+            offset = len(node_ids)
+            index = {node_id: offset + i for i, node_id in enumerate(nodes)}
+            node_ids.extend(nodes)
+            roots.append(index.get(_get(tree, "root_node_id"), MISSING))
+
+            for node in nodes.values():
+                if isinstance(node, dict):
+                    metadata = node.get("metadata") or {}
+                    branch_type, level = metadata.get("branch_type"), metadata.get("difficulty")
+                    if edges == CHILDREN:
+                        targets = node.get("child_node_ids") or ()
+                    else:
+                        targets = [choice["next_node_id"] for choice in node.get("choices") or ()]
+                else:
+                    metadata = node.metadata
+                    branch_type = metadata.branch_type.value if metadata and metadata.branch_type else None
+                    level = metadata.difficulty if metadata else None
+                    if edges == CHILDREN:
+                        targets = node.child_node_ids or ()
+                    else:
+                        targets = [choice.next_node_id for choice in node.choices or ()]
+                indices += [index.get(target, MISSING) for target in targets]
+                indptr.append(len(indices))
+                branch.append(_BRANCH_CODE.get(branch_type, UNTYPED_CODE))
+                difficulty.append(np.nan if level is None else level)
+            tree_ptr.append(len(node_ids))
+
+            for path in _get(tree, "goal_achievement_paths") or ():
+                path_nodes.extend(index.get(node_id, MISSING) for node_id in path)
+                path_ptr.append(len(path_nodes))
+                path_tree.append(t)
+
+        return cls(
+            tree_ptr=np.asarray(tree_ptr, dtype=np.int64),
+            indptr=np.asarray(indptr, dtype=np.int64),
+            indices=np.asarray(indices, dtype=np.int64),
+            roots=np.asarray(roots, dtype=np.int64),
+            branch=np.asarray(branch, dtype=np.int8),
+            difficulty=np.asarray(difficulty, dtype=np.float64),
+            path_ptr=np.asarray(path_ptr, dtype=np.int64),
+            path_tree=np.asarray(path_tree, dtype=np.int64),
+            path_nodes=np.asarray(path_nodes, dtype=np.int64),
+            node_ids=node_ids,
+        )
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.tree_ptr) - 1
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    @cached_property
+    def tree_of_node(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_trees), np.diff(self.tree_ptr))
+
+    @cached_property
+    def edge_source(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+
+    @cached_property
+    def out_degree(self) -> np.ndarray:
+        """Число ребер в существующие ноды"""
+        return np.bincount(self.edge_source[self.indices != MISSING], minlength=self.n_nodes)
+
+    @cached_property
+    def goal_ends(self) -> np.ndarray:
+        """Маска нод, которыми заканчиваются пути к цели"""
+        mask = np.zeros(self.n_nodes, dtype=bool)
+        lengths = np.diff(self.path_ptr)
+        ends = self.path_nodes[self.path_ptr[1:][lengths > 0] - 1]
+        mask[ends[ends != MISSING]] = True
+        return mask
+
+    def edges_of(self, nodes: np.ndarray) -> np.ndarray:
+        """Индексы ребер, выходящих из нод (без цикла по нодам)"""
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def per_tree(self, values: np.ndarray, nodes: Union[np.ndarray, slice] = slice(None)) -> np.ndarray:
+        """Сумма значений по нодам каждого дерева"""
+        return np.bincount(self.tree_of_node[nodes], weights=values, minlength=self.n_trees)
+
+    def local_ids(self, t: int, nodes: np.ndarray) -> List[str]:
+        """ID нод дерева t по глобальным индексам"""
+        return [self.node_ids[i] for i in nodes if self.tree_ptr[t] <= i < self.tree_ptr[t + 1]]
@@ -0,0 +1,58 @@
+"""
+Бенчмарк статистики по корпусу: массивы CSR по всему корпусу против обхода bfs по дереву
+
+python -m tests.bench_analytics
+"""
+import time
+
+from app.schemas import DialogStructureTree
+from app.services import analyze
+from app.utils import TreeArrays, bfs
+from tests.factories import make_structure_tree
+
+
+def per_tree_stats(trees):
+    """Глубина, ветвление и число путей обходом pydantic-деревьев по одному"""
+    rows = []
+    for tree in trees:
+        depth, paths = {tree.root_node_id: 1}, {tree.root_node_id: 1}
+        for node in bfs(tree, tree.root_node_id, yield_objects=True):
+            for child in node.child_node_ids:
+                if child not in depth:
+                    depth[child] = depth[node.node_id] + 1
+                paths[child] = paths.get(child, 0) + paths[node.node_id]
+        leaves = [node_id for node_id, node in tree.nodes.items() if not node.child_node_ids]
+        inner = [len(node.child_node_ids) for node in tree.nodes.values() if node.child_node_ids]
+        rows.append((max(depth.values()), sum(inner) / len(inner), sum(paths[leaf] for leaf in leaves)))
+    return rows
+
+
+def main(n_trees: int = 5000):
+    shapes = [(15, 2), (31, 2), (40, 3), (13, 3)]
+    trees = [make_structure_tree(*shapes[i % len(shapes)]) for i in range(n_trees)]
+    records = [tree.model_dump(mode="json") for tree in trees]
+
+    # записи корпуса хранятся в JSON: обход по дереву требует сначала собрать pydantic-модели
+    start = time.perf_counter()
+    validated = [DialogStructureTree.model_validate(record) for record in records]
+    validate = time.perf_counter() - start
+    baseline = per_tree_stats(validated)
+    total = time.perf_counter() - start
+    print(f"bfs per tree:          {total:.2f} s (validation {validate:.2f} s, bfs {total - validate:.2f} s)")
+
+    start = time.perf_counter()
+    arrays = TreeArrays.from_trees(records)
+    convert = time.perf_counter() - start
+    report = analyze(arrays)
+    total = time.perf_counter() - start
+    print(f"arrays (from records): {total:.2f} s (conversion {convert:.2f} s, metrics {total - convert:.2f} s)")
+    print(f"nodes: {arrays.n_nodes}, edges: {arrays.indices.size}")
+
+    assert report.columns["n_paths"].tolist() == [row[2] for row in baseline]
+    assert report.columns["depth"].tolist() == [row[0] for row in baseline]
+    print()
+    print(report.format())
+
+
+if __name__ == "__main__":
+    main()
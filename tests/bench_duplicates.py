@@ -0,0 +1,50 @@
+"""
+Бенчмарк поиска повторов: запрос к индексу LSH против полного перебора корпуса
+
+python -m tests.bench_duplicates
+"""
+import random
+import time
+
+from app.utils import MinHasher, MinHashLSH, shingles
+from app.utils.minhash import jaccard
+
+WORDS = (
+    "старый мастер письмо караван гора сад звезда мельница король дорога ключ тайна совет "
+    "дождь река город купец стража лес огонь книга карта остров ночь рассвет песня"
+).split()
+
+
+def make_lines(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(n)]
+
+
+def main(n_corpus: int = 20000, n_queries: int = 200):
+    lines = make_lines(n_corpus)
+    hasher = MinHasher()
+    lsh = MinHashLSH(threshold=0.7)
+
+    start = time.perf_counter()
+    for i, line in enumerate(lines):
+        lsh.insert(i, hasher.signature(line))
+    print(f"index {n_corpus} lines: {time.perf_counter() - start:.2f} s (bands={lsh.bands}, rows={lsh.rows})")
+
+    queries = [lines[i].upper() + "!" for i in range(0, n_corpus, n_corpus // n_queries)]
+    start = time.perf_counter()
+    found = sum(bool(lsh.query(hasher.signature(q))) for q in queries)
+    lsh_time = (time.perf_counter() - start) / len(queries)
+
+    corpus_shingles = [shingles(line) for line in lines]
+    start = time.perf_counter()
+    for q in queries[:10]:
+        q_shingles = shingles(q)
+        [i for i, s in enumerate(corpus_shingles) if jaccard(q_shingles, s) >= 0.7]
+    brute_time = (time.perf_counter() - start) / 10
+
+    print(f"lsh query   {lsh_time * 1e3:8.3f} ms  recall {found}/{len(queries)}")
+    print(f"brute force {brute_time * 1e3:8.3f} ms  x{brute_time / lsh_time:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Бенчмарк анализа цепей Маркова: пачки матриц по всему корпусу против решения по дереву
+
+python -m tests.bench_markov
+"""
+import time
+
+import numpy as np
+
+from app.services import analyze_chains
+from app.utils import CHOICES, TreeArrays
+from tests.factories import make_dialog_tree
+
+
+def make_records(n_trees: int):
+    """Заполненные деревья разной формы; в каждом третьем - петля из листа в корень"""
+    shapes = [(15, 2), (31, 2), (40, 3), (13, 3)]
+    records = []
+    for i in range(n_trees):
+        record = make_dialog_tree(*shapes[i % len(shapes)]).model_dump(mode="json")
+        if i % 3 == 0:
+            leaf = next(node for node in reversed(record["nodes"].values()) if not node["choices"])
+            leaf["choices"] = [{"text": "назад", "next_node_id": record["root_node_id"]}]
+        records.append(record)
+    return records
+
+
+def per_tree(records):
+    """Тот же анализ, но отдельным вызовом на каждое дерево"""
+    return [
+        analyze_chains(TreeArrays.from_trees([record], edges=CHOICES)).columns["p_goal"][0]
+        for record in records
+    ]
+
+
+def main(n_trees: int = 5000):
+    records = make_records(n_trees)
+
+    start = time.perf_counter()
+    arrays = TreeArrays.from_trees(records, edges=CHOICES)
+    convert = time.perf_counter() - start
+    report = analyze_chains(arrays)
+    total = time.perf_counter() - start
+    print(f"batch:    {total:.2f} s (conversion {convert:.2f} s, solve {total - convert:.2f} s)")
+
+    sample = records[:500]
+    start = time.perf_counter()
+    p_goal = per_tree(sample)
+    elapsed = time.perf_counter() - start
+    print(f"per tree: {elapsed * n_trees / len(sample):.2f} s (extrapolated from {len(sample)} trees)")
+
+    assert np.allclose(p_goal, report.columns["p_goal"][:len(sample)])
+    print()
+    print(report.format())
+
+
+if __name__ == "__main__":
+    main()
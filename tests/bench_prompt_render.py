@@ -0,0 +1,32 @@
+"""
+Микро-бенчмарк: скомпилированный as_prompt против рефлексивной отрисовки
+
+python -m tests.bench_prompt_render
+"""
+import timeit
+
+from tests.factories import make_character, make_goal, make_constraints, make_dialog_tree
+from tests.prompt_reference import as_prompt_reflective
+
+
+def main(number: int = 2000):
+    nodes = list(make_dialog_tree(31).nodes.values())
+    cases = {
+        "character": make_character(),
+        "goal": make_goal(),
+        "constraints": make_constraints(),
+        "node": nodes[3],
+    }
+
+    for name, model in cases.items():
+        assert model.as_prompt(exclude_none=False) == as_prompt_reflective(model, exclude_none=False)
+        reflective = timeit.timeit(lambda: as_prompt_reflective(model, exclude_none=False), number=number)
+        compiled = timeit.timeit(lambda: model.as_prompt(exclude_none=False), number=number)
+        print(
+            f"{name:<12} reflective {reflective / number * 1e6:8.2f} us  "
+            f"compiled {compiled / number * 1e6:8.2f} us  x{reflective / compiled:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Пик памяти пакета NPC: сбор ответов в памяти против потоковой записи в NDJSON
+
+python -m tests.bench_streaming
+"""
+import asyncio
+import os
+import tempfile
+import tracemalloc
+
+from app.schemas import ContentGenerationRequest
+from app.services import ContentWriter
+from app.utils import DialogStreamWriter, iter_nodes
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+
+def peak_mib(func) -> float:
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def main(n_nodes: int = 31, batches=(4, 16, 64)):
+    structure = make_structure_tree(n_nodes)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+    writer = ContentWriter()
+    writer.llm = FakeContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()})
+    path = os.path.join(tempfile.mkdtemp(), "batch.ndjson")
+
+    for n_npcs in batches:
+        def in_memory():
+            async def run():
+                return [await writer.fill_dialog_tree(request, max_concurrency=8) for _ in range(n_npcs)]
+            asyncio.run(run())
+
+        def streaming():
+            async def run():
+                with DialogStreamWriter(path) as stream:
+                    for i in range(n_npcs):
+                        await writer.stream_dialog_tree(request, stream, f"npc_{i}", max_concurrency=8)
+            asyncio.run(run())
+
+        def reading():
+            for _ in iter_nodes(path):
+                pass
+
+        print(
+            f"{n_npcs:4d} NPC x {n_nodes} nodes: in-memory {peak_mib(in_memory):7.2f} MiB  "
+            f"streaming {peak_mib(streaming):6.2f} MiB  lazy read {peak_mib(reading):5.2f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Бенчмарк построения деревьев на 1000 узлов: dump/повторная валидация против однократной валидации
+
+python -m tests.bench_tree_construction
+"""
+import copy
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from app.schemas import (
+    Choice, NodeMetadata, DialogNode, DialogTree, DialogStructureNode, DialogStructureTree
+)
+from app.services import ContentWriter, TreeGenerator
+from tests.factories import make_structure_tree
+
+
+def legacy_structure_tree(generated_tree: Dict[str, Any]) -> DialogStructureTree:
+    """Прежний structure_tree: NodeMetadata, затем узел, затем дерево"""
+    nodes = {}
+    for node_id, node_info in generated_tree.get("nodes", {}).items():
+        meta = node_info.get("metadata", {})
+        node_info['metadata'] = NodeMetadata(**meta)
+        nodes[node_id] = DialogStructureNode(**node_info)
+    return DialogStructureTree(
+        root_node_id=generated_tree["root_node_id"],
+        nodes=nodes,
+        goal_achievement_paths=generated_tree.get("goal_achievement_paths", [])
+    )
+
+
+def legacy_fill(structure: DialogStructureTree, responses: Dict[str, Dict]) -> DialogTree:
+    """Прежний fill_dialog_tree без LLM: копия дерева и пересборка каждого узла"""
+    tree = DialogTree(**structure.model_dump())
+    for node_id, node in list(tree.nodes.items()):
+        response = responses[node_id]
+        choices = [
+            Choice(text=c.get("text", ""), next_node_id=c.get("next_node_id", ""))
+            for c in response.get("choices", [])
+        ]
+        tree.nodes[node_id] = DialogNode(
+            npc_text=response.get("npc_text", ""),
+            choices=choices,
+            **node.model_dump(exclude={"npc_text", "choices"})
+        )
+    return tree
+
+
+def current_fill(structure: DialogStructureTree, responses: Dict[str, Dict]) -> DialogTree:
+    """Текущий путь ContentWriter без LLM: разбор ответа тем же кодом, что и при генерации"""
+    tree = DialogTree.from_structure(structure)
+    for node_id, node in list(tree.nodes.items()):
+        tree.nodes[node_id] = ContentWriter.parse_node(node, responses[node_id])
+    return tree
+
+
+def measure(name: str, fn: Callable[[Any], Any], setup: Callable[[], Any] = lambda: None, repeat: int = 5) -> None:
+    """Лучшее время из repeat прогонов и пик памяти; setup готовит вход вне замера"""
+    timings: List[float] = []
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+
+    arg = setup()
+    tracemalloc.start()
+    result = fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    print(f"{name:<28} cpu {min(timings) * 1e3:8.2f} ms   peak mem {peak / 2 ** 20:7.2f} MiB")
+
+
+def main(n_nodes: int = 1000):
+    structure = make_structure_tree(n_nodes)
+    raw_tree = structure.model_dump(mode="json")
+    responses = {
+        node_id: {
+            "npc_text": f"Реплика для {node_id}",
+            "choices": [{"text": f"Перейти к {c}", "next_node_id": c} for c in node.child_node_ids],
+        }
+        for node_id, node in structure.nodes.items()
+    }
+    generator = TreeGenerator()
+
+    print(f"Tree of {n_nodes} nodes")
+    fresh_raw = lambda: copy.deepcopy(raw_tree)  # noqa: E731
+    measure("structure: legacy", legacy_structure_tree, fresh_raw)
+    measure("structure: type adapter", generator.structure_tree, fresh_raw)
+    measure("fill: legacy", lambda _: legacy_fill(structure, responses))
+    measure("fill: from_structure", lambda _: current_fill(structure, responses))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Бенчмарк пула воркеров над очередью SQLite с имитацией LLM (задержка ответа на каждую ноду)
+
+python -m tests.bench_worker_pool
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from app.schemas import ContentGenerationRequest
+from app.services import ContentWriter, JobQueue, QueueWorker, collect, run_worker_processes, submit_content
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+LLM_DELAY = 0.05
+
+
+def fake_worker(queue: JobQueue) -> QueueWorker:
+    """Воркер с имитацией LLM (функция верхнего уровня - передается в дочерние процессы)"""
+    writer = ContentWriter()
+    writer.llm = FakeContentLLM({}, delay=LLM_DELAY)
+    return QueueWorker(queue, poll_interval=0.01, content_writer=writer)
+
+
+def run(processes: int, n_npcs: int = 20, n_nodes: int = 15, concurrency: int = 2) -> float:
+    request = ContentGenerationRequest(
+        character=make_character(), goal=make_goal(), dialog_tree=make_structure_tree(n_nodes)
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "queue.db")
+        with JobQueue(path) as queue:
+            for _ in range(n_npcs):
+                submit_content(queue, request, batch_id="bench")
+
+        start = time.perf_counter()
+        run_worker_processes(path, processes, concurrency=concurrency, factory=fake_worker)
+        elapsed = time.perf_counter() - start
+
+        with JobQueue(path) as queue:
+            results = collect(queue, "bench")
+            assert len(results) == n_npcs and all(results.values())
+    return n_npcs * n_nodes / elapsed
+
+
+def main():
+    baseline = None
+    for processes in (1, 2, 4, 8):
+        throughput = run(processes)
+        baseline = baseline or throughput
+        print(f"{processes} processes: {throughput:7.1f} nodes/s  x{throughput / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
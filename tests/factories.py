@@ -0,0 +1,70 @@
+"""
+Синтетические входные данные для тестов и бенчмарков
+"""
+from typing import List
+
+from app.schemas import (
+    BranchType, Character, Goal, StructureConstraints, NodeMetadata, Choice,
+    DialogStructureNode, DialogStructureTree, DialogNode, DialogTree
+)
+
+_BRANCH_CYCLE: List[BranchType] = [
+    BranchType.MAIN_PATH, BranchType.EXPLORATION, BranchType.MAIN_PATH,
+    BranchType.SIDE_QUEST, BranchType.DEAD_END,
+]
+
+
+def make_character() -> Character:
+    return Character(**Character.Config.json_schema_extra["example"])
+
+
+def make_goal() -> Goal:
+    return Goal(**Goal.Config.json_schema_extra["example"])
+
+
+def make_constraints() -> StructureConstraints:
+    return StructureConstraints(max_turns=5)
+
+
+def _children(i: int, n_nodes: int, fanout: int) -> List[str]:
+    return [f"node_{c}" for c in range(i * fanout + 1, i * fanout + fanout + 1) if c < n_nodes]
+
+
+def make_structure_tree(n_nodes: int = 15, fanout: int = 2) -> DialogStructureTree:
+    """Полное дерево из n_nodes узлов с ветвлением fanout"""
+    nodes = {}
+    for i in range(n_nodes):
+        children = _children(i, n_nodes, fanout)
+        nodes[f"node_{i}"] = DialogStructureNode(
+            node_id=f"node_{i}",
+            parent_node_ids=[f"node_{(i - 1) // fanout}"] if i else [],
+            child_node_ids=children,
+            metadata=NodeMetadata(branch_type=_BRANCH_CYCLE[i % len(_BRANCH_CYCLE)], difficulty=i % 5 + 1),
+            narrative_summary=f"Событие в узле {i}: мудрец рассказывает о письме",
+            player_goal_hint=f"Узнать подробности на шаге {i}",
+            estimated_num_choices=len(children),
+        )
+
+    main_path, i = ["node_0"], 0
+    while i * fanout + 1 < n_nodes:
+        i = i * fanout + 1
+        main_path.append(f"node_{i}")
+
+    return DialogStructureTree(root_node_id="node_0", nodes=nodes, goal_achievement_paths=[main_path])
+
+
+def make_dialog_tree(n_nodes: int = 15, fanout: int = 2) -> DialogTree:
+    """Заполненное дерево той же формы, что и make_structure_tree"""
+    structure = make_structure_tree(n_nodes, fanout)
+    nodes = {}
+    for node_id, node in structure.nodes.items():
+        nodes[node_id] = DialogNode(
+            npc_text=f"Реплика мудреца в {node_id}",
+            choices=[Choice(text=f"Перейти к {child}", next_node_id=child) for child in node.child_node_ids],
+            **node.model_dump(),
+        )
+    return DialogTree(
+        root_node_id=structure.root_node_id,
+        nodes=nodes,
+        goal_achievement_paths=structure.goal_achievement_paths,
+    )
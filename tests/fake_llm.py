@@ -0,0 +1,66 @@
+"""
+Детерминированная замена LLM-клиента для тестов и бенчмарков
+"""
+import asyncio
+import re
+from typing import Any, Dict, List, Optional
+
+from app.utils import estimate_tokens, plan_max_tokens, with_deadline
+
+
+class FakeContentLLM:
+    """Отвечает на промпт заполнения ноды вариантами выбора по child_node_ids"""
+
+    def __init__(self, children: Dict[str, list], delay: float = 0.0, context_window: int = 65536):
+        self.children = children
+        self.delay = delay
+        self.context_window = context_window
+        self.calls = 0
+        self.max_tokens: List[int] = []
+
+    def max_tokens_for(self, prompt: str, expected_output: int) -> int:
+        return plan_max_tokens(estimate_tokens(prompt), expected_output, self.context_window, 4096)
+
+    async def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        self.calls += 1
+        self.max_tokens.append(kwargs.get("max_tokens"))
+        if self.delay:
+            # как и LLMClient, ответ ожидается с учетом текущего дедлайна
+            await with_deadline(asyncio.sleep(self.delay))
+        node_id = self.node_id(prompt)
+        return {
+            "npc_text": f"Реплика для {node_id}",
+            "choices": [
+                {"text": f"Перейти к {child}", "next_node_id": child}
+                for child in self.children.get(node_id, [])
+            ],
+        }
+
+    @staticmethod
+    def node_id(prompt: str) -> Optional[str]:
+        """ID текущей ноды из секции 'Текущий момент' промпта"""
+        current = prompt.split("## Текущий момент:", 1)[-1]
+        match = re.search(r"Уникальный идентификатор текущей ноды: (\S+)", current)
+        return match.group(1) if match else None
+
+
+class FakeCompletions:
+    """chat.completions с заданными задержками ответов; считает запуски и отмены"""
+
+    def __init__(self, delays, content='{"npc_text": "ok"}'):
+        self.delays, self.content, self.started, self.cancelled = list(delays), content, 0, 0
+
+    async def create(self, **kwargs):
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delays.pop(0))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        message = type("Message", (), {"content": self.content})
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})]})
+
+
+def fake_openai(completions) -> Any:
+    """Объект с интерфейсом AsyncOpenAI.chat.completions"""
+    return type("Client", (), {"chat": type("Chat", (), {"completions": completions})})
@@ -0,0 +1,54 @@
+"""
+Эталонная рефлексивная отрисовка моделей в промпт (для проверки и бенчмарка AutoPromptModel.as_prompt)
+"""
+from typing import Dict, List
+
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+
+from app.schemas.schema import AutoPromptModel
+
+
+def as_prompt_reflective(model: BaseModel, exclude_none: bool = True, *, _lvl: int = 0) -> str:
+    """Рефлексивная отрисовка без плана: поля обходятся заново при каждом вызове"""
+    tab, bullet = AutoPromptModel._TAB, AutoPromptModel._BULLET
+
+    def pad(bul: str = bullet): return tab * _lvl + bul
+
+    parts: List[str] = []
+    model_fields: Dict[str, FieldInfo] = model.__class__.model_fields
+
+    for field_name, field_info in model_fields.items():
+        value = getattr(model, field_name)
+        if exclude_none and not value:
+            continue
+
+        description = field_info.description or field_name.replace("_", " ").capitalize()
+
+        if isinstance(value, BaseModel):
+            parts.append(f"{pad()}{description}:")
+            parts.append(as_prompt_reflective(value, _lvl=_lvl + 1))
+
+        elif isinstance(value, list):
+            parts.append(f"{pad()}{description}:")
+
+            for i, item in enumerate(value, 1):
+                parts.append(
+                    as_prompt_reflective(item, _lvl=_lvl + 1)
+                    if isinstance(item, BaseModel)
+                    else f"{tab}{pad(str(i))}. {item}"  # в случае списка значений
+                )
+
+        elif isinstance(value, dict):
+            parts.append(f"{pad()}{description}:")
+            for k, v in value.items():
+                parts.append(
+                    as_prompt_reflective(v, _lvl=_lvl + 1)
+                    if isinstance(v, BaseModel)
+                    else f"{tab}{pad()}{k}: {v}"
+                )
+
+        else:
+            parts.append(f"{pad()}{description}: {value}")
+
+    return "\n".join(parts)
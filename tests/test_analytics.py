@@ -0,0 +1,96 @@
+import numpy as np
+
+from app.schemas import BranchType, DialogStructureNode, DialogStructureTree, NodeMetadata, TreeGenerationRequest
+from app.services import CorpusStore, analyze, analyze_corpus
+from app.utils import TreeArrays
+from tests.factories import make_character, make_constraints, make_goal, make_structure_tree
+
+
+def _tree(edges, branch=None, paths=None, root="a"):
+    """Дерево из списка ребер {нода: [дети]}"""
+    nodes = {}
+    for node_id, children in edges.items():
+        parents = [p for p, cs in edges.items() if node_id in cs]
+        nodes[node_id] = DialogStructureNode(
+            node_id=node_id,
+            parent_node_ids=parents,
+            child_node_ids=children,
+            metadata=NodeMetadata(branch_type=(branch or {}).get(node_id, BranchType.MAIN_PATH), difficulty=2),
+            narrative_summary=node_id,
+            player_goal_hint=node_id,
+        )
+    return DialogStructureTree(root_node_id=root, nodes=nodes, goal_achievement_paths=paths or [])
+
+
+def test_arrays_are_concatenated_csr():
+    arrays = TreeArrays.from_trees([make_structure_tree(3), make_structure_tree(7)])
+
+    assert arrays.n_trees == 2 and arrays.n_nodes == 10
+    assert arrays.tree_ptr.tolist() == [0, 3, 10]
+    assert arrays.roots.tolist() == [0, 3]
+    assert arrays.indices[arrays.indptr[3]:arrays.indptr[4]].tolist() == [4, 5]
+    assert arrays.out_degree.tolist() == [2, 0, 0, 2, 2, 2, 0, 0, 0, 0]
+
+
+def test_path_counts_on_dag_with_loop_back():
+    # ромб a -> (b, c) -> d, из d петля назад в a и выход в e
+    diamond = _tree(
+        {"a": ["b", "c"], "b": ["d"], "c": ["d"], "d": ["a", "e", "x"], "e": [], "u": ["e"]},
+        branch={"d": BranchType.LOOP_BACK}, paths=[["a", "b", "d", "e"]]
+    )
+    # ребро вглубь на тот же уровень (c -> b) не петля
+    cross = _tree({"a": ["b", "c"], "b": [], "c": ["b"]})
+    # ребро d -> c не растит глубину, но лежит вне цикла a <-> b: петлей считается только b -> a
+    behind_cycle = _tree({"a": ["b"], "b": ["a", "c", "d"], "c": ["e"], "d": ["c", "e"], "e": []})
+
+    report = analyze([diamond, cross, behind_cycle])
+    rows = list(report.rows())
+
+    assert rows[0]["n_paths"] == 2 and rows[0]["loop_edges"] == 1
+    assert rows[0]["depth"] == 4 and rows[0]["unreachable"] == 1
+    assert rows[0]["dead_end_ratio"] == 0.0
+    assert rows[0]["max_branching"] == 2  # ребро в отсутствующую ноду x не считается
+    assert rows[1]["n_paths"] == 2 and rows[1]["loop_edges"] == 0
+    assert rows[1]["dead_end_ratio"] == 1.0
+    assert rows[0]["share_loop"] == 1 / 6
+    assert rows[2]["n_paths"] == 3 and rows[2]["loop_edges"] == 1
+
+
+def test_report_over_corpus_records(tmp_path):
+    request = TreeGenerationRequest(character=make_character(), goal=make_goal(), constraints=make_constraints())
+    with CorpusStore(tmp_path / "corpus.db") as store:
+        hashes = [store.put_tree(make_structure_tree(n), request) for n in (7, 15, 31)]
+        report = analyze_corpus(store)
+
+    assert report.keys == hashes
+    assert report.columns["depth"].tolist() == [3, 4, 5]
+    assert report.columns["n_paths"].tolist() == [4, 8, 16]
+    assert report.depth_histogram.tolist() == [0, 0, 0, 1, 1, 1]
+    assert report.branching_histogram.tolist() == [0, 0, 3 + 7 + 15]
+    assert np.isclose(sum(report.branch_mix.values()), 1.0)
+    # путь к цели идет по node_1, node_3, ...: сложность i % 5 + 1
+    assert report.difficulty_curve[:3].tolist() == [1.0, 2.0, 4.0]
+    assert report.to_csv(tmp_path / "report.csv") == 3
+    assert "n_paths" in report.format()
+
+
+def test_untyped_nodes_are_left_out_of_branch_shares():
+    typed = _tree({"a": ["b"], "b": []}, branch={"b": BranchType.DEAD_END})
+    # запись корпуса без типа ветки у части нод
+    untyped = {
+        "root_node_id": "a",
+        "nodes": {
+            "a": {"child_node_ids": ["b", "c"], "metadata": None},
+            "b": {"child_node_ids": [], "metadata": {"branch_type": None, "difficulty": 2}},
+            "c": {"child_node_ids": [], "metadata": {"branch_type": "dead_end"}},
+        },
+    }
+    bare = {"root_node_id": "a", "nodes": {"a": {"child_node_ids": []}}}
+
+    report = analyze([typed, untyped, bare])
+    typed_row, untyped_row, bare_row = report.rows()
+
+    assert typed_row["share_main"] == 0.5 and typed_row["share_dead_end"] == 0.5
+    assert untyped_row["share_main"] == 0.0 and untyped_row["share_dead_end"] == 1.0
+    assert np.isnan(bare_row["share_main"])
+    assert report.branch_mix["main"] == 1 / 3 and report.branch_mix["dead_end"] == 2 / 3
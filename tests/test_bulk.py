@@ -0,0 +1,173 @@
+import asyncio
+import json
+
+import httpx
+
+from app.schemas import StructureConstraints, TreeGenerationRequest
+from app.services import BatchAPI, BulkPipeline, TemplateLibrary
+from app.services.batch_server import BatchServer, create_batch_app
+from app.utils import LLMConfig, SystemPrompts
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+
+class ScriptedResponder:
+    """Отвечает на запросы пакета по системному промпту роли; первые fail_nodes нод - с ошибкой"""
+
+    def __init__(self, n_nodes: int = 7, fail_nodes: int = 0):
+        self.structure = make_structure_tree(n_nodes)
+        self.children = {node_id: node.child_node_ids for node_id, node in self.structure.nodes.items()}
+        self.fail_nodes = fail_nodes
+        self.calls = {"tree": 0, "content": 0, "validation": 0}
+        self.rethemes, self.partial_themes = 0, False
+
+    async def __call__(self, body):
+        system, prompt = body["messages"][0]["content"], body["messages"][1]["content"]
+        if system == SystemPrompts.tree_generation_prompt and "готовый скелет" in prompt:
+            self.rethemes += 1
+            node_ids = list(self.structure.nodes)[:-1] if self.partial_themes else self.structure.nodes
+            return json.dumps({"nodes": {
+                node_id: {"narrative_summary": f"Новое событие {node_id}", "player_goal_hint": "Новая цель"}
+                for node_id in node_ids
+            }}, ensure_ascii=False)
+        if system == SystemPrompts.tree_generation_prompt:
+            self.calls["tree"] += 1
+            return self.structure.model_dump_json(include={"root_node_id", "nodes", "goal_achievement_paths"})
+        if system == SystemPrompts.content_generation_prompt:
+            self.calls["content"] += 1
+            if self.fail_nodes:
+                self.fail_nodes -= 1
+                raise RuntimeError("upstream error")
+            node_id = FakeContentLLM.node_id(prompt)
+            return json.dumps({
+                "npc_text": f"Реплика для {node_id}",
+                "choices": [{"text": f"Перейти к {child}", "next_node_id": child} for child in self.children[node_id]],
+            }, ensure_ascii=False)
+        self.calls["validation"] += 1
+        return json.dumps({"scores": {"coherence": 4}, "comments": {"coherence": "ok"}})
+
+
+def _pipeline(responder):
+    server = BatchServer(responder)
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_batch_app(server)), base_url="http://batch.test/v1/")
+    api = BatchAPI(LLMConfig(api_key="test"), http=http)
+    return server, BulkPipeline(api=api, poll_interval=0.01), api
+
+
+def _request():
+    return TreeGenerationRequest(
+        character=make_character(), goal=make_goal(), constraints=StructureConstraints(max_turns=3)
+    )
+
+
+def test_bulk_pipeline_runs_stages_as_waves():
+    responder = ScriptedResponder(n_nodes=7)
+    server, pipeline, api = _pipeline(responder)
+
+    async def run():
+        try:
+            return await pipeline.run([_request(), _request()])
+        finally:
+            await pipeline.close()
+            await api.close()
+
+    items = asyncio.run(run())
+
+    # одна волна на этап: деревья, ноды обоих NPC, валидация
+    assert len(server.batches) == 3
+    assert [batch["request_counts"]["total"] for batch in server.batches.values()] == [2, 14, 2]
+    assert responder.calls == {"tree": 2, "content": 14, "validation": 2}
+    for item in items:
+        assert set(item.structure.nodes) == set(responder.structure.nodes)
+        assert not item.content.is_partial
+        assert item.content.dialog_tree.nodes["node_1"].npc_text == "Реплика для node_1"
+        assert [c.next_node_id for c in item.content.dialog_tree.nodes["node_0"].choices] == ["node_1", "node_2"]
+        assert item.validation.is_valid
+        assert item.errors == {}
+
+
+def test_bulk_pipeline_retries_failed_requests_and_reports_leftovers():
+    responder = ScriptedResponder(n_nodes=7, fail_nodes=2)
+    server, pipeline, api = _pipeline(responder)
+    structure = make_structure_tree(7)
+
+    async def run():
+        try:
+            return await pipeline.run([_request()], structures=[structure], validate=False)
+        finally:
+            await pipeline.close()
+            await api.close()
+
+    (item,) = asyncio.run(run())
+
+    # волны деревьев нет, упавшие ноды отправлены повторной волной
+    assert responder.calls == {"tree": 0, "content": 9, "validation": 0}
+    assert [batch["request_counts"]["total"] for batch in server.batches.values()] == [7, 2]
+    assert not item.content.is_partial and item.validation is None
+
+    responder.fail_nodes = 100
+    server, pipeline, api = _pipeline(responder)
+    (item,) = asyncio.run(run())
+    assert set(item.content.unfilled_node_ids) == set(structure.nodes)
+    assert "upstream error" in item.errors["node:0:node_0"]
+
+
+def test_oversized_prompts_are_recorded_without_aborting_the_run(monkeypatch):
+    responder = ScriptedResponder(n_nodes=7)
+    server, pipeline, api = _pipeline(responder)
+    # клиенты ролей общие для процесса: контекст уменьшается только на время теста
+    monkeypatch.setattr(pipeline.tree_generator.llm, "context_window", 100)
+    monkeypatch.setattr(pipeline.validator.llm, "context_window", 100)
+
+    async def run():
+        try:
+            return await pipeline.run([_request(), _request()], structures=[None, make_structure_tree(7)])
+        finally:
+            await pipeline.close()
+            await api.close()
+
+    tree_only, validation_only = asyncio.run(run())
+
+    # не поместившиеся промпты не уходят в пакеты, ошибка записана на NPC
+    assert responder.calls == {"tree": 0, "content": 7, "validation": 0}
+    assert tree_only.structure is None and tree_only.content is None
+    assert "tree:0" in tree_only.errors
+    assert not validation_only.content.is_partial and validation_only.validation is None
+    assert list(validation_only.errors) == ["validation:1"]
+
+
+def test_bulk_rethemes_matching_skeletons_and_keeps_caller_api_open():
+    responder = ScriptedResponder(n_nodes=7)
+    server, pipeline, api = _pipeline(responder)
+    pipeline.tree_generator.templates = TemplateLibrary()
+    pipeline.tree_generator.templates.add(_request(), responder.structure)
+    other_goal = _request()
+    other_goal.goal.goal_type = "escort"
+
+    async def run():
+        try:
+            return await pipeline.run([_request(), other_goal], validate=False)
+        finally:
+            await pipeline.close()
+
+    rethemed, generated = asyncio.run(run())
+
+    # скелет переписан в той же волне, что и дерево без шаблона
+    assert responder.rethemes == 1 and responder.calls["tree"] == 1
+    assert [batch["request_counts"]["total"] for batch in server.batches.values()] == [2, 14]
+    assert rethemed.structure.nodes["node_3"].narrative_summary == "Новое событие node_3"
+    assert generated.structure.nodes["node_3"].narrative_summary != "Новое событие node_3"
+    assert rethemed.errors == {} and generated.errors == {}
+    assert not api.http.is_closed
+
+    # ответ не покрывает скелет - дерево строится с нуля отдельной волной
+    responder.partial_themes = True
+    server, pipeline, api = _pipeline(responder)
+    pipeline.tree_generator.templates = TemplateLibrary()
+    pipeline.tree_generator.templates.add(_request(), responder.structure)
+    pipeline.max_retries = 0
+    (item,) = asyncio.run(pipeline.run([_request()], validate=False))
+    asyncio.run(api.close())
+    assert [batch["request_counts"]["total"] for batch in server.batches.values()] == [1, 1, 7]
+    assert item.structure.nodes["node_3"].narrative_summary != "Новое событие node_3"
+    assert item.errors == {}
@@ -0,0 +1,44 @@
+import asyncio
+
+from app.schemas import ContentGenerationRequest, DialogNode, DialogStructureNode
+from app.services import TreeGenerator, ContentWriter
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+
+def test_structure_tree_validates_raw_output_once():
+    expected = make_structure_tree(7)
+    raw = expected.model_dump(mode="json")
+    del raw["nodes"]["node_3"]["metadata"]
+
+    tree = TreeGenerator().structure_tree(raw)
+
+    assert isinstance(tree.nodes["node_0"], DialogStructureNode)
+    assert tree.nodes["node_3"].metadata.branch_type == "main"
+    expected.nodes["node_3"].metadata = tree.nodes["node_3"].metadata
+    assert tree.model_dump() == expected.model_dump()
+
+
+def test_fill_dialog_tree_does_not_alias_structure():
+    structure = make_structure_tree(7)
+    writer = ContentWriter()
+    writer.llm = FakeContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()})
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+
+    filled = asyncio.run(writer.fill_dialog_tree(request)).dialog_tree
+
+    node = filled.nodes["node_1"]
+    assert isinstance(node, DialogNode)
+    assert node.npc_text == "Реплика для node_1"
+    assert [c.next_node_id for c in node.choices] == structure.nodes["node_1"].child_node_ids
+    assert node.metadata == structure.nodes["node_1"].metadata
+    assert node.metadata is not structure.nodes["node_1"].metadata
+    assert DialogNode.model_validate(node.model_dump()) == node
+
+    # изменения заполненного дерева не затрагивают структуру
+    filled.nodes["node_0"].child_node_ids.append("node_99")
+    filled.nodes["node_0"].metadata.difficulty = 5
+    filled.goal_achievement_paths[0].append("node_99")
+    assert "node_99" not in structure.nodes["node_0"].child_node_ids
+    assert structure.nodes["node_0"].metadata.difficulty == 1
+    assert "node_99" not in structure.goal_achievement_paths[0]
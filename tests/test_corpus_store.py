@@ -0,0 +1,49 @@
+from app.schemas import BranchType, TreeGenerationRequest, TreeValidationResponse
+from app.services import CorpusStore
+from tests.factories import make_character, make_goal, make_constraints, make_structure_tree, make_dialog_tree
+
+
+def _request():
+    return TreeGenerationRequest(character=make_character(), goal=make_goal(), constraints=make_constraints())
+
+
+def test_store_dedups_by_content_and_round_trips(tmp_path):
+    request, tree = _request(), make_dialog_tree(7)
+    with CorpusStore(tmp_path / "corpus.db") as store:
+        first = store.put_tree(tree, request)
+        assert store.put_tree(make_dialog_tree(7), request) == first
+        structure = store.put_tree(make_structure_tree(7), request)
+        validation = TreeValidationResponse(scores={"logic": 4}, comments={"logic": "ok"}, is_valid=True)
+        store.put_validation(first, validation)
+        store.put_validation(first, validation)
+
+        assert store.counts() == {"requests": 1, "structure": 1, "filled": 1, "validations": 1}
+        assert store.get_tree(first) == tree
+        assert store.get_tree(structure) == make_structure_tree(7)
+        assert store.get_request(store.put_request(request)) == request
+        assert store.validations(first) == [validation]
+
+
+def test_lookup_search_compare_and_export(tmp_path):
+    request = _request()
+    with CorpusStore(tmp_path / "corpus.db") as store:
+        old = store.put_tree(make_dialog_tree(7), request)
+        edited = make_dialog_tree(9)
+        edited.nodes["node_3"].npc_text = "Мудрец молчит и смотрит на свиток"
+        new = store.put_tree(edited, request)
+        store.put_validation(new, TreeValidationResponse(scores={"a": 1}, comments={}, is_valid=False))
+
+        name = make_character().name
+        assert [t["hash"] for t in store.find_trees(character_name=name, is_valid=False)] == [new]
+        assert len(store.find_trees(goal_type=make_goal().goal_type, branch_type=BranchType.DEAD_END)) == 2
+        assert store.find_trees(character_name="Никто") == []
+
+        hits = store.search("свиток")
+        assert [(h["tree_hash"], h["node_id"]) for h in hits] == [(new, "node_3")]
+        assert len(store.search("мудреца")) == 15
+
+        assert store.compare(old, new) == {"added": ["node_7", "node_8"], "removed": [], "changed": ["node_3"]}
+
+        records = list(store.export(is_valid=False))
+        assert len(records) == 1 and records[0]["request"]["character"]["name"] == name
+        assert store.export_jsonl(tmp_path / "corpus.jsonl") == 2
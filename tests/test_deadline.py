@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from app.schemas import ContentGenerationRequest
+from app.services import ContentWriter, LLMClient, PriorityNodeScheduler
+from app.utils import DeadlineExceeded, LLMConfig, deadline_scope, remaining, with_deadline
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeCompletions, FakeContentLLM, fake_openai
+
+
+def test_nested_scope_cannot_extend_outer_deadline():
+    with deadline_scope(1.0):
+        with deadline_scope(60.0):
+            assert remaining() <= 1.0
+        with deadline_scope(None):
+            assert remaining() <= 1.0
+    assert remaining() is None
+
+
+class HoldingContentLLM(FakeContentLLM):
+    """Сразу отвечает для нод answered, остальные ответы ждут события, которое не наступает до дедлайна"""
+
+    def __init__(self, children, answered):
+        super().__init__(children)
+        self.answered, self.release, self.held = set(answered), asyncio.Event(), 0
+
+    async def generate(self, prompt, **kwargs):
+        if self.node_id(prompt) not in self.answered:
+            self.held += 1
+            await with_deadline(self.release.wait())
+        return await super().generate(prompt, **kwargs)
+
+
+def test_fill_returns_partial_tree_on_deadline():
+    structure = make_structure_tree(15)
+    first_tier = PriorityNodeScheduler(structure).tiers[0]
+    writer = ContentWriter()
+    writer.llm = HoldingContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()}, answered=first_tier)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+
+    response = asyncio.run(writer.fill_dialog_tree(request, max_concurrency=8, timeout=0.05))
+
+    # исход определяется событиями, а не соотношением задержек: висящие запросы отменены дедлайном
+    assert writer.llm.held > 0
+    assert response.is_partial
+    nodes = response.dialog_tree.nodes
+    assert set(response.unfilled_node_ids) == set(structure.nodes) - set(first_tier)
+    assert set(response.unfilled_node_ids) == {n for n, node in nodes.items() if not node.npc_text}
+
+
+def test_deadline_cancels_llm_request():
+    completions = FakeCompletions([5.0])
+    client = LLMClient(config=LLMConfig(api_key="-", model="deadline-test"))
+    client.backends.backends[0].client = fake_openai(completions)
+
+    async def run():
+        with deadline_scope(0.05):
+            await client.chat([{"role": "user", "content": "?"}])
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert completions.cancelled == 1
@@ -0,0 +1,34 @@
+from app.schemas import ContentGenerationResponse
+from app.utils import PackedDialogTree, pack_dialog_tree, write_dialog_pack
+from app.utils.dialog_pack import NONE
+from tests.factories import make_dialog_tree
+
+
+def test_pack_round_trip_through_mmap(tmp_path):
+    tree = make_dialog_tree(15)
+    tree.nodes["node_3"].metadata = None
+    tree.nodes["node_4"].choices.append(tree.nodes["node_4"].choices[0].model_copy(update={"next_node_id": "missing"}))
+    tree.metadata = {"npc": "Старый мудрец"}
+    path = tmp_path / "dialog.npcd"
+
+    size = write_dialog_pack(ContentGenerationResponse(dialog_tree=tree), path)
+
+    with PackedDialogTree.open(path) as packed:
+        assert len(packed) == 15 and size == path.stat().st_size
+        assert packed.node_id(packed.root_index) == "node_0"
+        idx = packed.node_index("node_1")
+        assert packed.npc_text(idx) == "Реплика мудреца в node_1"
+        assert packed.choices(idx) == [
+            ("Перейти к node_3", packed.node_index("node_3")),
+            ("Перейти к node_4", packed.node_index("node_4")),
+        ]
+        assert packed.choices(packed.node_index("node_4"))[-1][1] == NONE
+        assert packed.to_dialog_tree() == tree
+
+
+def test_pack_interns_repeated_strings():
+    tree = make_dialog_tree(31)
+    for node in tree.nodes.values():
+        node.npc_text = "Одна и та же реплика"
+
+    assert len(pack_dialog_tree(tree)) < len(pack_dialog_tree(make_dialog_tree(31)))
@@ -0,0 +1,55 @@
+import pytest
+
+from app.runtime import END, DialogRuntime, DialogStateMachine
+from app.schemas import Choice
+from tests.factories import make_dialog_tree
+
+
+def test_runtime_follows_choices_and_loop_backs():
+    tree = make_dialog_tree(7)
+    tree.nodes["node_3"].choices = [
+        Choice(text="Вернуться к началу", next_node_id="node_0"),
+        Choice(text="Уйти", next_node_id="nowhere"),
+    ]
+    runtime = DialogRuntime(DialogStateMachine.compile(tree))
+    machine = runtime.machine
+
+    session = runtime.start()
+    assert runtime.choices(session) == ("Перейти к node_1", "Перейти к node_2")
+    assert runtime.choose(session, 0) == machine.index("node_1")
+    runtime.choose(session, 0)
+    assert runtime.choose(session, 0) == machine.root
+    assert runtime.npc_text(session) == "Реплика мудреца в node_0"
+    assert runtime.turns(session) == 3
+
+    runtime.choose(session, 1)
+    assert runtime.choose(session, 1) == machine.index("node_6")
+    assert runtime.is_finished(session)
+    with pytest.raises(IndexError):
+        runtime.choose(session, 0)
+
+    other = runtime.start("node_3")
+    assert runtime.choose(other, 1) == END and runtime.is_finished(other)
+
+    runtime.end(session)
+    assert runtime.start() == session and runtime.active_sessions == 2
+    with pytest.raises(AttributeError):
+        machine.root = 1
+
+
+def test_repeated_end_does_not_hand_out_slot_twice():
+    runtime = DialogRuntime(DialogStateMachine.compile(make_dialog_tree(7)))
+    first, second = runtime.start(), runtime.start()
+
+    runtime.end(first)
+    with pytest.raises(ValueError):
+        runtime.end(first)
+    with pytest.raises(ValueError):
+        runtime.end(42)
+    assert runtime.active_sessions == 1
+
+    reused, fresh = runtime.start(), runtime.start()
+    assert reused == first and fresh not in (first, second)
+    assert runtime.active_sessions == 3
+    runtime.end(reused)
+    assert runtime.active_sessions == 2
@@ -0,0 +1,72 @@
+import asyncio
+import io
+
+from app.schemas import ContentGenerationRequest
+from app.services import ContentWriter, JobQueue, QueueWorker, assemble, stream_batch, submit_content
+from app.utils import DialogStreamWriter, iter_nodes, iter_npcs, iter_records, load_tree
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+
+def _setup(n_nodes=15, delay=0.0):
+    structure = make_structure_tree(n_nodes)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+    writer = ContentWriter()
+    writer.llm = FakeContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()}, delay=delay)
+    return request, writer
+
+
+def test_streamed_npcs_interleave_and_read_back_lazily(tmp_path):
+    request, writer = _setup(delay=0.001)
+    path = tmp_path / "batch.ndjson"
+
+    async def run():
+        with DialogStreamWriter(path) as stream:
+            await asyncio.gather(*(
+                writer.stream_dialog_tree(request, stream, npc_id, max_concurrency=4) for npc_id in ("a", "b")
+            ))
+
+    asyncio.run(run())
+    expected = asyncio.run(writer.fill_dialog_tree(request)).dialog_tree
+
+    npc_ids = [r["npc_id"] for r in iter_records(path) if r["type"] == "node"]
+    assert npc_ids != sorted(npc_ids)  # записи двух NPC чередуются
+    assert [(r["npc_id"], r["n_nodes"], r["unfilled_node_ids"]) for r in iter_npcs(path)] in (
+        [("a", 15, []), ("b", 15, [])], [("b", 15, []), ("a", 15, [])]
+    )
+    assert sum(1 for _ in iter_nodes(path, npc_id="b")) == 15
+    assert load_tree(path, "a") == expected
+    assert load_tree(path, "missing") is None
+
+
+def test_deadline_writes_partial_npc():
+    request, writer = _setup(delay=0.1)
+    buffer = io.StringIO()
+    stream = DialogStreamWriter(buffer)
+    unfilled = asyncio.run(writer.stream_dialog_tree(request, stream, "slow", max_concurrency=8, timeout=0.15))
+    buffer.seek(0)
+
+    end, = iter_npcs(buffer)
+    assert unfilled and end["unfilled_node_ids"] == unfilled and end["n_nodes"] == 15
+    buffer.seek(0)
+    tree = load_tree(buffer, "slow")
+    assert {n for n, node in tree.nodes.items() if not node.npc_text} == set(unfilled)
+
+
+def test_reader_skips_unfinished_tail_line():
+    buffer = io.StringIO('{"type": "end", "npc_id": "a", "n_nodes": 0, "unfilled_node_ids": []}\n{"type": "no')
+    assert [r["npc_id"] for r in iter_records(buffer)] == ["a"]
+
+
+def test_stream_batch_writes_finished_jobs(tmp_path):
+    request, writer = _setup(n_nodes=7)
+    with JobQueue(tmp_path / "queue.db") as queue:
+        job_id = submit_content(queue, request, batch_id="drop")
+        buffer = io.StringIO()
+        assert stream_batch(queue, "drop", DialogStreamWriter(buffer)) == [job_id]
+
+        asyncio.run(QueueWorker(queue, concurrency=2, poll_interval=0.01, content_writer=writer).run(stop_when_idle=True))
+        buffer = io.StringIO()
+        assert stream_batch(queue, "drop", DialogStreamWriter(buffer)) == []
+        buffer.seek(0)
+        assert load_tree(buffer, job_id) == assemble(queue, job_id).dialog_tree
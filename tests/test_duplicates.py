@@ -0,0 +1,75 @@
+import asyncio
+
+from app.schemas import Choice, ContentGenerationRequest
+from app.services import ContentWriter, CorpusStore, DuplicateDetector
+from app.utils import MinHasher, estimate_jaccard, shingles
+from app.utils.minhash import jaccard
+from tests.factories import make_character, make_goal, make_structure_tree, make_dialog_tree
+from tests.fake_llm import FakeContentLLM
+
+LINES = [
+    "Ты пришёл за письмом? Я храню его уже много лет и не отдам первому встречному.",
+    "Давным-давно в этих горах жил мастер, который ковал мечи для самого короля.",
+    "Мой сад полон редких трав, но без дождя они погибнут к концу лета.",
+    "Говорят, у старой мельницы по ночам слышна музыка, хотя там давно никто не живёт.",
+    "Прежде чем я отвечу, скажи мне, откуда ты родом и кто тебя сюда прислал.",
+    "Караван ушёл на рассвете, и с ним пропали все карты южных земель.",
+    "Я научу тебя читать звёзды, если ты принесёшь мне перо белой совы.",
+]
+
+
+def _tree():
+    tree = make_dialog_tree(7)
+    for node, line in zip(tree.nodes.values(), LINES):
+        node.npc_text, node.choices = line, []
+    return tree
+
+
+def test_minhash_estimate_tracks_exact_jaccard():
+    hasher = MinHasher(num_perm=128)
+    a, b = LINES[0], "Ты пришел за письмом?! Я храню его много лет и не отдам первому встречному..."
+    exact = jaccard(shingles(a), shingles(b))
+    assert abs(estimate_jaccard(hasher.signature(a), hasher.signature(b)) - exact) < 0.15
+    assert estimate_jaccard(hasher.signature(a), hasher.signature(LINES[1])) < 0.2
+
+
+def test_flags_near_duplicates_within_tree_and_choices():
+    tree = _tree()
+    detector = DuplicateDetector()
+    assert detector.find_in_tree(tree) == []
+
+    tree.nodes["node_5"].npc_text = "Ты пришел за письмом! Я храню его уже много лет и не отдам первому встречному"
+    tree.nodes["node_2"].choices = [
+        Choice(text="Расскажи мне о мастере мечей", next_node_id="node_5"),
+        Choice(text="Расскажи мне о мастере мечей!", next_node_id="node_6"),
+    ]
+    matches = detector.find_in_tree(tree)
+    assert {(m.node_id, m.field, m.other_node_id) for m in matches} == {
+        ("node_5", "npc_text", "node_0"), ("node_2", "choices", "node_2")
+    }
+
+
+def test_flags_against_corpus_and_regenerates(tmp_path):
+    stored = _tree()
+    with CorpusStore(tmp_path / "corpus.db") as store:
+        store.put_tree(stored)
+        detector = DuplicateDetector()
+        assert detector.index_corpus(store) == len(LINES)
+        assert detector.index_corpus(store) == 0
+
+    structure = make_structure_tree(7)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+    tree = make_dialog_tree(7)
+    for node in tree.nodes.values():
+        node.npc_text, node.choices = "", []
+    tree.nodes["node_4"].npc_text = LINES[3].upper()
+    matches = detector.find_in_corpus(tree)
+    assert [(m.node_id, m.other_node_id) for m in matches] == [("node_4", "node_3")]
+
+    writer = ContentWriter()
+    writer.llm = FakeContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()})
+    fixed = asyncio.run(writer.regenerate_nodes(request, tree, detector.flagged_nodes(tree), max_concurrency=2))
+    assert writer.llm.calls == 1
+    assert fixed.nodes["node_4"].npc_text == "Реплика для node_4"
+    assert fixed.nodes["node_3"] == tree.nodes["node_3"]
+    assert detector.find_in_corpus(fixed) == []
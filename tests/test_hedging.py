@@ -0,0 +1,55 @@
+import asyncio
+
+from app.services import LLMClient, latency_tracker
+from app.utils import LLMConfig
+from tests.fake_llm import FakeCompletions, fake_openai
+
+
+def _client(primary, hedge, model):
+    config = LLMConfig(api_key="-", model=model, hedge_quantile=0.9, hedge_min_delay=0.01, hedge_min_samples=3)
+    client = LLMClient(config=config, hedge_config=config.model_copy(update={"model": f"{model}-fallback"}))
+    client.backends.backends[0].client, client.hedge_backend.client = fake_openai(primary), fake_openai(hedge)
+    return client
+
+
+def test_hedge_fires_after_threshold_and_cancels_loser():
+    primary, hedge = FakeCompletions([0.0, 0.0, 0.0, 5.0]), FakeCompletions([0.01])
+    client = _client(primary, hedge, model="hedge-test")
+
+    async def run():
+        for _ in range(4):
+            result = await client.generate_structured_output("prompt")
+        return result
+
+    assert asyncio.run(run()) == {"npc_text": "ok"}
+    assert primary.cancelled == 1 and hedge.started == 1
+    metrics = client.hedge_metrics
+    assert (metrics.requests, metrics.hedged, metrics.hedge_wins, metrics.primary_wins) == (4, 1, 1, 3)
+    assert metrics.hedge_rate == 0.25
+    # отмененный основной запрос не попадает в окно задержек
+    assert latency_tracker.quantile(("hedge-test", "base"), 0.9, min_samples=4) is None
+
+
+def test_no_hedge_without_latency_samples():
+    primary, hedge = FakeCompletions([0.05]), FakeCompletions([])
+    client = _client(primary, hedge, model="cold-model")
+
+    assert asyncio.run(client.chat([{"role": "user", "content": "?"}])) == '{"npc_text": "ok"}'
+    assert hedge.started == 0 and client.hedge_metrics.hedged == 0
+    assert latency_tracker.quantile(("cold-model", "base"), 0.5) >= 0.05
+
+
+def test_no_hedge_into_the_only_backend():
+    config = LLMConfig(api_key="-", model="single", hedge_quantile=0.9, hedge_min_delay=0.01, hedge_min_samples=3)
+    client = LLMClient(config=config)
+    client.hedge_backend = None
+    primary = FakeCompletions([0.0, 0.0, 0.0, 0.05])
+    client.backends.backends[0].client = fake_openai(primary)
+
+    async def run():
+        for _ in range(4):
+            await client.generate_structured_output("prompt")
+
+    asyncio.run(run())
+    assert primary.started == 4 and primary.cancelled == 0
+    assert client.hedge_metrics.hedged == 0
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+from app.schemas import Choice
+from app.services import Localizer, TranslationMemory
+from app.utils import estimate_tokens, plan_max_tokens
+from tests.factories import make_character, make_dialog_tree
+
+
+class FakeTranslator:
+    """
+    Переводит строки пакета префиксом локали; drop - строки, которые в первый раз пропускаются,
+    fail - строки, пакет с которыми падает (в первый раз для локали или всегда при fail_always)
+    """
+
+    def __init__(self, delay=0.0, drop=(), fail=(), fail_always=False):
+        self.delay, self.drop, self.batches = delay, set(drop), []
+        self.fail, self.fail_always, self.failed = set(fail), fail_always, set()
+
+    def max_tokens_for(self, prompt, expected_output):
+        return plan_max_tokens(estimate_tokens(prompt), expected_output, 65536, 8192)
+
+    async def generate(self, prompt, **kwargs):
+        locale = re.search(r"с кодом \*\*(\S+)\*\*", prompt).group(1)
+        strings = json.loads(prompt.split("```json\n", 1)[1].split("\n```", 1)[0])
+        self.batches.append((locale, list(strings.values())))
+        await asyncio.sleep(self.delay)
+        failing = {(locale, text) for text in self.fail & set(strings.values())}
+        if failing and (self.fail_always or not failing <= self.failed):
+            self.failed |= failing
+            raise RuntimeError("LLM API error: upstream")
+        translations = {}
+        for key, text in strings.items():
+            if text in self.drop:
+                self.drop.discard(text)
+                continue
+            translations[key] = f"[{locale}] {text}"
+        return {"translations": translations}
+
+
+def _trees():
+    first, second = make_dialog_tree(7), make_dialog_tree(7)
+    second.nodes["node_0"].npc_text = "Другая реплика"
+    second.nodes["node_0"].choices = [Choice(text="Перейти к node_1", next_node_id="node_1")]
+    return [first, second]
+
+
+def test_localize_dedups_strings_and_uses_translation_memory():
+    trees = _trees()
+    localizer = Localizer(max_batch_strings=4, max_concurrency=3)
+    localizer.llm = FakeTranslator()
+
+    strings = localizer.collect_strings(trees)
+    assert len(strings) == 7 + 6 + 1
+    assert all(len(batch) <= 4 for batch in localizer.batches(strings))
+
+    result = asyncio.run(localizer.localize(trees, ["en", "de"], character=make_character()))
+    translated = [text for _, batch in localizer.llm.batches for text in batch]
+    assert sorted(translated) == sorted(strings * 2)
+
+    en = result["en"][1]
+    assert en.metadata["locale"] == "en"
+    assert en.nodes["node_0"].npc_text == "[en] Другая реплика"
+    assert en.nodes["node_1"].choices[0].text == "[en] Перейти к node_3"
+    assert en.nodes["node_1"].choices[0].next_node_id == "node_3"
+    assert trees[1].nodes["node_0"].npc_text == "Другая реплика"
+
+    localizer.llm = FakeTranslator()
+    trees[0].nodes["node_2"].npc_text = "Новая реплика"
+    asyncio.run(localizer.localize(trees, ["en"]))
+    assert localizer.llm.batches == [("en", ["Новая реплика"])]
+
+
+def test_missing_translations_are_retried(tmp_path):
+    trees = _trees()
+    with TranslationMemory(tmp_path / "tm.db") as memory:
+        localizer = Localizer(memory=memory)
+        localizer.llm = FakeTranslator(drop={"Другая реплика"})
+        result = asyncio.run(localizer.localize(trees, ["fr"]))
+        assert result["fr"][1].nodes["node_0"].npc_text == "[fr] Другая реплика"
+        assert localizer.llm.batches[-1] == ("fr", ["Другая реплика"])
+        assert memory.count("fr") == 14
+
+
+def test_failed_batch_is_retried_without_aborting_others():
+    trees = _trees()
+    localizer = Localizer(max_batch_strings=4, max_concurrency=4)
+    localizer.llm = FakeTranslator(fail={"Другая реплика"})
+    result = asyncio.run(localizer.localize(trees, ["en", "de"]))
+
+    # упал один пакет каждой локали, остальные переведены в первом круге
+    first_round = localizer.llm.batches[:2 * len(localizer.batches(localizer.collect_strings(trees)))]
+    retried = localizer.llm.batches[len(first_round):]
+    assert sorted(locale for locale, _ in retried) == ["de", "en"]
+    assert all("Другая реплика" in batch for _, batch in retried)
+    assert result["de"][1].nodes["node_0"].npc_text == "[de] Другая реплика"
+    assert localizer.memory.count("en") == 14
+
+    localizer = Localizer(max_batch_strings=4)
+    localizer.llm = FakeTranslator(fail={"Другая реплика"}, fail_always=True)
+    (failing,) = [batch for batch in localizer.batches(localizer.collect_strings(trees)) if "Другая реплика" in batch]
+    with pytest.raises(ValueError, match=f"No translation into en for {len(failing)} strings") as error:
+        asyncio.run(localizer.localize(trees, ["en"]))
+    assert isinstance(error.value.__cause__, RuntimeError)
+    assert localizer.memory.count("en") == 14 - len(failing)
+
+
+def test_batches_run_concurrently():
+    trees = [make_dialog_tree(31)]
+    localizer = Localizer(max_batch_strings=8, max_concurrency=8)
+    localizer.llm = FakeTranslator(delay=0.05)
+
+    async def timed():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await localizer.localize(trees, ["en"])
+        return loop.time() - start
+
+    elapsed = asyncio.run(timed())
+    assert len(localizer.llm.batches) >= 4
+    assert elapsed < 0.05 * len(localizer.llm.batches) / 2
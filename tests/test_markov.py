@@ -0,0 +1,94 @@
+import random
+
+import numpy as np
+
+from app.schemas import BranchType, Choice, DialogNode, DialogTree, NodeMetadata, TreeGenerationRequest
+from app.services import CorpusStore, analyze_chains, analyze_corpus_chains
+from app.runtime import DialogStateMachine
+from app.utils import UNTYPED
+from tests.factories import make_character, make_constraints, make_dialog_tree, make_goal
+
+
+def _tree(choices, branch=None, goal=None, root="a"):
+    """Заполненное дерево из переходов {нода: [next_node_id вариантов]}"""
+    nodes = {
+        node_id: DialogNode(
+            node_id=node_id,
+            metadata=NodeMetadata(branch_type=(branch or {}).get(node_id, BranchType.MAIN_PATH)),
+            narrative_summary=node_id,
+            player_goal_hint=node_id,
+            npc_text=node_id,
+            choices=[Choice(text=f"{node_id} -> {target}", next_node_id=target) for target in targets],
+        )
+        for node_id, targets in choices.items()
+    }
+    return DialogTree(root_node_id=root, nodes=nodes, goal_achievement_paths=[[root, goal]] if goal else [])
+
+
+def test_absorption_probabilities_and_expected_turns():
+    # из a: к цели g, в тупик d или снова в a (петля)
+    looped = _tree({"a": ["g", "d", "a"], "g": [], "d": []}, goal="g")
+    # b ведет в отсутствующую ноду, c и e образуют замкнутую петлю, u недостижима
+    trapped = _tree({"a": ["b", "c"], "b": ["g", "missing"], "c": ["e"], "e": ["c"], "g": [], "u": ["g"]}, goal="g")
+
+    report = analyze_chains([looped, trapped])
+    looped_row, trapped_row = report.rows()
+
+    assert np.isclose(looped_row["p_goal"], 0.5) and np.isclose(looped_row["p_dead_end"], 0.5)
+    assert np.isclose(looped_row["expected_turns"], 1.5)
+    assert np.isclose(trapped_row["p_goal"], 0.25)
+    assert np.isclose(trapped_row["p_dead_end"], 0.25)
+    assert np.isclose(trapped_row["p_trapped"], 0.5)
+    assert np.isclose(trapped_row["expected_turns"], 1.5)
+    assert report.unreachable == [[], ["u"]]
+
+
+def test_weighted_policy_prefers_branch_types():
+    tree = _tree(
+        {"a": ["m", "x"], "m": ["g"], "x": [], "g": []},
+        branch={"m": BranchType.MAIN_PATH, "x": BranchType.DEAD_END}, goal="g"
+    )
+    (row,) = analyze_chains([tree], policy={"main": 3.0, "dead_end": 1.0}).rows()
+    assert np.isclose(row["p_goal"], 0.75) and np.isclose(row["p_dead_end"], 0.25)
+    assert np.isclose(row["expected_turns"], 1.75)
+
+    # нода без типа ветки не получает вес основной линии: по умолчанию ее вес нулевой
+    tree.nodes["x"].metadata = None
+    (row,) = analyze_chains([tree], policy={"main": 3.0, "dead_end": 1.0}).rows()
+    assert np.isclose(row["p_goal"], 1.0)
+    (row,) = analyze_chains([tree], policy={"main": 3.0, UNTYPED: 1.0}).rows()
+    assert np.isclose(row["p_goal"], 0.75)
+
+
+def test_matches_random_playthroughs():
+    tree = make_dialog_tree(15)
+    # петля из листа обратно в корень и выбор в отсутствующую ноду
+    tree.nodes["node_14"].choices = [Choice(text="назад", next_node_id="node_0"), Choice(text="уйти", next_node_id="gone")]
+    (row,) = analyze_chains([tree]).rows()
+
+    machine = DialogStateMachine.compile(tree)
+    goal = machine.index(tree.goal_achievement_paths[0][-1])
+    rng, goals, turns, runs = random.Random(3), 0, 0, 20000
+    for _ in range(runs):
+        node = machine.root
+        while node != goal and not machine.is_terminal(node):
+            node = machine.step(node, rng.randrange(len(machine.transitions[node])))
+            turns += 1
+        goals += node == goal
+
+    assert abs(goals / runs - row["p_goal"]) < 0.02
+    assert abs(turns / runs - row["expected_turns"]) < 0.05
+    assert np.isclose(row["p_goal"] + row["p_dead_end"] + row["p_trapped"], 1.0)
+
+
+def test_corpus_batch(tmp_path):
+    request = TreeGenerationRequest(character=make_character(), goal=make_goal(), constraints=make_constraints())
+    with CorpusStore(tmp_path / "corpus.db") as store:
+        hashes = [store.put_tree(make_dialog_tree(n), request) for n in (7, 15, 31)]
+        report = analyze_corpus_chains(store)
+
+    assert report.keys == hashes
+    # без петель путь к цели - один лист из 2^(depth-1)
+    assert np.allclose(report.columns["p_goal"], [1 / 4, 1 / 8, 1 / 16])
+    assert np.allclose(report.columns["expected_turns"], [2, 3, 4])
+    assert report.columns["n_unreachable"].tolist() == [0, 0, 0]
@@ -0,0 +1,23 @@
+from app.schemas import (
+    Constraints, DialogNode, TreeGenerationRequest, ContentGenerationRequest
+)
+from tests.factories import (
+    make_character, make_goal, make_constraints, make_structure_tree, make_dialog_tree
+)
+from tests.prompt_reference import as_prompt_reflective
+
+
+def test_as_prompt_matches_reflective_renderer():
+    character, goal = make_character(), make_goal()
+    models = [
+        character, goal, make_constraints(), Constraints(),
+        TreeGenerationRequest(character=character, goal=goal, constraints=make_constraints()),
+        ContentGenerationRequest(character=character, goal=goal, dialog_tree=make_structure_tree(7)),
+        make_dialog_tree(7),
+        DialogNode(node_id="node_1", metadata=None, narrative_summary="", player_goal_hint="..."),
+        *make_dialog_tree(7).nodes.values(),
+    ]
+
+    for model in models:
+        for exclude_none in (True, False):
+            assert model.as_prompt(exclude_none=exclude_none) == as_prompt_reflective(model, exclude_none=exclude_none)
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from app.services import Backend, BackendPool, LLMClient
+from app.utils import LLMConfig
+from tests.fake_llm import FakeCompletions, fake_openai
+
+
+class FailingCompletions:
+    """chat.completions, который всегда отвечает ошибкой API"""
+
+    async def create(self, **kwargs):
+        raise ConnectionError("connection reset")
+
+
+def _pool(*weights, clock=lambda: 0.0):
+    return BackendPool(
+        [Backend(LLMConfig(api_key="-", model=f"m{i}", weight=w)) for i, w in enumerate(weights)],
+        max_errors=2, cooldown=10.0, clock=clock
+    )
+
+
+def test_select_least_loaded_by_weight_and_skip_slow():
+    pool = _pool(1.0, 2.0, 1.0)
+    a, b, c = pool.backends
+    a.in_flight, b.in_flight, c.in_flight = 1, 2, 2
+    assert pool.select() is b          # (2 + 1) / 2 < (1 + 1) / 1
+    a.in_flight = 0
+    assert pool.select() is a
+    a.latency, b.latency, c.latency = 10.0, 1.0, 1.0
+    assert pool.select() is b          # медленный a получает штраф
+    assert pool.select(exclude=[a, b, c]) is None
+
+
+def test_unhealthy_backend_leaves_rotation_until_cooldown():
+    now = [0.0]
+    pool = _pool(1.0, 1.0, clock=lambda: now[0])
+    a, b = pool.backends
+    for _ in range(2):
+        pool.started(a)
+        pool.failed(a)
+    assert not pool.is_healthy(a) and pool.select() is b
+    now[0] = 11.0
+    assert pool.is_healthy(a)
+
+
+def test_client_fails_over_to_next_backend():
+    client = LLMClient(
+        config=LLMConfig(api_key="-", model="broken"),
+        pool=[LLMConfig(api_key="-", model="working")]
+    )
+    broken, working = client.backends.backends
+    broken.client = fake_openai(FakeCompletions([0.0], content="not json"))
+    working.client = fake_openai(FakeCompletions([0.0]))
+
+    assert asyncio.run(client.generate_structured_output("prompt")) == {"npc_text": "ok"}
+    # неразборчивый ответ - не отказ бэкенда
+    assert broken.consecutive_errors == 0 and working.in_flight == 0
+
+    client = LLMClient(
+        config=LLMConfig(api_key="-", model="broken"),
+        pool=[LLMConfig(api_key="-", model="working")]
+    )
+    broken, working = client.backends.backends
+    broken.client = fake_openai(FailingCompletions())
+    working.client = fake_openai(FakeCompletions([0.0]))
+    assert asyncio.run(client.generate_structured_output("prompt")) == {"npc_text": "ok"}
+    assert broken.consecutive_errors == 1 and broken.in_flight == 0
+
+
+def test_weight_must_be_positive():
+    for weight in (0.0, -1.0):
+        with pytest.raises(ValidationError):
+            LLMConfig(api_key="-", weight=weight)
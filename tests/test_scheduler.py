@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.schemas import BranchType, ContentGenerationRequest
+from app.services import ContentWriter, PriorityNodeScheduler
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+
+def test_scheduler_puts_main_path_first_and_dead_ends_last():
+    tree = make_structure_tree(15)
+    tiers = PriorityNodeScheduler(tree).tiers
+
+    goal_path = tree.goal_achievement_paths[0]
+    assert set(goal_path) <= set(tiers[0])
+    assert all(tree.nodes[n].metadata.branch_type == BranchType.DEAD_END for n in tiers[-1] if n not in goal_path)
+    assert sorted(n for tier in tiers for n in tier) == sorted(tree.nodes)
+
+
+def test_fill_yields_playable_main_path_before_optional_branches():
+    structure = make_structure_tree(15)
+    writer = ContentWriter()
+    writer.llm = FakeContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()}, delay=0.001)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+
+    async def collect():
+        return [r async for r in writer.fill_in_priority_order(request, max_concurrency=4)]
+
+    partials = asyncio.run(collect())
+    main_tier = PriorityNodeScheduler(structure).tiers[0]
+    first = partials[0].dialog_tree.nodes
+
+    assert all(first[n].npc_text for n in main_tier)
+    assert any(not node.npc_text for node in first.values())
+    assert all(node.npc_text for node in partials[-1].dialog_tree.nodes.values())
+
+
+def test_error_cancels_and_awaits_remaining_workers():
+    tree = make_structure_tree(15)
+    scheduler = PriorityNodeScheduler(tree, max_concurrency=4)
+    started, cleaned = [], []
+
+    async def worker(node_id):
+        started.append(node_id)
+        if len(started) == 4:
+            raise RuntimeError("boom")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            cleaned.append(node_id)
+
+    async def run():
+        with pytest.raises(RuntimeError, match="boom"):
+            async for _ in scheduler.run(worker):
+                pass
+        # очистка отмененных worker завершена к моменту выхода из run
+        return list(cleaned)
+
+    assert sorted(asyncio.run(run())) == sorted(started[:3])
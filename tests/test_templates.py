@@ -0,0 +1,114 @@
+import asyncio
+
+from app.schemas import StructureConstraints, TreeGenerationRequest, TreeValidationResponse
+from app.services import CorpusStore, TemplateLibrary, TreeGenerator
+from app.utils import estimate_tokens, plan_max_tokens
+from tests.factories import make_character, make_goal, make_structure_tree
+
+
+class ScriptedTreeLLM:
+    """Отдает заранее заданные ответы по порядку и запоминает промпты"""
+
+    def __init__(self, *responses):
+        self.responses, self.prompts = list(responses), []
+
+    def max_tokens_for(self, prompt, expected_output):
+        return plan_max_tokens(estimate_tokens(prompt), expected_output, 65536, 8192)
+
+    async def generate(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return self.responses.pop(0)
+
+
+def _request(**constraints):
+    return TreeGenerationRequest(
+        character=make_character(), goal=make_goal(), constraints=StructureConstraints(**constraints)
+    )
+
+
+def _themes(tree, skip=()):
+    return {"nodes": {
+        node_id: {"narrative_summary": f"Новое событие {node_id}", "player_goal_hint": f"Новая цель {node_id}"}
+        for node_id in tree.nodes if node_id not in skip
+    }}
+
+
+def test_match_picks_closest_fitting_skeleton():
+    library = TemplateLibrary()
+    small = library.add(_request(max_turns=3), make_structure_tree(7))
+    large = library.add(_request(max_turns=5), make_structure_tree(31))
+
+    assert (small.depth, large.depth) == (3, 5)
+    assert library.match(_request(max_turns=5)) is large
+    assert library.match(_request(max_turns=4)) is small
+    assert library.match(_request(max_turns=2)) is None
+    assert library.match(_request(max_turns=5, max_choices=1)) is None
+
+    # скелет глубины 3 с ветвлением 2 не годится для длинных сюжетов с широким выбором
+    assert library.match(_request(max_turns=8, min_turns=8)) is None
+    assert library.match(_request(max_turns=5, min_choices=3)) is None
+    assert library.match(_request(max_turns=5, n_storylines=64)) is None
+
+    other_goal = _request(max_turns=5)
+    other_goal.goal.goal_type = "escort"
+    assert library.match(other_goal) is None
+
+
+def test_generator_rethemes_skeleton_in_one_call(tmp_path):
+    skeleton = make_structure_tree(15)
+    with CorpusStore(tmp_path / "corpus.db") as store:
+        tree_hash = store.put_tree(skeleton, _request())
+        store.put_validation(tree_hash, TreeValidationResponse(scores={"a": 5}, comments={}, is_valid=True))
+        library = TemplateLibrary.from_corpus(store)
+
+    generator = TreeGenerator(templates=library)
+    generator.llm = ScriptedTreeLLM(_themes(skeleton))
+    tree = asyncio.run(generator.generate_structure_tree(_request())).dialog_tree
+
+    assert len(generator.llm.prompts) == 1 and "node_14 [dead_end]" in generator.llm.prompts[0]
+    assert tree.nodes["node_3"].narrative_summary == "Новое событие node_3"
+    assert tree.nodes["node_3"].player_goal_hint == "Новая цель node_3"
+    assert {k: n.child_node_ids for k, n in tree.nodes.items()} == {k: n.child_node_ids for k, n in skeleton.nodes.items()}
+    assert tree.goal_achievement_paths == skeleton.goal_achievement_paths
+
+    # шаблон библиотеки не меняется вместе с выданным деревом
+    tree.nodes["node_0"].child_node_ids.append("node_99")
+    tree.goal_achievement_paths[0].append("node_99")
+    template = library.match(_request())
+    assert "node_99" not in template.tree.nodes["node_0"].child_node_ids
+    assert "node_99" not in template.tree.goal_achievement_paths[0]
+
+
+def test_incomplete_retheme_falls_back_to_full_generation():
+    skeleton = make_structure_tree(7)
+    library = TemplateLibrary()
+    library.add(_request(), skeleton)
+
+    malformed = _themes(skeleton)
+    del malformed["nodes"]["node_2"]["player_goal_hint"]
+    for response in (_themes(skeleton, skip={"node_6"}), malformed):
+        generated = make_structure_tree(3).model_dump(mode="json")
+        generator = TreeGenerator(templates=library)
+        generator.llm = ScriptedTreeLLM(response, generated)
+        tree = asyncio.run(generator.generate_structure_tree(_request())).dialog_tree
+
+        assert len(generator.llm.prompts) == 2
+        assert sorted(tree.nodes) == ["node_0", "node_1", "node_2"]
+
+
+def test_distant_template_is_not_reused():
+    skeleton = make_structure_tree(7)
+    library = TemplateLibrary()
+    library.add(_request(max_turns=3), skeleton)
+    far = _request(max_turns=9, max_choices=6)
+
+    # скелет подходит по жестким ограничениям, но слишком далек от запроса
+    assert library.match(far) is not None
+    generated = make_structure_tree(3).model_dump(mode="json")
+    generator = TreeGenerator(templates=library, max_template_distance=3.0)
+    generator.llm = ScriptedTreeLLM(generated)
+    tree = asyncio.run(generator.generate_structure_tree(far)).dialog_tree
+
+    assert len(generator.llm.prompts) == 1 and "node_0 [" not in generator.llm.prompts[0]
+    assert sorted(tree.nodes) == ["node_0", "node_1", "node_2"]
+    assert TreeGenerator(templates=library, max_template_distance=None).match_template(far) is not None
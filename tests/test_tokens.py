@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app.schemas import ContentGenerationRequest, StructureConstraints
+from app.services import ContentWriter
+from app.utils import (
+    PromptFactory, PromptTooLargeError, estimate_tokens, plan_max_tokens, expected_node_output, expected_tree_output
+)
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+
+def test_estimate_tokens_counts_words_and_punctuation():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hello") == 2
+    assert estimate_tokens("Привет, мир!") == 2 + 1 + 1 + 1
+    assert estimate_tokens('{\n  "a": 1\n}') == 9
+
+
+def test_plan_max_tokens_follows_expected_output():
+    structure = make_structure_tree(7)
+    short, wide = structure.nodes["node_6"], structure.nodes["node_0"]
+    assert expected_node_output(short) < expected_node_output(wide)
+    assert plan_max_tokens(1000, expected_node_output(short), 65536, 4096) < 4096
+    assert expected_tree_output(StructureConstraints(max_turns=8)) > expected_tree_output(StructureConstraints())
+    with pytest.raises(PromptTooLargeError):
+        plan_max_tokens(65000, 1000, 65536, 4096)
+
+
+def test_content_writer_compacts_prompt_that_does_not_fit():
+    structure = make_structure_tree(15)
+    llm = FakeContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()})
+    writer = ContentWriter()
+    writer.llm = llm
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+    node = structure.nodes["node_14"]
+
+    prompt = PromptFactory.build_prompt("node_content", current_node=node, request=request)
+    full_prompt_tokens = estimate_tokens(prompt)
+    llm.context_window = full_prompt_tokens + expected_node_output(node) - 1
+
+    filled = asyncio.run(writer.generate_node(node, request))
+    assert filled.npc_text == "Реплика для node_14"
+    assert llm.max_tokens[-1] <= llm.context_window
+
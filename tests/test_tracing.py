@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+from app.schemas import ContentGenerationRequest
+from app.services import ContentWriter, LLMClient
+from app.utils import LLMConfig, span, tracing
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeCompletions, FakeContentLLM, fake_openai
+
+
+def test_concurrent_fill_spans_nest_per_task(tmp_path):
+    structure = make_structure_tree(7)
+    writer = ContentWriter()
+    writer.llm = FakeContentLLM({k: n.child_node_ids for k, n in structure.nodes.items()}, delay=0.001)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+
+    with tracing() as trace:
+        asyncio.run(writer.fill_dialog_tree(request, max_concurrency=3))
+
+    by_id = {s.span_id: s for s in trace.spans}
+    nodes = [s for s in trace.spans if s.name == "content.generate_node"]
+    assert sorted(s.attributes["node_id"] for s in nodes) == sorted(structure.nodes)
+    assert len({s.lane for s in nodes}) == 3
+    for s in trace.spans:
+        if s.name in ("prompt.build", "content.construct"):
+            assert by_id[s.parent_id].name == "content.generate_node"
+            assert by_id[s.parent_id].lane == s.lane
+
+    trace.write(tmp_path / "fill.json")
+    events = json.loads((tmp_path / "fill.json").read_text())["traceEvents"]
+    assert sum(e["ph"] == "X" for e in events) == len(trace.spans)
+
+    otlp = trace.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {s["spanId"] for s in otlp} >= {s["parentSpanId"] for s in otlp if s["parentSpanId"]}
+
+
+def test_client_hooks_and_llm_spans():
+    completions = FakeCompletions([0.0])
+    client = LLMClient(config=LLMConfig(api_key="-", model="trace-test"))
+    client.backends.backends[0].client = fake_openai(completions)
+    calls = []
+    client.add_hooks(
+        before=lambda c, messages: calls.append(("before", len(messages))),
+        after=lambda c, messages, result, error, elapsed: calls.append(("after", result, error)),
+    )
+
+    with tracing() as trace:
+        asyncio.run(client.generate_structured_output("prompt"))
+
+    assert calls == [("before", 1), ("after", {"npc_text": "ok"}, None)]
+    chat, request, parse = sorted(trace.spans, key=lambda s: s.span_id)
+    assert (chat.name, request.name, parse.name) == ("llm.chat", "llm.request", "llm.parse")
+    assert chat.attributes["model"] == "trace-test"
+
+
+def test_critical_path_follows_latest_children():
+    with tracing() as trace:
+        with span("root"):
+            with span("a"):
+                pass
+            with span("b"):
+                with span("b1"):
+                    pass
+    assert [s.name for s in trace.critical_path()] == ["root", "a", "b", "b1"]
+
+    with span("outside") as outside:
+        assert outside is None
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from app.schemas import ContentGenerationRequest
+from app.services import (
+    ContentWriter, JobQueue, QueueWorker, assemble, collect, failures, stream_batch, submit_content
+)
+from app.utils import DialogStreamWriter, iter_npcs
+from tests.factories import make_character, make_goal, make_structure_tree
+from tests.fake_llm import FakeContentLLM
+
+
+class BrokenNodeLLM(FakeContentLLM):
+    """Падает на заполнении нод broken"""
+
+    def __init__(self, children, broken):
+        super().__init__(children)
+        self.broken = set(broken)
+
+    async def generate(self, prompt, **kwargs):
+        if self.node_id(prompt) in self.broken:
+            raise RuntimeError("LLM API error: upstream")
+        return await super().generate(prompt, **kwargs)
+
+
+def _writer(structure, broken=()):
+    writer = ContentWriter()
+    writer.llm = BrokenNodeLLM({k: n.child_node_ids for k, n in structure.nodes.items()}, broken)
+    return writer
+
+
+def test_expired_lease_is_handed_to_another_worker(tmp_path):
+    with JobQueue(tmp_path / "queue.db") as queue:
+        job_id = queue.enqueue("node", {"node_id": "node_0"})
+        assert queue.lease("crashed", lease_seconds=-1).id == job_id
+        job = queue.lease("alive")
+        assert job.id == job_id and job.attempts == 2
+        assert not queue.heartbeat(job_id, "crashed") and not queue.complete(job_id, "crashed", {})
+        assert queue.complete(job_id, "alive", {"ok": True}) and queue.result(job_id) == {"ok": True}
+
+
+def test_expired_lease_is_not_reissued_after_max_attempts(tmp_path):
+    with JobQueue(tmp_path / "queue.db") as queue:
+        job_id = queue.enqueue("node", {"node_id": "node_0"})
+        for attempt in (1, 2):
+            assert queue.lease(f"crashed-{attempt}", lease_seconds=-1, max_attempts=2).attempts == attempt
+        assert queue.lease("alive", max_attempts=2) is None
+        job = queue.job(job_id)
+        assert job["status"] == "failed" and job["error"] == "lease expired"
+        assert queue.counts() == {"pending": 0, "leased": 0, "done": 0, "failed": 1}
+
+
+def test_worker_fills_nodes_and_reassembles_response(tmp_path):
+    structure = make_structure_tree(7)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+
+    with JobQueue(tmp_path / "queue.db") as queue:
+        job_id = submit_content(queue, request, batch_id="drop-1")
+        assert assemble(queue, job_id) is None
+
+        worker = QueueWorker(queue, concurrency=3, poll_interval=0.01, content_writer=_writer(structure))
+        assert asyncio.run(worker.run(stop_when_idle=True)) == 8
+
+        response = collect(queue, "drop-1")[job_id]
+        assert queue.counts("drop-1")["done"] == 8
+        assert response.dialog_tree.nodes["node_2"].npc_text == "Реплика для node_2"
+        assert [c.next_node_id for c in response.dialog_tree.nodes["node_0"].choices] == ["node_1", "node_2"]
+
+
+def test_failed_node_job_yields_partial_response(tmp_path):
+    structure = make_structure_tree(7)
+    request = ContentGenerationRequest(character=make_character(), goal=make_goal(), dialog_tree=structure)
+
+    with JobQueue(tmp_path / "queue.db") as queue:
+        job_ids = [submit_content(queue, request, batch_id="drop-1") for _ in range(2)]
+        worker = QueueWorker(
+            queue, concurrency=3, poll_interval=0.01, max_attempts=2, request_cache_size=1,
+            content_writer=_writer(structure, broken={"node_3"})
+        )
+        asyncio.run(worker.run(stop_when_idle=True))
+
+        # node_3 исчерпал попытки у обоих NPC: результат готов, но частичный
+        assert len(worker._requests) == 1
+        assert queue.counts("drop-1") == {"pending": 0, "leased": 0, "done": 14, "failed": 2}
+        errors = failures(queue, "drop-1")
+        assert len(errors) == 2 and all("upstream" in error for error in errors.values())
+        for job_id, response in collect(queue, "drop-1").items():
+            assert response.unfilled_node_ids == ["node_3"]
+            assert not response.dialog_tree.nodes["node_3"].npc_text
+            assert response.dialog_tree.nodes["node_4"].npc_text == "Реплика для node_4"
+
+        path = tmp_path / "drop-1.jsonl"
+        with DialogStreamWriter(path) as stream:
+            assert stream_batch(queue, "drop-1", stream) == []
+        assert [npc["unfilled_node_ids"] for npc in iter_npcs(path)] == [["node_3"], ["node_3"]]
+
+
+def test_failed_npc_job_is_reported_not_pending(tmp_path):
+    with JobQueue(tmp_path / "queue.db") as queue:
+        job_id = queue.enqueue("npc", {"broken": True}, batch_id="drop-1")
+        worker = QueueWorker(queue, poll_interval=0.01, max_attempts=1, concurrency=1)
+        asyncio.run(worker.run(stop_when_idle=True))
+
+        assert list(failures(queue, "drop-1")) == [job_id]
+        assert collect(queue, "drop-1") == {}
+        with pytest.raises(RuntimeError, match="failed"):
+            assemble(queue, job_id)